@@ -0,0 +1,200 @@
+"""
+Parallel, incremental batch conversion of folders of SIMCAT dat files
+
+Files are spread across a process pool. A manifest in the output folder
+records the content hash, parser version and outputs of every converted
+file, so unchanged files are skipped when the batch is run again.
+
+Example:
+    python batch.py scenarios/ -o converted -f json parquet
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datfile import file_digest
+from dat_to_json import PARSER_VERSION
+from convert import FORMATS, convert_dat, output_paths
+from instrumentation import ParseStats
+
+MANIFEST_NAME = "manifest.json"
+
+
+def find_dat_files(inputs, out_dir):
+    """
+    Expand files and folders into (dat file, output folder) pairs. Files
+    found in folders keep their relative folder in the output, so scenarios
+    with the same file name do not clash
+    """
+    jobs = []
+    for path in inputs:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.[dD][aA][tT]")
+            for file_path in sorted(glob.glob(pattern, recursive=True)):
+                relative = os.path.relpath(os.path.dirname(file_path), path)
+                jobs.append((file_path, os.path.normpath(
+                    os.path.join(out_dir, relative))))
+        else:
+            jobs.append((path, out_dir))
+    return jobs
+
+
+def load_manifest(out_dir):
+    """
+    Load the manifest of a previous batch, or an empty one
+    """
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, out_dir):
+    """
+    Write the manifest, replacing the previous one in a single step
+    """
+    path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as outfile:
+        json.dump(manifest, outfile, indent=4, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(entry, digest, formats, bulk, file_out_dir, file_path):
+    """
+    Check a manifest entry against the current file, parser and outputs
+    """
+    if not entry or entry["digest"] != digest:
+        return False
+    if entry["parser_version"] != PARSER_VERSION or entry["bulk"] != bulk:
+        return False
+    if not set(formats) <= set(entry["formats"]):
+        return False
+    paths = output_paths(file_path, formats, file_out_dir)
+    return all(os.path.exists(path) for path in paths.values())
+
+
+def convert_job(file_path, file_out_dir, formats, bulk, entry, force):
+    """
+    Convert one dat file in a worker process. Never raises: failures are
+    returned so one bad file does not stop the batch. The parse statistics
+    of converted files are returned as a ParseStats summary
+    """
+    start = time.perf_counter()
+    result = {"file": file_path, "status": "converted", "error": None}
+    stats = ParseStats()
+    try:
+        digest = file_digest(file_path)
+        result["digest"] = digest
+        if not force and is_up_to_date(entry, digest, formats, bulk,
+                                       file_out_dir, file_path):
+            result["status"] = "skipped"
+        else:
+            result["outputs"] = convert_dat(file_path, formats, file_out_dir,
+                                            bulk, stats)
+            result["stats"] = stats.summary()
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = "".join(
+                traceback.format_exception_only(type(e), e)).strip()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def batch_convert(inputs, out_dir, formats=("json",), workers=None,
+                  bulk=False, force=False):
+    """
+    Convert every dat file in inputs (files or folders) into out_dir using a
+    process pool sized to the machine's cores by default. Returns a summary
+    with the number of converted, skipped and failed files, the errors and
+    the merged ParseStats summary of the converted files
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = load_manifest(out_dir)
+    jobs = find_dat_files(inputs, out_dir)
+    total = len(jobs)
+    summary = {"converted": 0, "skipped": 0, "failed": 0, "errors": {}}
+    stats = ParseStats()
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [
+                pool.submit(convert_job, file_path, file_out_dir, formats,
+                            bulk, manifest.get(os.path.abspath(file_path)),
+                            force)
+                for file_path, file_out_dir in jobs
+                ]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            status = result["status"]
+            summary[status] += 1
+            print(f"[{done}/{total}] {status} {result['file']} "
+                  f"({result['seconds']:.2f}s)")
+
+            key = os.path.abspath(result["file"])
+            if status == "failed":
+                summary["errors"][result["file"]] = result["error"]
+                print(f"    {result['error']}", file=sys.stderr)
+            elif status == "converted":
+                stats.merge(result["stats"])
+                manifest[key] = {
+                        "digest": result["digest"],
+                        "parser_version": PARSER_VERSION,
+                        "bulk": bulk,
+                        "formats": sorted(formats),
+                        "outputs": result["outputs"],
+                        }
+                # Saved as files finish, so an interrupted or crashed batch
+                # does not convert them again
+                save_manifest(manifest, out_dir)
+
+    summary["seconds"] = time.perf_counter() - start
+    summary["stats"] = stats.summary()
+
+    print(f"Converted {summary['converted']}, skipped {summary['skipped']}, "
+          f"failed {summary['failed']} of {total} files "
+          f"in {summary['seconds']:.1f}s")
+    for file_path, error in summary["errors"].items():
+        print(f"  {file_path}: {error}")
+
+    return summary
+
+
+def main(argv=None):
+    """
+    Batch convert the dat files and folders given in the command line
+    """
+    parser = argparse.ArgumentParser(
+            description="Convert folders of SIMCAT dat files in parallel")
+    parser.add_argument("inputs", nargs="+",
+                        help="dat files or folders searched recursively")
+    parser.add_argument("-o", "--out-dir", required=True,
+                        help="output folder, also holding the manifest")
+    parser.add_argument("-f", "--format", nargs="+", dest="formats",
+                        choices=list(FORMATS), default=["json"],
+                        help="output formats (default: json)")
+    parser.add_argument("-j", "--workers", type=int,
+                        help="number of processes (default: number of cores)")
+    parser.add_argument("--bulk", action="store_true",
+                        help="parse dataset sections with NumPy in bulk")
+    parser.add_argument("--force", action="store_true",
+                        help="convert files even if they are unchanged")
+    parser.add_argument("--stats", help="write the section timings and "
+                        "unresolved dataset references to a json file")
+    args = parser.parse_args(argv)
+
+    summary = batch_convert(args.inputs, args.out_dir, args.formats,
+                            args.workers, args.bulk, args.force)
+    if args.stats:
+        with open(args.stats, "w") as outfile:
+            json.dump(summary["stats"], outfile, indent=4)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Benchmarks of the dat file tools
+
+The parser suite writes synthetic dat files of several sizes (synthetic.py)
+and records the time and peak memory of each parser and the time of each
+export format. Results are saved as json with the parser version and
+environment, and can be compared with an earlier results file to spot
+regressions between versions.
+
+Examples:
+    python benchmarks.py --sizes small medium -o benchmark_results.json
+    python benchmarks.py --compare old_results.json -o new_results.json
+    python benchmarks.py --giscodes
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+import numpy as np
+from datfile import get_coordinates, get_coordinates_array
+from dat_to_json import PARSER_VERSION, parse_dat
+from model import load_model
+from yaml_export import write_yaml_file
+from normalised import write_normalised_json
+from columnar import write_columnar, pa
+from dat_writer import DatWriter
+from sqlite_export import write_sqlite
+from synthetic import write_synthetic_dat
+
+# Model sizes of the parser suite
+SIZES = {
+        "small": {"reaches": 100, "features": 2000},
+        "medium": {"reaches": 1000, "features": 20000},
+        "large": {"reaches": 5000, "features": 100000},
+        }
+
+# Parsers, called with the dat file path
+PARSERS = {
+        "parse_dat": lambda path: parse_dat(path),
+        "parse_dat_bulk": lambda path: parse_dat(path, bulk=True),
+        "load_model": load_model,
+        }
+
+
+def export_json(source, dat_file, model, path):
+    with open(path, "w") as outfile:
+        json.dump(dat_file, outfile, indent=4, sort_keys=False)
+
+
+def export_yaml(source, dat_file, model, path):
+    write_yaml_file(dat_file, path)
+
+
+def export_normalised(source, dat_file, model, path):
+    write_normalised_json(model, path)
+
+
+def export_npz(source, dat_file, model, path):
+    write_columnar(model, path, "npz")
+
+
+def export_parquet(source, dat_file, model, path):
+    write_columnar(model, path, "parquet")
+
+
+def export_gpkg(source, dat_file, model, path):
+    write_sqlite(model, path + ".gpkg")
+
+
+def export_dat(source, dat_file, model, path):
+    DatWriter(source).write(model, path)
+
+
+# Export formats, called with the source dat file, its DatFile dict and
+# DatModel and an output path. Parquet needs pyarrow
+EXPORTS = {
+        "json": export_json,
+        "yaml": export_yaml,
+        "normalised": export_normalised,
+        "npz": export_npz,
+        "gpkg": export_gpkg,
+        "dat": export_dat,
+        }
+if pa is not None:
+    EXPORTS["parquet"] = export_parquet
+
+
+def synthetic_giscodes(size, seed=0):
+    """
+    Random giscodes covering the layouts get_coordinates handles: 6 digit
+    eastings with 6 or 7 digit northings and 5 digit eastings starting
+    with 5 or more
+    """
+    rng = np.random.default_rng(seed)
+    easting = rng.integers(100000, 700000, size)
+    short = rng.random(size) < 0.2
+    easting[short] = rng.integers(50000, 100000, short.sum())
+    northing = rng.integers(100000, 1300000, size)
+    codes = np.char.add(easting.astype(str), northing.astype(str))
+    return codes.astype(f"U{np.char.str_len(codes).max()}")
+
+
+def benchmark_giscodes(size=1000000, seed=0):
+    """
+    Time the scalar and vectorised giscode decoders on the same synthetic
+    codes and check they agree. Returns the seconds taken by each
+    """
+    codes = synthetic_giscodes(size, seed)
+    code_list = codes.tolist()
+
+    start = time.perf_counter()
+    scalar = [get_coordinates(code) for code in code_list]
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    easting, northing, valid = get_coordinates_array(codes)
+    vector_seconds = time.perf_counter() - start
+
+    expected = np.array(scalar, dtype=np.int64).reshape(-1, 2)
+    if not (valid.all() and np.array_equal(easting, expected[:, 0])
+            and np.array_equal(northing, expected[:, 1])):
+        raise AssertionError("Vectorised giscodes differ from get_coordinates")
+
+    return {"get_coordinates": scalar_seconds,
+            "get_coordinates_array": vector_seconds}
+
+
+def timed(function, *args, **kwargs):
+    """
+    Call a function, returning its result and the seconds it took
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def peak_memory(function, *args):
+    """
+    Peak memory in bytes allocated by Python while calling a function
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def best_time(repeat, function, *args):
+    """
+    Shortest of several timings of a function call, the least noisy
+    """
+    return min(timed(function, *args)[1] for _ in range(repeat))
+
+
+def benchmark_size(sizes, folder, seed=0, repeat=1):
+    """
+    Benchmark the parsers and exports on one synthetic dat file. Times are
+    the best of repeat runs without tracemalloc, which slows Python down,
+    and peak memory is measured in another run
+    """
+    path = os.path.join(folder, "synthetic.dat")
+    _, generate_seconds = timed(write_synthetic_dat, path, seed=seed, **sizes)
+    result = {
+            **sizes,
+            "file_bytes": os.path.getsize(path),
+            "generate_seconds": generate_seconds,
+            "parse_seconds": {},
+            "parse_peak_bytes": {},
+            "export_seconds": {},
+            }
+
+    for name, parser in PARSERS.items():
+        result["parse_seconds"][name] = best_time(repeat, parser, path)
+        result["parse_peak_bytes"][name] = peak_memory(parser, path)
+
+    dat_file = parse_dat(path, bulk=True)
+    model = load_model(path)
+    for name, export in EXPORTS.items():
+        out_path = os.path.join(folder, f"export_{name}")
+        result["export_seconds"][name] = best_time(
+                repeat, export, path, dat_file, model, out_path)
+    return result
+
+
+def run_info():
+    """
+    Versions and machine the benchmarks ran on
+    """
+    return {
+            "parser_version": PARSER_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            }
+
+
+def benchmark_parsers(size_names=("small", "medium"), seed=0, repeat=1):
+    """
+    Run the parser suite on the named sizes of SIZES
+    """
+    results = {**run_info(), "repeat": repeat, "sizes": {}}
+    for name in size_names:
+        with tempfile.TemporaryDirectory() as folder:
+            results["sizes"][name] = benchmark_size(SIZES[name], folder, seed,
+                                                    repeat)
+    return results
+
+
+def compare_results(old, new, tolerance=1.25):
+    """
+    Return (size, group, name, old value, new value) of every time or peak
+    memory in the new results more than tolerance times the old one
+    """
+    regressions = []
+    for size, new_result in new["sizes"].items():
+        old_result = old["sizes"].get(size)
+        if old_result is None:
+            continue
+        for group in ("parse_seconds", "parse_peak_bytes", "export_seconds"):
+            for name, value in new_result[group].items():
+                old_value = old_result.get(group, {}).get(name)
+                if old_value and value > old_value * tolerance:
+                    regressions.append((size, group, name, old_value, value))
+    return regressions
+
+
+def main(argv=None):
+    """
+    Run the benchmarks given in the command line
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the dat file tools")
+    parser.add_argument("--sizes", nargs="+", default=["small", "medium"],
+                        choices=list(SIZES), help="model sizes to benchmark")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="keep the best time of this many runs")
+    parser.add_argument("-o", "--output", help="save the results to a json file")
+    parser.add_argument("--compare", help="results json file to compare with")
+    parser.add_argument("--tolerance", type=float, default=1.25,
+                        help="slow down ratio reported as a regression")
+    parser.add_argument("--giscodes", action="store_true",
+                        help="only benchmark the giscode decoders")
+    args = parser.parse_args(argv)
+
+    if args.giscodes:
+        timings = benchmark_giscodes()
+        for name, seconds in timings.items():
+            print(f"{name}: {seconds:.3f}s")
+        print(f"speed up: {timings['get_coordinates'] / timings['get_coordinates_array']:.1f}x")
+        return
+
+    results = benchmark_parsers(args.sizes, repeat=args.repeat)
+    for size, result in results["sizes"].items():
+        print(f"{size}: {result['reaches']} reaches, {result['features']} "
+              f"features, {result['file_bytes'] / 1e6:.1f} MB")
+        for name, seconds in result["parse_seconds"].items():
+            peak = result["parse_peak_bytes"][name] / 1e6
+            print(f"    {name}: {seconds:.3f}s, peak {peak:.1f} MB")
+        for name, seconds in result["export_seconds"].items():
+            print(f"    export {name}: {seconds:.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=4)
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare_results(old, results, args.tolerance)
+        for size, group, name, old_value, value in regressions:
+            print(f"Regression {size} {group} {name}: {old_value:.4g} -> "
+                  f"{value:.4g} ({value / old_value:.2f}x)")
+        if not regressions:
+            print(f"No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
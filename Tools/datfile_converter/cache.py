@@ -0,0 +1,193 @@
+"""
+Content addressed cache of parsed dat files
+
+Parsed DatModels and DatFile dicts are pickled to a cache folder, keyed by
+the sha256 of the dat file and a fingerprint of the parser, so a file is
+only parsed again when its content or the parser changes. The folder is
+kept under a size limit by evicting the least recently used entries, and
+loads are also memoised in the process.
+
+Example:
+    from cache import DatCache
+    cache = DatCache()
+    model = cache.load_model("EXAMPLE.dat")
+"""
+
+import os
+import sys
+import copy
+import time
+import pickle
+import hashlib
+from collections import OrderedDict
+from datfile import file_digest
+from dat_to_json import PARSER_VERSION, parse_dat
+from model import load_model
+from npd import NpdStore
+
+# Default cache folder, which can be moved with the SAGIS_DAT_CACHE variable
+CACHE_DIR = os.environ.get(
+        "SAGIS_DAT_CACHE",
+        os.path.join(os.path.expanduser("~"), ".cache", "sagis_datfile"))
+
+# Modules whose source changes the parsed data
+PARSER_MODULES = ("datfile", "dat_to_json", "sections", "model", "npd")
+
+CACHE_SUFFIX = ".pkl"
+
+_fingerprint = None
+
+
+def parser_fingerprint():
+    """
+    Return a short hash of PARSER_VERSION and the source of the parser
+    modules, so editing the parser invalidates the cache even if the version
+    was not bumped
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256(PARSER_VERSION.encode())
+        for name in PARSER_MODULES:
+            with open(sys.modules[name].__file__, "rb") as f:
+                digest.update(f.read())
+        _fingerprint = digest.hexdigest()[:16]
+    return _fingerprint
+
+
+class DatCache:
+    """
+    Disk and in-process cache of parsed dat files. Objects returned from the
+    cache are shared between calls, so copy them before making changes
+    """
+
+    def __init__(self, folder=CACHE_DIR, max_bytes=1 << 30, memo_size=8):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        # Digests of files already hashed, keyed by path, size and mtime
+        self.digests = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def digest(self, file_path):
+        """
+        Return the sha256 of a file, only hashing it again if it changed
+        """
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self.digests:
+            self.digests[key] = file_digest(file_path)
+        return self.digests[key]
+
+    def path(self, digest, kind):
+        """
+        Return the cache file of a dat file digest and kind of output
+        """
+        name = f"{digest}-{kind}-{parser_fingerprint()}{CACHE_SUFFIX}"
+        return os.path.join(self.folder, name)
+
+    def get(self, file_path, kind, build):
+        """
+        Return the cached output of kind for a dat file, calling
+        build(file_path) and storing the result on a miss
+        """
+        digest = self.digest(file_path)
+        key = (digest, kind)
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            return self.memo[key]
+
+        path = self.path(digest, kind)
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+            # Mark the entry as recently used for eviction
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            data = build(file_path)
+            self.store(path, data)
+
+        self.memo[key] = data
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+        return data
+
+    def store(self, path, data):
+        """
+        Pickle data to a cache file in a single step, then evict old entries
+        """
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            pickle.dump(data, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def entries(self):
+        """
+        Return (last used, size, path) of the cache files, oldest first
+        """
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(CACHE_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove the least recently used cache files until the folder fits in
+        max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """
+        Remove every cache file and forget memoised loads
+        """
+        for _, _, path in self.entries():
+            os.remove(path)
+        self.memo.clear()
+
+    def load_model(self, file_path):
+        """
+        Load a dat file as a DatModel through the cache. Entries are keyed
+        by content, so a copy of the file elsewhere gets a shallow copy of
+        the model reading its NPD files next to that path
+        """
+        model = self.get(file_path, "model", load_model)
+        folder = os.path.dirname(file_path)
+        if model.npd.folder != folder:
+            model = copy.copy(model)
+            model.npd = NpdStore(folder, model.npd.cache_dir)
+        return model
+
+    def parse_dat(self, file_path, bulk=False):
+        """
+        Parse a dat file into a DatFile dict through the cache
+        """
+        kind = "bulk" if bulk else "dict"
+        return self.get(file_path, kind,
+                        lambda path: parse_dat(path, bulk=bulk))
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as folder:
+        for kind in ("load_model", "parse_dat"):
+            cache = DatCache(folder)
+            for label in ("cold", "disk", "memo"):
+                if label == "disk":
+                    cache = DatCache(folder)
+                start = time.perf_counter()
+                getattr(cache, kind)("EXAMPLE.dat")
+                print(f"{kind} {label}: {time.perf_counter() - start:.4f}s")
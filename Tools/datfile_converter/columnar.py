@@ -0,0 +1,164 @@
+"""
+Binary columnar export of the dat file data
+
+Reaches, standards, features and the flow, river quality and effluent
+datasets of a DatModel are written as separate tables in a folder, as
+Parquet files when pyarrow is available and as NPZ files otherwise.
+Metadata and determinands go to a small json file. Readers can then load
+only the columns they need, e.g. feature coordinates and dist_head
+"""
+
+import os
+import json
+import numpy as np
+
+# Parquet support is optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+TABLES = ("reaches", "standards", "features", "flow_datasets", "wq_datasets",
+          "effluent_datasets")
+
+METADATA_FILE = "metadata.json"
+
+
+def pool_array(model):
+    """
+    The string pool as a NumPy string array, indexed by pool code to decode
+    whole columns at once
+    """
+    return np.array(model.pool.strings, dtype=str)
+
+
+def reach_table(model, strings):
+    """
+    Reaches as columns, one decay rate column per determinand. strings is
+    the pool_array of the model
+    """
+    reaches = model.reaches
+    table = {}
+    for name in ("simno", "name", "unique_ref", "wbid", "conn1", "conn2",
+                 "conn3", "flow_code", "wq_code"):
+        table[name] = strings[reaches[name]]
+    for name in ("length", "alpha", "beta"):
+        table[name] = reaches[name]
+    for n, det in sorted(model.det_names.items()):
+        table[f"decay_{det}"] = reaches["decay_rates"][:, n - 1]
+    return table
+
+
+def standard_table(model, strings):
+    """
+    Reach standards as columns, one column per threshold
+    """
+    standards = model.standards
+    table = {
+            "simno": strings[model.reaches["simno"][standards["reach"]]],
+            "det_code": standards["det_code"],
+            "count": standards["count"],
+            }
+    for n in range(standards["thresholds"].shape[1]):
+        table[f"threshold_{n + 1}"] = standards["thresholds"][:, n]
+    return table
+
+
+def feature_table(model, strings):
+    """
+    Features as columns, with the indices of their datasets (-1 if missing)
+    """
+    features = model.features
+    table = {
+            "id": np.arange(1, len(features["reach"]) + 1, dtype=np.int32),
+            "simno": strings[model.reaches["simno"][features["reach"]]],
+            }
+    for name in ("name", "feat_code", "flow_code", "wq_code", "gap_flow_code",
+                 "gap_wq_code", "target_code", "giscode"):
+        table[name] = strings[features[name]]
+    for name in ("dist_head", "easting", "northing", "reach", "flow", "wq",
+                 "eff"):
+        table[name] = features[name]
+    return table
+
+
+def dataset_table(datasets, strings):
+    """
+    Dataset parameter rows as columns
+    """
+    table = {}
+    for name, column in datasets.columns.items():
+        if name in ("code", "npd_filename", "title"):
+            table[name] = strings[column]
+        else:
+            table[name] = column
+    return table
+
+
+def model_tables(model):
+    """
+    Return all the tables of a DatModel as dicts of NumPy columns
+    """
+    strings = pool_array(model)
+    return {
+            "reaches": reach_table(model, strings),
+            "standards": standard_table(model, strings),
+            "features": feature_table(model, strings),
+            "flow_datasets": dataset_table(model.flow, strings),
+            "wq_datasets": dataset_table(model.wq, strings),
+            "effluent_datasets": dataset_table(model.eff, strings),
+            }
+
+
+def write_columnar(model, folder, fmt=None):
+    """
+    Export a DatModel as one columnar file per table. fmt is "parquet" or
+    "npz", by default parquet if pyarrow is installed
+    """
+    if fmt is None:
+        fmt = "parquet" if pa is not None else "npz"
+    if fmt == "parquet" and pa is None:
+        raise ImportError("pyarrow is needed to write parquet files")
+
+    os.makedirs(folder, exist_ok=True)
+    for name, table in model_tables(model).items():
+        path = os.path.join(folder, f"{name}.{fmt}")
+        if fmt == "parquet":
+            pq.write_table(pa.table(table), path)
+        else:
+            np.savez_compressed(path, **table)
+
+    with open(os.path.join(folder, METADATA_FILE), "w") as outfile:
+        json.dump({
+            "metadata": model.metadata,
+            "determinands": model.determinands,
+            }, outfile, indent=4)
+
+
+def read_columnar(folder, table, columns=None):
+    """
+    Read a table of a columnar export as a dict of NumPy arrays, loading
+    only the requested columns. Parquet files are memory mapped
+    """
+    if table not in TABLES:
+        raise ValueError(f"Unknown table '{table}', expected one of {TABLES}")
+
+    path = os.path.join(folder, f"{table}.parquet")
+    if os.path.exists(path):
+        if pa is None:
+            raise ImportError("pyarrow is needed to read parquet files")
+        data = pq.read_table(path, columns=columns, memory_map=True)
+        return {name: data[name].to_numpy() for name in data.column_names}
+
+    # NPZ members are only read and decompressed when accessed
+    with np.load(os.path.join(folder, f"{table}.npz")) as data:
+        return {name: data[name] for name in (columns or data.files)}
+
+
+def read_metadata(folder):
+    """
+    Read the metadata and determinands of a columnar export
+    """
+    with open(os.path.join(folder, METADATA_FILE)) as f:
+        return json.load(f)
@@ -0,0 +1,156 @@
+"""
+Command line tool to convert SIMCAT dat files to json, yaml, columnar and
+SQLite formats
+
+Examples:
+    python convert.py EXAMPLE.dat
+    python convert.py scenarios/*.dat --format json normalised parquet -o out
+    python convert.py scenarios/*.dat --format gpkg -o out
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import argparse
+from dat_to_json import parse_dat
+from model import load_model
+from normalised import write_normalised_json
+from yaml_export import write_yaml_file
+from columnar import write_columnar
+from sqlite_export import write_sqlite
+from instrumentation import ParseStats
+
+# Output formats and the file (or folder) suffix they are written to
+FORMATS = {
+        "json": ".json",
+        "yaml": ".yaml",
+        "normalised": ".normalised.json",
+        "parquet": "_parquet",
+        "npz": "_npz",
+        "sqlite": ".sqlite",
+        "gpkg": ".gpkg",
+        }
+
+# Formats exported from the columnar model rather than the DatFile dict
+MODEL_FORMATS = ("normalised", "parquet", "npz", "sqlite", "gpkg")
+
+
+def output_paths(file_path, formats, out_dir=None):
+    """
+    Return the output path of each format for a dat file
+    """
+    folder = out_dir or os.path.dirname(file_path)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return {fmt: os.path.join(folder, stem + FORMATS[fmt]) for fmt in formats}
+
+
+def check_complete(file_path, file_stats):
+    """
+    Raise a ValueError naming the sections missing from a parsed file, or
+    cut short, so an incomplete file is not taken as converted
+    """
+    problems = file_stats.incomplete_sections()
+    if problems:
+        raise ValueError(f"{file_path} is incomplete: {', '.join(problems)}")
+
+
+def replace_output(tmp_path, path):
+    """
+    Move a finished output file or folder into place
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def convert_dat(file_path, formats=("json", "yaml"), out_dir=None, bulk=False,
+                stats=None):
+    """
+    Convert a dat file to the requested formats, returning the paths written.
+    Parsing is recorded in stats if a ParseStats is given. Files missing a
+    section, or cut short, raise a ValueError. Outputs are written to a
+    temporary folder and only moved into place once all of them are done,
+    so a failure never leaves partial outputs behind
+    """
+    paths = output_paths(file_path, formats, out_dir)
+    folder = os.path.dirname(next(iter(paths.values())))
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    file_stats = ParseStats()
+
+    with tempfile.TemporaryDirectory(dir=folder or None,
+                                     prefix=".converting-") as tmp_dir:
+        tmp_paths = {fmt: os.path.join(tmp_dir, os.path.basename(path))
+                     for fmt, path in paths.items()}
+
+        if "json" in formats or "yaml" in formats:
+            dat_file = parse_dat(file_path, bulk=bulk, stats=file_stats)
+            check_complete(file_path, file_stats)
+
+            # Export as json
+            if "json" in formats:
+                with open(tmp_paths["json"], "w") as outfile:
+                    json.dump(dat_file, outfile, indent=4, sort_keys=False)
+
+            # Export as yaml, streamed straight from the data without aliases
+            if "yaml" in formats:
+                write_yaml_file(dat_file, tmp_paths["yaml"])
+
+        if any(fmt in formats for fmt in MODEL_FORMATS):
+            # Only record the file once if it was already parsed above
+            parsed = "json" in formats or "yaml" in formats
+            model = load_model(file_path,
+                               stats=None if parsed else file_stats)
+            if not parsed:
+                check_complete(file_path, file_stats)
+
+            if "normalised" in formats:
+                write_normalised_json(model, tmp_paths["normalised"])
+            for fmt in ("parquet", "npz"):
+                if fmt in formats:
+                    write_columnar(model, tmp_paths[fmt], fmt)
+            for fmt in ("sqlite", "gpkg"):
+                if fmt in formats:
+                    name = os.path.splitext(os.path.basename(file_path))[0]
+                    write_sqlite(model, tmp_paths[fmt], name, file_path)
+
+        for fmt, path in paths.items():
+            replace_output(tmp_paths[fmt], path)
+
+    if stats is not None:
+        stats.merge(file_stats.summary())
+    return list(paths.values())
+
+
+def main(argv=None):
+    """
+    Convert the dat files given in the command line
+    """
+    parser = argparse.ArgumentParser(
+            description="Convert SIMCAT dat files to json, yaml, columnar and "
+                        "SQLite formats")
+    parser.add_argument("files", nargs="*", default=["EXAMPLE.dat"],
+                        help="dat files to convert (default: EXAMPLE.dat)")
+    parser.add_argument("-f", "--format", nargs="+", dest="formats",
+                        choices=list(FORMATS), default=["json", "yaml"],
+                        help="output formats (default: json yaml)")
+    parser.add_argument("-o", "--out-dir",
+                        help="output folder (default: next to each dat file)")
+    parser.add_argument("--bulk", action="store_true",
+                        help="parse dataset sections with NumPy in bulk")
+    parser.add_argument("--stats", action="store_true",
+                        help="report section timings and unresolved datasets")
+    args = parser.parse_args(argv)
+
+    stats = ParseStats() if args.stats else None
+    for file_path in args.files:
+        for path in convert_dat(file_path, args.formats, args.out_dir,
+                                args.bulk, stats):
+            print(f"Created {path}")
+    if stats is not None:
+        print(stats.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,16 +3,69 @@ Python version of SIMCAT
 """
 
 import re
-import json
-import yaml
-from datfile import DatFile, config, get_coordinates
+from itertools import islice
+from datfile import config, get_coordinates, new_dat_file
+from sections import (process_river_flow_section_bulk,
+                      process_river_quality_section_bulk,
+                      process_effluent_section_bulk)
 
-file_path = "EXAMPLE.dat"
+# Version of the parser output. Bump it whenever a change in parsing changes
+# the data produced from an existing dat file, so cached outputs are rebuilt
+PARSER_VERSION = "2"
+
+# Section markers only ever start with one of these characters
+MARKER_CHARS = "=*"
 
 # TODO Check all data is being read, specially flow and wq data for reaches (ask Peter)
 
 
-def process_dat_file_lines(file_path, config, dat_file):
+def iter_section_lines(file, end_marker):
+    """
+    Yield the stripped lines of a section until its end marker is reached.
+    Returns True if the end marker was found, False if the file ended first
+    """
+    for line in file:
+        if line[:1] in MARKER_CHARS and line.strip() == end_marker:
+            return True
+        yield line.strip()
+    return False
+
+
+def iter_sections(file, config):
+    """
+    Stream the sections of a dat file. For every start marker found yields
+    the section name and a generator with the section lines, which must be
+    consumed before moving on to the next section
+    """
+    # Single lookup table for the start markers
+    start_markers = {
+            markers["start"]: (section, markers["end"])
+            for section, markers in config.items()
+            }
+
+    for line in file:
+        # Markers only ever start with '=' or '*'
+        if line[:1] not in MARKER_CHARS:
+            continue
+        match = start_markers.get(line.strip())
+        if match:
+            section, end_marker = match
+            yield section, iter_section_lines(file, end_marker)
+
+
+def parse_dat(file_path, config=config, bulk=False, stats=None):
+    """
+    Parse a dat file into a new DatFile dict, independent from any other
+    parsed file. Errors are raised to the caller. stats is an optional
+    ParseStats (instrumentation.py) recording timings and counters
+    """
+    dat_file = new_dat_file()
+    with open(file_path, 'r') as file:
+        process_dat_sections(file, config, dat_file, bulk, stats)
+    return dat_file
+
+
+def process_dat_file_lines(file_path, config, dat_file, bulk=False, stats=None):
     """
     Process all the sections:
     [0] Metadata at the top of the file
@@ -27,104 +80,105 @@ def process_dat_file_lines(file_path, config, dat_file):
     [7] River Quality Targets - superseded
     [8] Intermittent Discharges - superseded
     [9] Features - id, name, feat type, distance (km), coordinates (BNG)
+
+    The file is streamed so only one line is held in memory at a time. With
+    bulk=True the River Flow, River Quality and Effluent sections are
+    tokenised as a whole into NumPy columns and expanded into the same
+    dicts. Building the dicts takes back most of what the tokenising saves,
+    so this is only slightly faster; model.load_model keeps the columns
+
+    With a ParseStats as stats, the time, lines and records of each section
+    and unresolved dataset references are recorded, and errors are added
+    to it as well as printed
     """
     # Open DAT file for reading
     try:
         with open(file_path, 'r') as file:
-            lines = file.readlines()
-
-        # Process metadata section at the top
-        process_metadata(lines, dat_file)
-
-        # Initialize variables to track section boundaries
-        section_start = None
-        section_end = None
-
-        # Iterate through the lines
-        for line in lines:
-
-            # Determinands
-            if config["Determinands"]["start"] in line:
-                section_start = "start_determinands"
-                section_lines = []
-            elif config["Determinands"]["end"] in line:
-                section_end = "end_determinands"
-                if section_start and section_end:
-                    det_units_dict = process_determinand_section(
-                            section_lines, dat_file)
-                    section_start = section_end = None
-
-            # Reaches
-            elif config["Reaches"]["start"] in line:
-                section_start = "start_reaches"
-                section_lines = []
-            elif config["Reaches"]["end"] in line:
-                section_end = "end_reaches"
-                if section_start and section_end:
-                    process_reaches_section(
-                            section_lines, dat_file, det_units_dict)
-                    section_start = section_end = None
-
-            # River flow
-            elif config["RiverFlow"]["start"] in line:
-                section_start = "start_river_flow"
-                section_lines = []
-            elif config["RiverFlow"]["end"] in line:
-                section_end = "end_river_flow"
-                if section_start and section_end:
-                    flow_data = process_river_flow_section(
-                            section_lines, dat_file)
-                    section_start = section_end = None
-
-            # River quality
-            elif config["RiverQuality"]["start"] in line:
-                section_start = "start_river_quality"
-                section_lines = []
-            elif config["RiverQuality"]["end"] in line:
-                section_end = "end_river_quality"
-                if section_start and section_end:
-                    wq_data = process_river_quality_section(
-                            section_lines, dat_file, det_units_dict)
-                    section_start = section_end = None
-
-            # Effluent
-            elif config["Effluent"]["start"] in line:
-                section_start = "start_effluent"
-                section_lines = []
-            elif config["Effluent"]["end"] in line:
-                section_end = "end_effluent"
-                if section_start and section_end:
-                    eff_data = process_effluent_section(
-                            section_lines, dat_file, det_units_dict)
-                    section_start = section_end = None
-
-            # Features
-            elif config["Features"]["start"] in line:
-                section_start = "start_features"
-                section_lines = []
-            elif config["Features"]["end"] in line:
-                section_end = "end_features"
-                if section_start and section_end:
-                    process_features_section(
-                            section_lines, dat_file, flow_data, wq_data, eff_data)
-                    section_start = section_end = None
-
-            # Anything else add lines to be processed
-            elif section_start:
-                section_lines.append(line.strip())
+            process_dat_sections(file, config, dat_file, bulk, stats)
 
     except FileNotFoundError:
         print(f"The file '{file_path}' was not found.")
+        if stats is not None:
+            stats.error(file_path, "file not found")
 
     except Exception as e:
         print(f"An error occurred: {str(e)}")
+        if stats is not None:
+            stats.error(file_path, f"{type(e).__name__}: {e}")
+
+
+def process_dat_sections(file, config, dat_file, bulk=False, stats=None):
+    """
+    Process the metadata and sections of an open dat file into dat_file.
+    All intermediate data is local so calls are independent
+    """
+    # Pick section handlers
+    if bulk:
+        flow_handler = process_river_flow_section_bulk
+        wq_handler = process_river_quality_section_bulk
+        eff_handler = process_effluent_section_bulk
+    else:
+        flow_handler = process_river_flow_section
+        wq_handler = process_river_quality_section
+        eff_handler = process_effluent_section
+
+    # Process metadata section at the top
+    if stats is None:
+        process_metadata(islice(file, 10), dat_file)
+    else:
+        stats.files += 1
+        start = stats.start()
+        process_metadata(stats.count_lines("metadata", islice(file, 10)),
+                         dat_file)
+        stats.add_section("metadata", start, len(dat_file["metadata"]))
+
+    # Feed each section straight to its handler
+    for section, lines in iter_sections(file, config):
+        if stats is not None:
+            lines = stats.count_lines(section, lines)
+            start = stats.start()
+
+        if section == "Determinands":
+            det_units_dict = process_determinand_section(
+                    lines, dat_file)
+            records = len(det_units_dict)
+
+        elif section == "Reaches":
+            process_reaches_section(
+                    lines, dat_file, det_units_dict)
+            records = len(dat_file["reaches"])
+
+        elif section == "RiverFlow":
+            flow_data = flow_handler(
+                    lines, dat_file)
+            records = len(flow_data)
+
+        elif section == "RiverQuality":
+            wq_data = wq_handler(
+                    lines, dat_file, det_units_dict)
+            records = len(wq_data)
+
+        elif section == "Effluent":
+            eff_data = eff_handler(
+                    lines, dat_file, det_units_dict)
+            records = len(eff_data)
+
+        elif section == "Features":
+            records = process_features_section(
+                    lines, dat_file, flow_data, wq_data, eff_data, stats)
+
+        if stats is not None:
+            stats.add_section(section, start, records)
 
 
 def process_metadata(lines, dat_file):
     """
     Parse dat file metadata at the top of the file
     """
-    for line in lines[1:10]:
+    for n, line in enumerate(islice(lines, 1, 10), 2):
+        if ": " not in line:
+            raise ValueError(f"Header line {n} is not 'name: value', not a "
+                             f"SIMCAT dat file? {line.strip()[:80]!r}")
         name = line.split(": ")[0].strip("=").strip()
         value = line.split(": ")[1].strip()
         dat_file["metadata"][name] = value
@@ -188,7 +242,7 @@ def process_reaches_section(lines, dat_file, det_units_dict):
             beta, wbid, unique_ref = re.split(r"\s{2,}", line)
             # Create reach
             dat_file["reaches"][simno] = {}
-            reach = DatFile["reaches"][simno]
+            reach = dat_file["reaches"][simno]
             # Populate
             reach["name"] = name.strip("''").replace("'", "")
             reach["unique_ref"] = unique_ref.strip()
@@ -218,7 +272,7 @@ def process_river_flow_section(lines, dat_file):
     for line in lines:
 
         if ".npd" in line:
-            code, dist, npd_filename, corr, _ = re.split(r"\s{2,}", line)
+            code, dist, npd_filename, corr, *_ = re.split(r"\s{2,}", line)
             flow_data[code] = {
                     "dist": float(dist),
                     "npd_filename": npd_filename.replace("'", ""),
@@ -254,7 +308,19 @@ def process_river_quality_section(lines, dat_file, det_units_dict):
         if det_code == '1':
             wq_data[code] = {}
 
-        if len(parts) > 9:
+        if ".npd" in line:
+            # Non-parametric distribution
+            code, det_code, dist, npd_filename, corr, sample_n, *_ = parts
+
+            wq_data_det = wq_data[code]
+            wq_data_det[det_name] = {
+                    "dist": float(dist),
+                    "npd_filename": npd_filename.replace("'", ""),
+                    "corr": float(corr),
+                    "sample_n": float(sample_n)
+                    }
+
+        elif len(parts) > 9:
             # Power function
             code, det_code, dist, mean_conc, std, power_idx, base_conc, \
             cut_off_pc, corr, sample_n, _ = parts
@@ -310,13 +376,12 @@ def process_effluent_section(lines, dat_file, det_units_dict):
 
         # Check for NPD files
         if ".npd" in line:
-            code, dist, npd_filename, shift, corr, sample_n, *_ = re.split(r"\s{2,}", line)
+            code, det_code, dist, npd_filename, corr, sample_n, *_ = parts
 
             eff_data_det = eff_data[code]
             eff_data_det[det_name] = {
                     "dist": float(dist),
-                    "npd_filename": float(npd_filename),
-                    "shift": float(shift_conc),
+                    "npd_filename": npd_filename.replace("'", ""),
                     "corr": float(corr),
                     "sample_n": float(sample_n)
                     }
@@ -338,10 +403,27 @@ def process_effluent_section(lines, dat_file, det_units_dict):
     return eff_data
 
 
-def process_features_section(lines, dat_file, flow_data, wq_data, eff_data):
+def split_feature_line(line):
+    """
+    Split a feature line into name, code, simno, dist_head, flow_code,
+    wq_code, gap filling flow and quality codes, target code and giscode
+    """
+    parts = re.split(r"\s{2,}", line)
+    # Handle names with spaces
+    if len(parts) > 10:
+        parts = [parts[0] + " " + parts[1]] + parts[2:]
+    parts[0] = parts[0].replace("'", "")
+    parts[-1] = parts[-1].replace("'", "")
+    return parts
+
+
+def process_features_section(lines, dat_file, flow_data, wq_data, eff_data,
+                             stats=None):
     """
     Parse features and assing flow and quality data
     [9] Features - id, name, feat type, distance (km), coordinates (BNG)
+    Dataset codes other than "0" (no dataset) missing from their section are
+    counted in stats if given. Returns the number of features
     """
     count = 1
 
@@ -350,15 +432,10 @@ def process_features_section(lines, dat_file, flow_data, wq_data, eff_data):
             continue
 
         else:
-            parts = re.split(r"\s{2,}", line)
-            # Handle names with spaces
-            if len(parts) > 10:
-                parts = [parts[0] + " " + parts[1]] + parts[2:]
-
-            name, code, simno, dist_head, flow_code, wq_code, _, _, _, giscode = parts
-            name = name.replace("'", "")
+            name, code, simno, dist_head, flow_code, wq_code, _, _, _, giscode = \
+                split_feature_line(line)
             reach = dat_file["reaches"][simno]
-            long, lat = get_coordinates(giscode.replace("'", ""))
+            long, lat = get_coordinates(giscode)
 
             # Effluent features
             if code in ["3", "5", "12"]:
@@ -368,6 +445,8 @@ def process_features_section(lines, dat_file, flow_data, wq_data, eff_data):
                     effluent_data = eff_data[wq_code].copy()
                 except KeyError:
                     effluent_data = None
+                    if stats is not None and wq_code != "0":
+                        stats.unresolved_reference("eff_data", wq_code)
 
                 reach["features"][count] = {
                         "name": name,
@@ -387,11 +466,15 @@ def process_features_section(lines, dat_file, flow_data, wq_data, eff_data):
                     feature_flow_data = flow_data[flow_code].copy()
                 except KeyError:
                     feature_flow_data = None
+                    if stats is not None and flow_code != "0":
+                        stats.unresolved_reference("flow_data", flow_code)
 
                 try:
                     feature_wq_data = wq_data[wq_code].copy()
                 except KeyError:
                     feature_wq_data = None
+                    if stats is not None and wq_code != "0":
+                        stats.unresolved_reference("wq_data", wq_code)
 
                 reach["features"][count] = {
                         "name": name,
@@ -408,19 +491,9 @@ def process_features_section(lines, dat_file, flow_data, wq_data, eff_data):
             # Increase feature count
             count += 1
 
-# Process dat file
-process_dat_file_lines(file_path, config, DatFile)
-
-# Export as json
-jsonfile = "EXAMPLE.json"
-with open(jsonfile, "w") as outfile:
-    json.dump(DatFile, outfile, indent=4, sort_keys=False)
+    return count - 1
 
-# Read json and re-export as yaml. This is preferable to exporting directly as
-# yaml to avoid references in the output file
-with open(jsonfile) as f:
-    data = json.load(f)
 
-yamlfile = "EXAMPLE.yaml"
-with open(yamlfile, "w") as outfile:
-    yaml.safe_dump(data, outfile, default_flow_style=False, sort_keys=False)
+if __name__ == "__main__":
+    from convert import main
+    main()
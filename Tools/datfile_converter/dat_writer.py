@@ -0,0 +1,345 @@
+"""
+Write a DatModel back to SIMCAT dat format
+
+The dat file the model was parsed from is used as a template: the header
+lines read by process_metadata and the Reaches, River Flow, River Quality,
+Effluent and Features sections are generated from the model, while
+everything the parser does not read (notes, General data, determinand
+settings, targets) is copied from the template unchanged. Lines are built
+column by column and joined once, so many scenario variants can be written
+from one template, e.g. with changed effluent mean concentrations.
+
+Example:
+    writer = DatWriter("EXAMPLE.dat")
+    model = load_model("EXAMPLE.dat")
+    variant = with_dataset_columns(model, "Effluent",
+                                   mean=model.eff.columns["mean"] * 1.1)
+    writer.write(variant, "EXAMPLE_eff110.dat", sections=("Effluent",))
+"""
+
+import os
+import copy
+import time
+import tempfile
+import numpy as np
+from datfile import config
+from dat_to_json import parse_dat
+from lazy import scan_sections
+from model import load_model
+from sections import LAYOUTS
+
+# Sections generated from the model, "metadata" being the header lines
+MODEL_SECTIONS = ("metadata", "Reaches", "RiverFlow", "RiverQuality",
+                  "Effluent", "Features")
+
+# DatModel attribute holding each dataset section
+DATASET_ATTRIBUTES = {"RiverFlow": "flow", "RiverQuality": "wq", "Effluent": "eff"}
+
+# Column widths, always leaving two spaces between fields for the parser
+REACH_WIDTHS = (5, 61, 9, 6, 6, 6, 6, 6, 9, 9, 20, 0)
+DECAY_WIDTH = 15
+STANDARD_WIDTHS = (30, 5, 3)
+DATASET_WIDTH = 15
+FEATURE_WIDTHS = (70, 6, 6, 10, 6, 6, 6, 6, 6, 50)
+SEPARATOR_WIDTH = 110
+
+HEADER_LINES = 10
+
+
+def format_number(value):
+    """
+    Shortest text that parses back to the same float, without a trailing
+    ".0" so integer fields (distribution types, sample counts) stay integers
+    """
+    text = repr(value)
+    return text[:-2] if text.endswith(".0") else text
+
+
+def pad(text, width):
+    """
+    Left align a field, keeping at least two spaces after it
+    """
+    return (text + "  ").ljust(width)
+
+
+def format_row(fields, widths):
+    """
+    Join the fields of a line into fixed width columns
+    """
+    return "".join(pad(field, width) for field, width in zip(fields, widths))
+
+
+def reach_lines(model):
+    """
+    Lines of the Reaches section: reach data, decay rates and standards
+    """
+    pool = model.pool
+    reaches = model.reaches
+    strings = {name: [pool[code] for code in reaches[name].tolist()]
+               for name in ("simno", "name", "unique_ref", "wbid", "conn1",
+                            "conn2", "conn3", "flow_code", "wq_code")}
+    numbers = {name: [format_number(v) for v in reaches[name].tolist()]
+               for name in ("length", "alpha", "beta")}
+
+    # Standards of each reach, in file order
+    standards = model.standards
+    standard_lines = [[] for _ in range(len(strings["simno"]))]
+    for reach, det_code, count, thresholds in zip(
+            standards["reach"].tolist(), standards["det_code"].tolist(),
+            standards["count"].tolist(), standards["thresholds"].tolist()):
+        values = [format_number(v) for v in thresholds if v == v]
+        standard_lines[reach].append(
+                format_row(("'Standard'", str(det_code), str(count)),
+                           STANDARD_WIDTHS)
+                + "".join(pad(v, DATASET_WIDTH) for v in values))
+
+    lines = []
+    for n, decay_rates in enumerate(reaches["decay_rates"].tolist()):
+        lines.append(format_row((
+                strings["simno"][n], f"'{strings['name'][n]}'",
+                numbers["length"][n], strings["conn1"][n],
+                strings["conn2"][n], strings["conn3"][n],
+                strings["flow_code"][n], strings["wq_code"][n],
+                numbers["alpha"][n], numbers["beta"][n],
+                f"'{strings['wbid'][n]}'", strings["unique_ref"][n],
+                ), REACH_WIDTHS).rstrip())
+        lines.append("".join(pad(format_number(v), DECAY_WIDTH)
+                             for v in decay_rates))
+        lines.extend(standard_lines[n])
+    return lines
+
+
+def dataset_lines(model, section):
+    """
+    Lines of a River Flow, River Quality or Effluent section. Each row is
+    written with the fields of its line variant, the NPD file name going
+    after the distribution type
+    """
+    table = getattr(model, DATASET_ATTRIBUTES[section])
+    columns = table.columns
+    pool = model.pool
+    size = len(columns["code"])
+
+    codes = [pool[code] for code in columns["code"].tolist()]
+    titles = [f"'{pool[code]}'" for code in columns["title"].tolist()]
+    npd_filenames = [f"'{pool[code]}'"
+                     for code in columns["npd_filename"].tolist()]
+    masks = {"npd": columns["is_npd"]}
+    if "power" in LAYOUTS[section]:
+        masks["power"] = columns["is_power"] & ~columns["is_npd"]
+        masks["standard"] = ~(columns["is_power"] | columns["is_npd"])
+    else:
+        masks["standard"] = ~columns["is_npd"]
+
+    lines = [None] * size
+    for variant, fields in LAYOUTS[section].items():
+        rows = np.flatnonzero(masks[variant]).tolist()
+        if not rows:
+            continue
+        # Format whole columns of the variant at once
+        formatted = [[codes[row] for row in rows]]
+        for name in fields[1:]:
+            values = columns[name][rows].tolist()
+            formatted.append([format_number(v) for v in values])
+        if variant == "npd":
+            formatted.insert(fields.index("dist") + 1,
+                             [npd_filenames[row] for row in rows])
+        formatted.append([titles[row] for row in rows])
+        for row, fields_text in zip(rows, zip(*formatted)):
+            lines[row] = "".join(pad(text, DATASET_WIDTH)
+                                 for text in fields_text).rstrip()
+    return lines
+
+
+def feature_lines(model):
+    """
+    Lines of the Features section, with a separator line naming the reach
+    and its water body before the features of each reach
+    """
+    pool = model.pool
+    features = model.features
+    reaches = model.reaches
+    columns = [[pool[code] for code in features[name].tolist()]
+               for name in ("name", "feat_code")]
+    columns.append([pool[code] for code in
+                    reaches["simno"][features["reach"]].tolist()])
+    columns.append([format_number(v) for v in features["dist_head"].tolist()])
+    for name in ("flow_code", "wq_code", "gap_flow_code", "gap_wq_code",
+                 "target_code", "giscode"):
+        columns.append([pool[code] for code in features[name].tolist()])
+
+    lines = []
+    previous = None
+    for reach, fields in zip(features["reach"].tolist(), zip(*columns)):
+        if reach != previous:
+            simno = pool[reaches["simno"][reach]]
+            name = pool[reaches["name"][reach]]
+            wbid = pool[reaches["wbid"][reach]]
+            lines.append(f"Reach {simno} {name} - WBID:{wbid}".center(
+                    SEPARATOR_WIDTH, "="))
+            previous = reach
+        name, *fields, giscode = fields
+        lines.append(format_row(
+                [f"'{name}'", *fields, f"'{giscode}'"], FEATURE_WIDTHS))
+    return lines
+
+
+def with_dataset_columns(model, section, **columns):
+    """
+    Return a copy of a model with some columns of a dataset table replaced,
+    e.g. mean=... for a variant. Everything else is shared with the original
+    """
+    variant = copy.copy(model)
+    attribute = DATASET_ATTRIBUTES[section]
+    table = copy.copy(getattr(model, attribute))
+    for name, values in columns.items():
+        if name not in table.columns:
+            raise KeyError(f"Unknown {section} column '{name}'")
+        if len(values) != len(table.columns[name]):
+            raise ValueError(f"Expected {len(table.columns[name])} values "
+                             f"for {section} column '{name}'")
+    table.columns = {**table.columns, **columns}
+    setattr(variant, attribute, table)
+    return variant
+
+
+class DatWriter:
+    """
+    Write DatModels to dat files using a dat file as template for the text
+    the model does not hold
+    """
+
+    def __init__(self, template_path, config=config):
+        with open(template_path, "rb") as f:
+            self.template = f.read()
+        self.newline = "\r\n" if b"\r\n" in self.template[:1000] else "\n"
+        self.offsets = scan_sections(self.template, config)
+
+        # Header lines read by process_metadata
+        header_end = 0
+        for _ in range(HEADER_LINES):
+            header_end = self.template.index(b"\n", header_end) + 1
+        self.header = self.template[:header_end].decode().splitlines()
+        self.header_end = header_end
+
+    def render_header(self, metadata):
+        """
+        Header lines with the given metadata, unchanged lines kept as they
+        are in the template
+        """
+        lines = []
+        for line in self.header:
+            if ": " in line:
+                name, value = line.split(": ", 1)
+                key = name.strip("=").strip()
+                new_value = metadata.get(key, value.strip())
+                if new_value != value.strip():
+                    line = f"{name}: {new_value}"
+            lines.append(line)
+        return lines
+
+    def render_section(self, model, section):
+        """
+        Generated lines of a section
+        """
+        if section == "Reaches":
+            return reach_lines(model)
+        if section == "Features":
+            return feature_lines(model)
+        return dataset_lines(model, section)
+
+    def render(self, model, sections=MODEL_SECTIONS):
+        """
+        Return the dat file of a model as bytes. Only the given sections are
+        generated, the others are copied from the template
+        """
+        for section in sections:
+            if section not in MODEL_SECTIONS:
+                raise ValueError(f"Cannot write section '{section}', "
+                                 f"expected one of {MODEL_SECTIONS}")
+            if section != "metadata" and section not in self.offsets:
+                raise ValueError(f"Section '{section}' not in the template")
+
+        return self.splice(
+                {section: self.render_section(model, section)
+                 for section in sections if section != "metadata"},
+                model.metadata if "metadata" in sections else None)
+
+    def splice(self, section_lines, metadata=None):
+        """
+        Return the template as bytes with the lines of the given sections
+        ({section: lines}, any section of the config) and the header
+        metadata replaced
+        """
+        newline = self.newline
+        if metadata is not None:
+            chunks = [(newline.join(self.render_header(metadata))
+                       + newline).encode()]
+        else:
+            chunks = [self.template[:self.header_end]]
+
+        position = self.header_end
+        for section, (start, end) in sorted(self.offsets.items(),
+                                            key=lambda item: item[1]):
+            if section not in section_lines:
+                continue
+            chunks.append(self.template[position:start])
+            chunks.append("".join(line + newline
+                                  for line in section_lines[section]).encode())
+            position = end
+        chunks.append(self.template[position:])
+        return b"".join(chunks)
+
+    def write(self, model, file_path, sections=MODEL_SECTIONS):
+        """
+        Write the dat file of a model
+        """
+        with open(file_path, "wb") as outfile:
+            outfile.write(self.render(model, sections))
+
+
+def check_round_trip(file_path):
+    """
+    Write a dat file from its own model and parse it again. Returns a dict
+    of checks which should all be True: the template alone reproduces the
+    file byte for byte, and a fully generated file parses to the same data
+    """
+    model = load_model(file_path)
+    writer = DatWriter(file_path)
+    checks = {"template": writer.render(model, sections=()) ==
+              writer.template}
+
+    with tempfile.TemporaryDirectory() as folder:
+        out_path = os.path.join(folder, "round_trip.dat")
+        writer.write(model, out_path)
+        written = load_model(out_path)
+        checks["model"] = written.to_dict() == model.to_dict()
+        checks["parse_dat"] = (parse_dat(out_path, bulk=True) ==
+                               parse_dat(file_path, bulk=True))
+        checks["titles"] = all(
+                [written.pool[c] for c in getattr(written, a).columns["title"]]
+                == [model.pool[c] for c in getattr(model, a).columns["title"]]
+                for a in DATASET_ATTRIBUTES.values())
+    return checks
+
+
+if __name__ == "__main__":
+    for check, passed in check_round_trip("EXAMPLE.dat").items():
+        print(f"{check}: {'ok' if passed else 'FAILED'}")
+
+    # Write perturbed effluent mean concentrations
+    model = load_model("EXAMPLE.dat")
+    writer = DatWriter("EXAMPLE.dat")
+    rng = np.random.default_rng(0)
+    mean = model.eff.columns["mean"]
+    count = 500
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        for n in range(count):
+            factors = rng.lognormal(0, 0.2, len(mean))
+            variant = with_dataset_columns(model, "Effluent", mean=mean * factors)
+            writer.write(variant, os.path.join(folder, f"variant_{n}.dat"),
+                         sections=("Effluent",))
+        seconds = time.perf_counter() - start
+    print(f"{count} effluent variants in {seconds:.2f}s "
+          f"({count / seconds * 60:.0f} per minute)")
@@ -2,6 +2,10 @@
 The main object to hold the dat file data
 """
 
+import copy
+import hashlib
+import numpy as np
+
     # [3] Reaches - order (simno), id, name, waterbody, length, connectivity,
     # velocity (alpha and beta), temperature, EQS targets (per det), decay rates (per det)
     # [4] River Flow - dist type, params, linked to feature
@@ -29,6 +33,14 @@ DatFile = {
             }
         }
 
+
+def new_dat_file():
+    """
+    Return a new, empty DatFile dict to parse a dat file into
+    """
+    return copy.deepcopy(DatFile)
+
+
 # Reach = {
 #         "metadata": {},
 #         "flow_params": {},
@@ -79,8 +91,13 @@ config = {
 def get_coordinates(giscode):
     """
     A function to separate the coordinate field from SIMCAT outputs into Easting
-    and Northing. It only works with coordinates within the UK
+    and Northing. It only works with coordinates within the UK. Surrounding
+    whitespace is ignored, anything but up to 18 ASCII digits raises a
+    ValueError
     """
+    giscode = giscode.strip()
+    if not (giscode.isascii() and giscode.isdigit()) or len(giscode) > 18:
+        raise ValueError(f"Malformed giscode {giscode!r}")
     if len(giscode) < 12:
         if int(giscode[0]) < 5:
             x_coor = giscode[:6]
@@ -93,3 +110,60 @@ def get_coordinates(giscode):
         y_coor = giscode[6:]
 
     return int(x_coor), int(y_coor)
+
+
+def get_coordinates_array(giscodes):
+    """
+    Vectorised get_coordinates for a whole column of giscodes, using the same
+    rules: codes shorter than 12 digits starting with 5 or more have a
+    5 digit easting, all others a 6 digit one. Returns easting and northing
+    int64 arrays and a mask of valid codes. Surrounding whitespace is
+    ignored. Malformed codes (empty, not all ASCII digits, without a
+    northing or over 18 digits) are flagged and given -1 instead of raising
+    """
+    codes = np.asarray(giscodes)
+    if codes.dtype.kind not in "US":
+        codes = codes.astype(str)
+    codes = np.ascontiguousarray(np.char.strip(codes))
+    size = len(codes)
+    lengths = np.char.str_len(codes)
+
+    # Character codes as a 2D array, 4 bytes per character for str arrays.
+    # Digits become 0-9, anything else wraps around to a large number
+    char_type = np.uint32 if codes.dtype.kind == "U" else np.uint8
+    chars = codes.view(char_type).reshape(
+            size, codes.dtype.itemsize // np.dtype(char_type).itemsize)
+    width = min(int(lengths.max(initial=0)), 18)
+    digits = chars[:, :width] - char_type(ord("0"))
+    is_digit = digits < 10
+
+    first = digits[:, 0] if width else np.zeros(size, dtype=char_type)
+    split = np.where((lengths < 12) & (first >= 5), 5, 6)
+    valid = ((np.count_nonzero(is_digit, axis=1) == lengths)
+             & (lengths > split))
+
+    # Read the whole code as one number, then split it at the easting
+    powers = 10 ** np.arange(19, dtype=np.int64)
+    value = np.zeros(size, dtype=np.int64)
+    if width:
+        value = np.where(is_digit, digits, 0).astype(np.int64) \
+            @ powers[width - 1::-1]
+    value //= powers[np.clip(width - lengths, 0, 18)]
+    northing_scale = powers[np.clip(lengths - split, 0, 18)]
+    easting = value // northing_scale
+    northing = value - easting * northing_scale
+
+    easting[~valid] = -1
+    northing[~valid] = -1
+    return easting, northing, valid
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """
+    Return the sha256 hex digest of a file's content, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
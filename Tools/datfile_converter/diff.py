@@ -0,0 +1,325 @@
+"""
+Structural diff between two dat files
+
+Reaches, features and the river flow, river quality and effluent datasets
+of both models are hashed with a BLAKE2 digest of the repr of their
+values (the built-in hash is not used: hash(-1.0) == hash(-2.0), so some
+edits would go unnoticed). A reach hash covers its own data and the hashes
+of its features, so unchanged reaches are skipped without looking at their
+features, and field level deltas are only worked out for entities whose
+hashes differ.
+
+Features are matched by reach, name, feature code and occurrence of the
+pair in the reach (not by their file order id, which shifts when a feature
+is added) and datasets by their code.
+
+Example:
+    python diff.py Baseline.dat optionB.dat
+"""
+
+import json
+import hashlib
+import argparse
+import numpy as np
+from model import load_model
+
+# Feature columns compared, all pool codes except the numeric ones
+FEATURE_FIELDS = ("name", "feat_code", "dist_head", "flow_code", "wq_code",
+                  "gap_flow_code", "gap_wq_code", "target_code", "giscode",
+                  "easting", "northing")
+FEATURE_NUMBERS = ("dist_head", "easting", "northing")
+
+# Dataset sections, the DatModel attribute and the entity name used in diffs
+DATASETS = (("flow", "flow"), ("wq", "wq"), ("eff", "effluent"))
+
+
+def flatten(data, prefix=""):
+    """
+    Flatten nested dicts into {"a.b": value}, with lists as tuples
+    """
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, list):
+            flat[name] = tuple(value)
+        else:
+            flat[name] = value
+    return flat
+
+
+def digest(values):
+    """
+    BLAKE2 digest of the repr of a tuple of python values
+    """
+    return hashlib.blake2b(repr(values).encode(), digest_size=16).digest()
+
+
+def column_values(column, pool=None):
+    """
+    Column as a list of python values, decoding pool codes and turning NaN
+    into None so equal rows hash equally
+    """
+    if pool is not None:
+        return [pool[code] for code in column.tolist()]
+    if column.dtype.kind == "f":
+        return np.where(np.isnan(column), None, column).tolist()
+    return column.tolist()
+
+
+def hash_features(model):
+    """
+    Return {reach index: {feature key: (hash, feature index)}}
+    """
+    pool = model.pool
+    features = model.features
+    if not len(features.get("reach", ())):
+        return {}
+    columns = [column_values(features[name],
+                             None if name in FEATURE_NUMBERS else pool)
+               for name in FEATURE_FIELDS]
+
+    reach_features = {}
+    for n, (reach, row) in enumerate(zip(features["reach"].tolist(),
+                                         zip(*columns))):
+        keyed = reach_features.setdefault(reach, {})
+        # Number repeated names and codes within a reach in file order
+        name, feat_code = row[:2]
+        occurrence = 0
+        while (name, feat_code, occurrence) in keyed:
+            occurrence += 1
+        keyed[(name, feat_code, occurrence)] = (digest(row), n)
+    return reach_features
+
+
+def hash_reaches(model, reach_features):
+    """
+    Return {simno: (reach hash, data hash, reach index)}. The reach hash
+    covers the hashes of its features
+    """
+    hashes = {}
+    for reach in model.iter_reaches():
+        data_hash = digest(tuple(
+                flatten(reach.to_dict_without_features()).items()))
+        features = reach_features.get(reach.index, {})
+        reach_hash = digest((data_hash, tuple(
+                (key, value[0]) for key, value in features.items())))
+        hashes[reach.simno] = (reach_hash, data_hash, reach.index)
+    return hashes
+
+
+def hash_datasets(model, table):
+    """
+    Return {dataset code: (hash, dataset index)} of a DatasetTable
+    """
+    if table is None:
+        return {}
+    pool = model.pool
+    columns = [column_values(column, pool if name in ("npd_filename", "title")
+                             else None)
+               for name, column in table.columns.items() if name != "code"]
+    rows = list(zip(*columns))
+    return {
+            code: (digest(tuple(rows[table.starts[n]:table.stops[n]])), n)
+            for code, n in table.index.items()
+            }
+
+
+class ModelHashes:
+    """
+    Hashes of the entities of a DatModel, computed once so a model can be
+    compared against several others
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.features = hash_features(model)
+        self.reaches = hash_reaches(model, self.features)
+        self.datasets = {
+                entity: hash_datasets(model, getattr(model, attribute))
+                for attribute, entity in DATASETS
+                }
+
+
+def field_deltas(old, new):
+    """
+    Return {field: (old value, new value)} of the fields that differ. Fields
+    missing on one side are None
+    """
+    return {
+            field: (old.get(field), new.get(field))
+            for field in dict.fromkeys([*old, *new])
+            if old.get(field) != new.get(field)
+            }
+
+
+def feature_fields(model, n):
+    """
+    Flat fields of a feature
+    """
+    features = model.features
+    return {
+            name: (features[name][n].item() if name in FEATURE_NUMBERS
+                   else model.pool[features[name][n]])
+            for name in FEATURE_FIELDS
+            }
+
+
+def dataset_fields(model, entity, n):
+    """
+    Flat fields of a dataset, determinand parameters prefixed with the
+    determinand short name
+    """
+    if entity == "flow":
+        table = model.flow
+        fields = flatten(table.flow_dict(n))
+        fields["title"] = model.pool[table.columns["title"][table.starts[n]]]
+        return fields
+
+    table = model.wq if entity == "wq" else model.eff
+    det_names = model.det_names if entity == "wq" else model.eff_names
+    fields = flatten(table.determinand_dict(n, det_names))
+    rows = table.rows(n)
+    for det_code, title in zip(table.columns["det_code"][rows].tolist(),
+                               table.columns["title"][rows].tolist()):
+        fields[f"{det_names[det_code]}.title"] = model.pool[title]
+    return fields
+
+
+def compare_keys(old, new):
+    """
+    Split the keys of two dicts into removed, added and common, keeping the
+    file order
+    """
+    removed = [key for key in old if key not in new]
+    added = [key for key in new if key not in old]
+    common = [key for key in old if key in new]
+    return removed, added, common
+
+
+def change(entity, key, kind, fields=None):
+    """
+    A change record of the diff
+    """
+    return {"entity": entity, "key": key, "change": kind, "fields": fields}
+
+
+def diff_features(old, new, simno, old_features, new_features):
+    """
+    Changes between the features of a reach
+    """
+    changes = []
+    removed, added, common = compare_keys(old_features, new_features)
+    for key in removed:
+        changes.append(change("feature", (simno, *key), "removed"))
+    for key in added:
+        changes.append(change("feature", (simno, *key), "added"))
+    for key in common:
+        old_hash, old_n = old_features[key]
+        new_hash, new_n = new_features[key]
+        if old_hash != new_hash:
+            changes.append(change("feature", (simno, *key), "changed",
+                                  field_deltas(feature_fields(old, old_n),
+                                               feature_fields(new, new_n))))
+    return changes
+
+
+def diff_models(old, new):
+    """
+    Return the list of added, removed and changed reaches, features and
+    datasets between two DatModels (or ModelHashes), with field deltas as
+    {field: (old value, new value)} for changed entities. Feature keys are
+    (simno, name, feat_code, occurrence) and dataset keys their code
+    """
+    old_hashes = old if isinstance(old, ModelHashes) else ModelHashes(old)
+    new_hashes = new if isinstance(new, ModelHashes) else ModelHashes(new)
+    old, new = old_hashes.model, new_hashes.model
+    changes = []
+
+    removed, added, common = compare_keys(old_hashes.reaches, new_hashes.reaches)
+    for simno in removed:
+        changes.append(change("reach", simno, "removed"))
+    for simno in added:
+        changes.append(change("reach", simno, "added"))
+    for simno in common:
+        old_hash, old_data, old_n = old_hashes.reaches[simno]
+        new_hash, new_data, new_n = new_hashes.reaches[simno]
+        # Skip the whole reach, features included
+        if old_hash == new_hash:
+            continue
+        if old_data != new_data:
+            changes.append(change("reach", simno, "changed", field_deltas(
+                    flatten(old.reach(simno).to_dict_without_features()),
+                    flatten(new.reach(simno).to_dict_without_features()))))
+        changes.extend(diff_features(
+                old, new, simno, old_hashes.features.get(old_n, {}),
+                new_hashes.features.get(new_n, {})))
+
+    for _, entity in DATASETS:
+        old_datasets = old_hashes.datasets[entity]
+        new_datasets = new_hashes.datasets[entity]
+        removed, added, common = compare_keys(old_datasets, new_datasets)
+        for code in removed:
+            changes.append(change(entity, code, "removed"))
+        for code in added:
+            changes.append(change(entity, code, "added"))
+        for code in common:
+            old_hash, old_n = old_datasets[code]
+            new_hash, new_n = new_datasets[code]
+            if old_hash != new_hash:
+                changes.append(change(entity, code, "changed", field_deltas(
+                        dataset_fields(old, entity, old_n),
+                        dataset_fields(new, entity, new_n))))
+
+    return changes
+
+
+def diff_dat(old_path, new_path):
+    """
+    Diff two dat files
+    """
+    return diff_models(load_model(old_path), load_model(new_path))
+
+
+def summarise(changes):
+    """
+    Count changes by entity and kind, e.g. {"feature": {"changed": 3}}
+    """
+    summary = {}
+    for record in changes:
+        counts = summary.setdefault(record["entity"], {})
+        counts[record["change"]] = counts.get(record["change"], 0) + 1
+    return summary
+
+
+def main(argv=None):
+    """
+    Print the diff between the dat files given in the command line
+    """
+    parser = argparse.ArgumentParser(
+            description="Structural diff between two SIMCAT dat files")
+    parser.add_argument("old", help="baseline dat file")
+    parser.add_argument("new", help="scenario dat file")
+    parser.add_argument("-o", "--output",
+                        help="write the changes to a json file")
+    args = parser.parse_args(argv)
+
+    changes = diff_dat(args.old, args.new)
+    for record in changes:
+        print(f"{record['change']} {record['entity']} {record['key']}")
+        for field, (old, new) in (record["fields"] or {}).items():
+            print(f"    {field}: {old} -> {new}")
+    for entity, counts in summarise(changes).items():
+        print(f"{entity}: " + ", ".join(f"{n} {kind}"
+                                        for kind, n in counts.items()))
+    if not changes:
+        print("No differences")
+
+    if args.output:
+        with open(args.output, "w") as outfile:
+            json.dump(changes, outfile, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Incremental re-simulation of scenarios of a baseline dat file
+
+A baseline run keeps the flow and load shots at the end of every reach. A
+scenario of the same model is diffed against the baseline (diff.py), the
+reaches holding changed features, reaches or datasets are found and only
+those reaches and the reaches downstream of them are run again, starting
+from the baseline shots of the unchanged reaches upstream. Results of the
+unchanged reaches are copied from the baseline.
+
+The random shots of a feature depend on the seed, its reach and its
+position in the reach only, so a re-simulation gives the same results as a
+full run of the scenario.
+
+Example:
+    baseline = IncrementalRun.from_dat("Baseline.dat")
+    results = baseline.rerun_dat("optionB.dat")
+    results["recomputed"]
+"""
+
+import time
+import argparse
+import numpy as np
+from diff import ModelHashes, diff_models
+from model import load_model
+from network import ReachNetwork
+from simulation import (DEFAULT_SHOTS, PERCENTILES, EFFLUENT_DATA,
+                        FLOW_DATA_BIFURCATIONS, MassBalance, read_run_settings)
+
+# Per feature result arrays
+RESULT_ARRAYS = ("flow_mean", "flow_low95", "conc_mean") + tuple(
+        f"conc_q{p}" for p in PERCENTILES)
+
+
+def reach_rows(model, reach):
+    """
+    Feature indices of a reach in file order
+    """
+    return model.reach_features[
+            model.reach_offsets[reach]:model.reach_offsets[reach + 1]]
+
+
+def dataset_users(model, entity, code):
+    """
+    Simnos of the reaches whose features or diffuse inflows use a river
+    flow ("flow"), river quality ("wq") or effluent ("effluent") dataset
+    """
+    pool = model.pool
+    code = pool.get(code)
+    if code < 0:
+        return set()
+    features = model.features
+    reaches = model.reaches
+
+    # The wq column holds effluent or river quality data-set codes, or the
+    # flow data-sets of some bifurcations, depending on the feature type
+    feat_code = features["feat_code"]
+    effluent = np.isin(feat_code, [pool.get(c) for c in EFFLUENT_DATA])
+    wq_code = features["wq_code"] == code
+    if entity == "flow":
+        uses = (features["flow_code"] == code) | wq_code & np.isin(
+                feat_code, [pool.get(c) for c in FLOW_DATA_BIFURCATIONS])
+        reach_uses = reaches["flow_code"] == code
+    elif entity == "effluent":
+        uses = wq_code & effluent
+        reach_uses = np.zeros(len(reaches["simno"]), dtype=bool)
+    else:
+        uses = wq_code & ~effluent
+        reach_uses = reaches["wq_code"] == code
+
+    used = set(features["reach"][uses].tolist())
+    used.update(np.flatnonzero(reach_uses).tolist())
+    return {pool[reaches["simno"][n]] for n in used}
+
+
+class IncrementalRun:
+    """
+    Baseline run whose per reach results are kept, so that scenarios of the
+    same model only re-simulate the reaches affected by their changes
+    """
+
+    def __init__(self, model, shots=DEFAULT_SHOTS, seed=0, settings=None):
+        self.model = model
+        self.shots = shots
+        self.seed = seed
+        self.settings = settings
+        self.hashes = ModelHashes(model)
+        self.network = ReachNetwork.from_model(model)
+        balance = MassBalance(model, shots, seed, settings, self.network)
+        self.results = balance.run()
+        self.ends = balance.ends
+
+    @classmethod
+    def from_dat(cls, file_path, seed=0, shots=None):
+        """
+        Run a baseline dat file
+        """
+        settings = read_run_settings(file_path)
+        return cls(load_model(file_path), shots or settings["shots"], seed,
+                   settings)
+
+    def changed_reaches(self, model, changes):
+        """
+        Simnos of the reaches of the scenario touched by the changes: the
+        reaches of changed features and reaches, the reaches using changed
+        datasets and the old downstream reaches of reconnected reaches
+        """
+        changed = set()
+        for record in changes:
+            entity, key = record["entity"], record["key"]
+            if entity == "feature":
+                changed.add(key[0])
+            elif entity == "reach":
+                changed.add(key)
+                if key in self.network.index:
+                    down = self.network.downstream_of(key)
+                    if down is not None:
+                        changed.add(down)
+            else:
+                changed |= dataset_users(model, entity, key)
+                changed |= dataset_users(self.model, entity, key)
+        return changed
+
+    def rerun(self, model, settings=None):
+        """
+        Simulate a scenario of the baseline model, running only the reaches
+        downstream of the changes. results["recomputed"] lists the simnos of
+        the reaches run again
+        """
+        start_time = time.perf_counter()
+        settings = settings or self.settings
+        if settings != self.settings or model.determinands != \
+                self.model.determinands:
+            # Everything changes, run it all
+            balance = MassBalance(model, self.shots, self.seed, settings)
+            results = balance.run()
+            results["recomputed"] = list(balance.network.simnos)
+            results["seconds"] = time.perf_counter() - start_time
+            return results
+
+        changes = diff_models(self.hashes, model)
+        network = ReachNetwork.from_model(model)
+        balance = MassBalance(model, self.shots, self.seed, settings, network)
+
+        # Changed reaches and every reach using their results
+        after = balance.dependants()
+        stack = [network.index[simno]
+                 for simno in self.changed_reaches(model, changes)
+                 if simno in network.index]
+        affected = set(stack)
+        while stack:
+            for m in after[stack.pop()]:
+                if m not in affected:
+                    affected.add(m)
+                    stack.append(m)
+
+        # Baseline results of the other reaches, features matched by
+        # position as the reach and its features are unchanged
+        results = balance.new_results()
+        ends = {}
+        for n, simno in enumerate(network.simnos):
+            if n in affected:
+                continue
+            old = self.network.index[simno]
+            new_rows = reach_rows(model, n)
+            old_rows = reach_rows(self.model, old)
+            for name in RESULT_ARRAYS:
+                results[name][new_rows] = self.results[name][old_rows]
+            ends[simno] = self.ends[simno]
+
+        results = balance.run(affected, ends, results)
+        results["recomputed"] = [network.simnos[n] for n in sorted(affected)]
+        results["seconds"] = time.perf_counter() - start_time
+        return results
+
+    def rerun_dat(self, file_path):
+        """
+        Simulate a scenario dat file
+        """
+        return self.rerun(load_model(file_path), read_run_settings(file_path))
+
+
+def main(argv=None):
+    """
+    Run a baseline and re-simulate the scenarios given in the command line
+    """
+    parser = argparse.ArgumentParser(
+            description="Incremental re-simulation of SIMCAT dat file scenarios")
+    parser.add_argument("baseline", help="baseline dat file")
+    parser.add_argument("scenarios", nargs="+", help="scenario dat files")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the random shots")
+    args = parser.parse_args(argv)
+
+    baseline = IncrementalRun.from_dat(args.baseline, args.seed)
+    print(f"{args.baseline}: {len(baseline.network)} reaches in "
+          f"{baseline.results['seconds']:.2f}s")
+    for file_path in args.scenarios:
+        results = baseline.rerun_dat(file_path)
+        print(f"{file_path}: {len(results['recomputed'])} reaches in "
+              f"{results['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Optional instrumentation of dat file parsing
+
+A ParseStats passed to parse_dat, process_dat_file_lines or load_model
+records the wall time, number of lines and number of records of every
+section, the feature dataset references that could not be resolved and
+any parsing errors. Summaries of many files (e.g. from batch workers) can
+be merged to find slow sections and data problems in big batch runs.
+
+Example:
+    stats = ParseStats()
+    dat_file = parse_dat("EXAMPLE.dat", stats=stats)
+    print(stats.report())
+"""
+
+import time
+
+# Sections in file order, "metadata" being the header lines
+SECTIONS = ("metadata", "Determinands", "Reaches", "RiverFlow",
+            "RiverQuality", "Effluent", "Features")
+
+# Examples of unresolved codes kept per kind of reference
+MAX_CODES = 20
+
+
+class ParseStats:
+    """
+    Counters and timings of the sections of parsed dat files
+    """
+
+    def __init__(self):
+        self.files = 0
+        self.sections = {}
+        self.unresolved = {}
+        self.errors = []
+
+    def _section(self, section):
+        counters = self.sections.get(section)
+        if counters is None:
+            counters = self.sections[section] = {
+                    "seconds": 0.0, "lines": 0, "records": 0, "ended": 0}
+        return counters
+
+    def count_lines(self, section, lines):
+        """
+        Pass the lines of a section through, counting them, and the section
+        as ended if the lines (iter_section_lines) reached its end marker
+        """
+        counters = self._section(section)
+        lines = iter(lines)
+        while True:
+            try:
+                line = next(lines)
+            except StopIteration as stop:
+                counters["ended"] += bool(stop.value)
+                return
+            counters["lines"] += 1
+            yield line
+
+    def incomplete_sections(self, required=SECTIONS[1:]):
+        """
+        Problems with the required sections of the files parsed: sections
+        missing, or without their end marker in some file (e.g. a truncated
+        file). Empty if every file was complete
+        """
+        problems = []
+        for section in required:
+            counters = self.sections.get(section)
+            if counters is None:
+                problems.append(f"no {section} section")
+            elif counters["ended"] < self.files:
+                problems.append(f"no end marker after the {section} section")
+        return problems
+
+    def start(self):
+        """
+        Start timing a section
+        """
+        return time.perf_counter()
+
+    def add_section(self, section, start, records):
+        """
+        Record the time since start and the records of a section
+        """
+        counters = self._section(section)
+        counters["seconds"] += time.perf_counter() - start
+        counters["records"] += records
+
+    def unresolved_reference(self, kind, code):
+        """
+        Count a feature reference to a dataset code (kind "flow_data",
+        "wq_data" or "eff_data") that is not in its section
+        """
+        codes = self.unresolved.setdefault(kind, {})
+        codes[code] = codes.get(code, 0) + 1
+
+    def error(self, file_path, message):
+        self.errors.append({"file": file_path, "error": message})
+
+    def summary(self):
+        """
+        Structured summary, json serialisable. Sections are listed in file
+        order and unresolved references with their most common codes
+        """
+        order = {section: n for n, section in enumerate(SECTIONS)}
+        unresolved = {}
+        for kind, codes in self.unresolved.items():
+            common = sorted(codes.items(), key=lambda item: -item[1])
+            unresolved[kind] = {
+                    "count": sum(codes.values()),
+                    "codes": dict(common[:MAX_CODES]),
+                    }
+        return {
+                "files": self.files,
+                "sections": {
+                    section: dict(self.sections[section])
+                    for section in sorted(self.sections,
+                                          key=lambda s: order.get(s, len(order)))
+                    },
+                "unresolved": unresolved,
+                "errors": list(self.errors),
+                }
+
+    def merge(self, summary):
+        """
+        Add the summary of another ParseStats, e.g. from a worker process.
+        Only the most common unresolved codes of the summary are known
+        """
+        self.files += summary["files"]
+        for section, counters in summary["sections"].items():
+            totals = self._section(section)
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+        for kind, unresolved in summary["unresolved"].items():
+            codes = self.unresolved.setdefault(kind, {})
+            for code, count in unresolved["codes"].items():
+                codes[code] = codes.get(code, 0) + count
+            # References beyond the listed codes
+            missing = unresolved["count"] - sum(unresolved["codes"].values())
+            if missing:
+                codes["(other)"] = codes.get("(other)", 0) + missing
+        self.errors.extend(summary["errors"])
+
+    def report(self):
+        """
+        Summary as text, one line per section
+        """
+        summary = self.summary()
+        lines = [f"{summary['files']} files"]
+        for section, counters in summary["sections"].items():
+            lines.append(f"    {section}: {counters['seconds']:.3f}s, "
+                         f"{counters['lines']} lines, "
+                         f"{counters['records']} records")
+        for kind, unresolved in summary["unresolved"].items():
+            codes = ", ".join(f"{code} ({count})" for code, count in
+                              unresolved["codes"].items())
+            lines.append(f"    unresolved {kind}: {unresolved['count']} "
+                         f"references to {codes}")
+        for error in summary["errors"]:
+            lines.append(f"    error in {error['file']}: {error['error']}")
+        return "\n".join(lines)
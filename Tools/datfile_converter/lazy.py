@@ -0,0 +1,251 @@
+"""
+Lazy access to the sections of a dat file
+
+The file is memory mapped and scanned once for the start and end markers
+in datfile.config. Each section is only decoded and parsed the first time
+it is used, so reading the Reaches connectivity or the Features coordinates
+does not parse the dataset sections. Features resolve their flow, quality
+and effluent data from the dataset sections on access.
+
+Example:
+    with LazyDatFile("EXAMPLE.dat") as dat_file:
+        reach = dat_file.reaches["1"]
+"""
+
+import re
+import mmap
+from itertools import islice
+from collections.abc import Mapping
+from datfile import config, get_coordinates, new_dat_file
+from dat_to_json import (process_metadata, process_determinand_section,
+                         process_reaches_section, process_river_flow_section,
+                         process_river_quality_section,
+                         process_effluent_section, split_feature_line)
+from sections import (process_river_flow_section_bulk,
+                      process_river_quality_section_bulk,
+                      process_effluent_section_bulk)
+from normalised import LazyFeature
+
+# Dataset table of the normalised layout and the section holding it
+TABLE_SECTIONS = {
+        "flow_datasets": "RiverFlow",
+        "wq_datasets": "RiverQuality",
+        "effluent_datasets": "Effluent",
+        }
+
+
+def scan_sections(buffer, config=config):
+    """
+    Find the byte range of every section in a single regex scan of the
+    buffer. Returns {section: (first byte after the start marker line,
+    first byte of the end marker line)}
+    """
+    markers = {}
+    for section, section_markers in config.items():
+        markers[section_markers["start"].encode()] = (section, "start")
+        markers[section_markers["end"].encode()] = (section, "end")
+    pattern = re.compile(
+            rb"^(" + b"|".join(re.escape(m) for m in markers) + rb")[ \t]*\r?$",
+            re.MULTILINE)
+
+    # Same rules as iter_sections: inside a section only its end counts
+    offsets = {}
+    current = None
+    for match in pattern.finditer(buffer):
+        section, kind = markers[match.group(1)]
+        if current is None and kind == "start":
+            current, start = section, match.end() + 1
+        elif current == section and kind == "end":
+            offsets[current] = (start, match.start())
+            current = None
+    return offsets
+
+
+class SectionTables(Mapping):
+    """
+    Dataset tables of a LazyDatFile, parsing each section when first used
+    """
+    __slots__ = ("dat_file",)
+
+    def __init__(self, dat_file):
+        self.dat_file = dat_file
+
+    def __getitem__(self, table):
+        return self.dat_file.datasets(TABLE_SECTIONS[table])
+
+    def __iter__(self):
+        return iter(TABLE_SECTIONS)
+
+    def __len__(self):
+        return len(TABLE_SECTIONS)
+
+
+class ReachFeatures(Mapping):
+    """
+    Features of a reach, parsing the Features section when first used
+    """
+    __slots__ = ("dat_file", "simno")
+
+    def __init__(self, dat_file, simno):
+        self.dat_file = dat_file
+        self.simno = simno
+
+    def _features(self):
+        return self.dat_file.reach_features.get(self.simno, {})
+
+    def __getitem__(self, feature_id):
+        return self._features()[feature_id]
+
+    def __iter__(self):
+        return iter(self._features())
+
+    def __len__(self):
+        return len(self._features())
+
+
+class LazyDatFile(Mapping):
+    """
+    Dat file in the DatFile layout, with every section parsed on first
+    access. Dataset sections are tokenised in bulk unless bulk=False
+    """
+
+    def __init__(self, file_path, config=config, bulk=True):
+        self.file_path = file_path
+        self.bulk = bulk
+        self.parsed = {}
+        with open(file_path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = scan_sections(self.buffer, config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Close the memory map. Sections already parsed are kept
+        """
+        self.buffer.close()
+
+    def __repr__(self):
+        return (f"LazyDatFile({self.file_path!r}, "
+                f"parsed={list(self.parsed)})")
+
+    # DatFile layout
+    def __getitem__(self, key):
+        if key not in ("metadata", "determinands", "reaches"):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(("metadata", "determinands", "reaches"))
+
+    def __len__(self):
+        return 3
+
+    def section_lines(self, section):
+        """
+        Return the stripped lines of a section, decoded from the map
+        """
+        if section not in self.offsets:
+            raise KeyError(f"Section '{section}' not found in {self.file_path}")
+        start, end = self.offsets[section]
+        return [line.strip() for line in
+                self.buffer[start:end].decode().splitlines()]
+
+    def section(self, section):
+        """
+        Parse a section the first time it is requested and keep the result
+        """
+        if section not in self.parsed:
+            self.parsed[section] = getattr(self, f"_parse_{section}")()
+        return self.parsed[section]
+
+    def _parse_metadata(self):
+        self.buffer.seek(0)
+        lines = (line.decode() for line in iter(self.buffer.readline, b""))
+        dat_file = new_dat_file()
+        process_metadata(islice(lines, 10), dat_file)
+        return dat_file["metadata"]
+
+    def _parse_Determinands(self):
+        return process_determinand_section(
+                self.section_lines("Determinands"), {})
+
+    def _parse_Reaches(self):
+        scratch = {"reaches": {}}
+        process_reaches_section(
+                self.section_lines("Reaches"), scratch, self.determinands)
+        for simno, reach in scratch["reaches"].items():
+            reach["features"] = ReachFeatures(self, simno)
+        return scratch["reaches"]
+
+    def _parse_RiverFlow(self):
+        handler = (process_river_flow_section_bulk if self.bulk
+                   else process_river_flow_section)
+        return handler(self.section_lines("RiverFlow"), {})
+
+    def _parse_RiverQuality(self):
+        handler = (process_river_quality_section_bulk if self.bulk
+                   else process_river_quality_section)
+        return handler(self.section_lines("RiverQuality"), {},
+                       self.determinands)
+
+    def _parse_Effluent(self):
+        handler = (process_effluent_section_bulk if self.bulk
+                   else process_effluent_section)
+        return handler(self.section_lines("Effluent"), {}, self.determinands)
+
+    def _parse_Features(self):
+        """
+        Group features by reach, numbered in file order as in
+        process_features_section. Datasets are looked up when accessed
+        """
+        tables = SectionTables(self)
+        reach_features = {}
+        count = 1
+        for line in self.section_lines("Features"):
+            if "WBID:" in line:
+                continue
+            name, code, simno, dist_head, flow_code, wq_code, _, _, _, \
+                giscode = split_feature_line(line)
+            long, lat = get_coordinates(giscode)
+            reach_features.setdefault(simno, {})[count] = LazyFeature({
+                    "name": name,
+                    "feat_code": code,
+                    "dist_head": float(dist_head),
+                    "giscode": {
+                        "long": long,
+                        "lat": lat
+                        },
+                    "flow_code": flow_code,
+                    "wq_code": wq_code,
+                    }, tables)
+            count += 1
+        return reach_features
+
+    @property
+    def metadata(self):
+        return self.section("metadata")
+
+    @property
+    def determinands(self):
+        return self.section("Determinands")
+
+    @property
+    def reaches(self):
+        return self.section("Reaches")
+
+    @property
+    def reach_features(self):
+        return self.section("Features")
+
+    def datasets(self, section):
+        """
+        Return the datasets of RiverFlow, RiverQuality or Effluent by code
+        """
+        if section not in TABLE_SECTIONS.values():
+            raise ValueError(f"'{section}' is not a dataset section")
+        return self.section(section)
@@ -0,0 +1,254 @@
+"""
+Reach network index built from the Reaches connectivity
+
+Reaches are connected in two ways (see the notes of section [3]):
+    older version, (d), (e) and (f) give the reach processed next:
+        0,x,0  the next reach, x, starts a new branch
+        x,0,0  the next reach, x, is a straight continuation of this one
+        z,y,x  the next reach, x, is formed by mixing z and y
+    newer version, (d) is the downstream reach and (e) and (f) are 'x'
+
+Each reach has at most one downstream reach, so the network is a forest
+rooted at the outlets. It is stored as arrays: the downstream reach of
+each reach, the upstream reaches in CSR layout and a depth first order
+from the outlets in which the upstream reaches of any reach are a
+contiguous slice. Upstream and downstream sets and paths are then
+answered in time proportional to their size.
+
+Example:
+    network = ReachNetwork.from_model(load_model("EXAMPLE.dat"))
+    network.upstream("9")
+"""
+
+import numpy as np
+
+
+def connectivity_edges(simnos, connectivity):
+    """
+    Return the (upstream simno, downstream simno) pairs defined by the
+    connectivity codes (conn1, conn2, conn3) of each reach
+    """
+    edges = []
+    for simno, (conn1, conn2, conn3) in zip(simnos, connectivity):
+        # Newer version: next downstream reach and two dummy values
+        if conn2.lower() == "x" or conn3.lower() == "x":
+            if conn1 != "0":
+                edges.append((simno, conn1))
+        # Older version: straight continuation
+        elif conn1 != "0" and conn2 == "0" and conn3 == "0":
+            edges.append((simno, conn1))
+        # Older version: mixing of two reaches
+        elif conn1 != "0" and conn2 != "0" and conn3 != "0":
+            edges.append((conn1, conn3))
+            edges.append((conn2, conn3))
+    return edges
+
+
+class ReachNetwork:
+    """
+    Array backed index of the reach network. Reaches are referred to by
+    simno in the public methods and by their file order index in the arrays
+    """
+
+    def __init__(self, simnos, connectivity, lengths):
+        self.simnos = list(simnos)
+        self.index = {simno: n for n, simno in enumerate(self.simnos)}
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        size = len(self.simnos)
+
+        # Downstream reach of each reach, -1 at the outlets
+        downstream = np.full(size, -1, dtype=np.int64)
+        for up, down in connectivity_edges(self.simnos, connectivity):
+            if up not in self.index or down not in self.index:
+                raise ValueError(f"Connectivity from reach {up} to {down} "
+                                 f"refers to a reach that does not exist")
+            n = self.index[up]
+            if downstream[n] not in (-1, self.index[down]):
+                raise ValueError(f"Reach {up} drains into more than one reach")
+            downstream[n] = self.index[down]
+        self.downstream = downstream
+
+        # Upstream reaches in CSR layout, in file order within each reach
+        has_down = np.flatnonzero(downstream >= 0)
+        order = has_down[np.argsort(downstream[has_down], kind="stable")]
+        counts = np.bincount(downstream[has_down], minlength=size)
+        self.up_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.up_index = order
+
+        self.topological = self._topological_order()
+        self._depth_first_order()
+        self.head_distance = self._head_distance()
+
+    @classmethod
+    def from_model(cls, model):
+        """
+        Build the network of a DatModel
+        """
+        pool = model.pool
+        reaches = model.reaches
+        conns = [[pool[code] for code in reaches[name].tolist()]
+                 for name in ("conn1", "conn2", "conn3")]
+        return cls([pool[code] for code in reaches["simno"].tolist()],
+                   list(zip(*conns)), reaches["length"])
+
+    @classmethod
+    def from_reaches(cls, reaches):
+        """
+        Build the network of the reaches dict of a DatFile
+        """
+        return cls(reaches,
+                   [(r["connectivity"]["conn1"], r["connectivity"]["conn2"],
+                     r["connectivity"]["conn3"]) for r in reaches.values()],
+                   [r["length"] for r in reaches.values()])
+
+    def __len__(self):
+        return len(self.simnos)
+
+    def _upstream_of(self, n):
+        return self.up_index[self.up_offsets[n]:self.up_offsets[n + 1]]
+
+    def _topological_order(self):
+        """
+        Reaches ordered from the headwaters to the outlets, every reach
+        after all the reaches draining into it
+        """
+        remaining = np.diff(self.up_offsets).copy()
+        ready = np.flatnonzero(remaining == 0).tolist()
+        downstream = self.downstream.tolist()
+        order = []
+        while ready:
+            n = ready.pop()
+            order.append(n)
+            down = downstream[n]
+            if down >= 0:
+                remaining[down] -= 1
+                if remaining[down] == 0:
+                    ready.append(down)
+        if len(order) != len(self.simnos):
+            raise ValueError("The reach connectivity has a loop")
+        return np.array(order, dtype=np.int64)
+
+    def _depth_first_order(self):
+        """
+        Depth first order from the outlets over upstream links. Each reach is
+        followed by all its upstream reaches, size of them
+        """
+        size = np.ones(len(self.simnos), dtype=np.int64)
+        for n in self.topological.tolist():
+            down = self.downstream[n]
+            if down >= 0:
+                size[down] += size[n]
+        self.subtree_size = size
+
+        order = []
+        stack = np.flatnonzero(self.downstream < 0)[::-1].tolist()
+        while stack:
+            n = stack.pop()
+            order.append(n)
+            stack.extend(self._upstream_of(n)[::-1].tolist())
+        self.dfs_order = np.array(order, dtype=np.int64)
+        self.dfs_position = np.empty(len(order), dtype=np.int64)
+        self.dfs_position[self.dfs_order] = np.arange(len(order))
+
+    def _head_distance(self):
+        """
+        Distance from the furthest headwater to the top of each reach
+        """
+        distance = np.zeros(len(self.simnos))
+        for n in self.topological.tolist():
+            down = self.downstream[n]
+            if down >= 0:
+                distance[down] = max(distance[down],
+                                     distance[n] + self.lengths[n])
+        return distance
+
+    def upstream_indices(self, simno, include_self=False):
+        """
+        Indices of every reach draining into a reach, as a slice of the depth
+        first order
+        """
+        n = self.index[simno]
+        start = self.dfs_position[n] + (0 if include_self else 1)
+        return self.dfs_order[start:self.dfs_position[n] + self.subtree_size[n]]
+
+    def upstream(self, simno, include_self=False):
+        """
+        Simnos of every reach draining into a reach
+        """
+        return [self.simnos[n] for n in
+                self.upstream_indices(simno, include_self).tolist()]
+
+    def directly_upstream(self, simno):
+        """
+        Simnos of the reaches flowing straight into a reach
+        """
+        return [self.simnos[n] for n in
+                self._upstream_of(self.index[simno]).tolist()]
+
+    def downstream_of(self, simno):
+        """
+        Simno of the reach a reach flows into, None at an outlet
+        """
+        down = self.downstream[self.index[simno]]
+        return None if down < 0 else self.simnos[down]
+
+    def path(self, simno, to=None):
+        """
+        Simnos from a reach down to another reach, or to the outlet. Raises
+        ValueError if the second reach is not downstream of the first
+        """
+        n = self.index[simno]
+        end = None if to is None else self.index[to]
+        path = [n]
+        while n != end and self.downstream[n] >= 0:
+            n = int(self.downstream[n])
+            path.append(n)
+        if end is not None and n != end:
+            raise ValueError(f"Reach {to} is not downstream of reach {simno}")
+        return [self.simnos[n] for n in path]
+
+    def is_upstream(self, simno, of):
+        """
+        Whether a reach drains into another one
+        """
+        n, m = self.index[simno], self.index[of]
+        offset = self.dfs_position[n] - self.dfs_position[m]
+        return 0 < offset < self.subtree_size[m]
+
+    def headwaters(self):
+        """
+        Simnos of the reaches with nothing upstream
+        """
+        return [self.simnos[n] for n in
+                np.flatnonzero(np.diff(self.up_offsets) == 0).tolist()]
+
+    def outlets(self):
+        """
+        Simnos of the reaches not flowing into another reach
+        """
+        return [self.simnos[n] for n in
+                np.flatnonzero(self.downstream < 0).tolist()]
+
+    def distance_from_head(self, simno):
+        """
+        Distance in km from the furthest headwater to the top of a reach
+        """
+        return self.head_distance[self.index[simno]].item()
+
+    def path_distances(self, path):
+        """
+        Cumulative distance in km to the top of each reach of a path, from
+        the top of its first reach
+        """
+        lengths = self.lengths[[self.index[simno] for simno in path]]
+        return np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+
+
+def feature_chainage(model, network=None):
+    """
+    Distance of every feature of a DatModel from the furthest headwater,
+    i.e. the distance to the top of its reach plus its dist_head
+    """
+    network = network or ReachNetwork.from_model(model)
+    features = model.features
+    return network.head_distance[features["reach"]] + features["dist_head"]
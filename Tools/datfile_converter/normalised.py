@@ -0,0 +1,180 @@
+"""
+Normalised json export of the dat file data
+
+Features only keep the flow_code and wq_code of the datasets they use and
+each dataset is written once in the top level flow_datasets, wq_datasets and
+effluent_datasets tables, instead of being copied into every feature.
+load_normalised_json rebuilds the usual DatFile layout lazily on access
+"""
+
+import json
+from collections.abc import Mapping
+from model import EFFLUENT_FEATURES
+
+# Dataset tables of the normalised layout and the feature key resolving them
+DATASET_TABLES = {
+        "flow_data": "flow_datasets",
+        "wq_data": "wq_datasets",
+        "eff_data": "effluent_datasets",
+        }
+
+
+def model_to_normalised(model):
+    """
+    Return a DatModel in the normalised layout
+    """
+    reaches = {}
+    for reach in model.iter_reaches():
+        reach_dict = reach.to_dict_without_features()
+        reach_dict["features"] = {
+                feature.id: {
+                    "name": feature.name,
+                    "feat_code": feature.feat_code,
+                    "dist_head": feature.dist_head,
+                    "giscode": {
+                        "long": feature.easting,
+                        "lat": feature.northing
+                        },
+                    "flow_code": feature.flow_code,
+                    "wq_code": feature.wq_code,
+                    }
+                for feature in reach.features
+                }
+        reaches[reach.simno] = reach_dict
+
+    return {
+            "metadata": dict(model.metadata),
+            "determinands": model.determinands,
+            "reaches": reaches,
+            "flow_datasets": {
+                code: model.flow.flow_dict(n)
+                for code, n in model.flow.index.items()
+                },
+            "wq_datasets": {
+                code: model.wq.determinand_dict(n, model.det_names)
+                for code, n in model.wq.index.items()
+                },
+            "effluent_datasets": {
+                code: model.eff.determinand_dict(n, model.eff_names)
+                for code, n in model.eff.index.items()
+                },
+            }
+
+
+def write_normalised_json(model, file_path, indent=4):
+    """
+    Export a DatModel as normalised json
+    """
+    with open(file_path, "w") as outfile:
+        json.dump(model_to_normalised(model), outfile, indent=indent,
+                  sort_keys=False)
+
+
+class LazyFeature(Mapping):
+    """
+    Feature in the DatFile layout, resolving its flow, quality or effluent
+    data from the dataset tables on access. Resolved datasets are shared
+    between features, not copies
+    """
+    __slots__ = ("feature", "tables")
+
+    def __init__(self, feature, tables):
+        self.feature = feature
+        self.tables = tables
+
+    def _keys(self):
+        keys = [k for k in self.feature if k not in ("flow_code", "wq_code")]
+        if self.feature["feat_code"] in EFFLUENT_FEATURES:
+            return keys + ["eff_data"]
+        return keys + ["flow_data", "wq_data"]
+
+    def __getitem__(self, key):
+        if key in DATASET_TABLES:
+            if key not in self._keys():
+                raise KeyError(key)
+            code = self.feature["flow_code" if key == "flow_data" else "wq_code"]
+            return self.tables[DATASET_TABLES[key]].get(code)
+        if key in ("flow_code", "wq_code"):
+            raise KeyError(key)
+        return self.feature[key]
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return f"LazyFeature({self.feature['name']!r})"
+
+    def to_dict(self):
+        """Return the feature as a plain dict"""
+        return {key: self[key] for key in self}
+
+
+class LazyFeatures(Mapping):
+    """
+    Features of a reach, wrapped as LazyFeature when accessed
+    """
+    __slots__ = ("features", "tables")
+
+    def __init__(self, features, tables):
+        self.features = features
+        self.tables = tables
+
+    def __getitem__(self, feature_id):
+        return LazyFeature(self.features[feature_id], self.tables)
+
+    def __iter__(self):
+        return iter(self.features)
+
+    def __len__(self):
+        return len(self.features)
+
+
+def denormalise(data):
+    """
+    Rebuild the layout of a normalised dict with lazy features. Dataset
+    tables are looked up when a feature's flow_data, wq_data or eff_data is
+    accessed
+    """
+    tables = {name: data.get(name, {}) for name in DATASET_TABLES.values()}
+    reaches = {}
+    for simno, reach in data["reaches"].items():
+        reach = dict(reach)
+        reach["features"] = LazyFeatures(reach["features"], tables)
+        reaches[simno] = reach
+    return {
+            "metadata": data["metadata"],
+            "determinands": data["determinands"],
+            "reaches": reaches,
+            }
+
+
+def load_normalised_json(file_path):
+    """
+    Load a normalised json export in the DatFile layout, with datasets
+    resolved lazily
+    """
+    with open(file_path) as f:
+        return denormalise(json.load(f))
+
+
+def to_plain_dict(dat_file):
+    """
+    Materialise a lazily loaded DatFile into plain dicts, e.g. to dump it
+    """
+    return {
+            "metadata": dat_file["metadata"],
+            "determinands": dat_file["determinands"],
+            "reaches": {
+                simno: {
+                    **{k: v for k, v in reach.items() if k != "features"},
+                    "features": {
+                        feature_id: feature.to_dict()
+                        for feature_id, feature in reach["features"].items()
+                        },
+                    }
+                for simno, reach in dat_file["reaches"].items()
+                },
+            }
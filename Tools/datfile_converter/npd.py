@@ -0,0 +1,149 @@
+"""
+Lazy, shared loading of NPD (non-parametric distribution) files
+
+Datasets with non-parametric distributions only name an NPD file, which
+sits next to the dat file and is often referenced by many features. An
+NpdStore hands out one LazyNpd per file name, so every dataset using a
+file shares it, and the file is only read and parsed into a NumPy array
+the first time its values are used. With a cache folder, parsed arrays
+are also saved as .npy files keyed by the file's hash and memory mapped
+on later runs.
+
+Example:
+    store = NpdStore("scenarios/baseline")
+    values = store["IntFlow3_1.npd"].values
+"""
+
+import os
+import numpy as np
+from datfile import file_digest
+
+
+def read_npd(file_path):
+    """
+    Read the values of an NPD file. Lines that are not numbers (titles,
+    notes) are skipped. If the first numeric line is a single integer
+    matching the number of values after it, it is taken as the count of
+    values and dropped
+    """
+    rows = []
+    with open(file_path) as f:
+        for line in f:
+            try:
+                rows.append([float(v) for v in line.replace(",", " ").split()])
+            except ValueError:
+                continue
+    rows = [row for row in rows if row]
+
+    if rows and len(rows[0]) == 1 and rows[0][0].is_integer():
+        count = int(rows[0][0])
+        if count == sum(len(row) for row in rows[1:]):
+            rows = rows[1:]
+    return np.array([v for row in rows for v in row], dtype=np.float64)
+
+
+class LazyNpd:
+    """
+    Values of an NPD file, read on first access and then kept
+    """
+    __slots__ = ("store", "filename", "_values")
+
+    def __init__(self, store, filename):
+        self.store = store
+        self.filename = filename
+        self._values = None
+
+    def __repr__(self):
+        state = "loaded" if self.loaded else "not loaded"
+        return f"LazyNpd({self.filename!r}, {state})"
+
+    @property
+    def loaded(self):
+        return self._values is not None
+
+    @property
+    def values(self):
+        if self._values is None:
+            self._values = self.store.load(self.filename)
+        return self._values
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.values, dtype=dtype)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __bool__(self):
+        # Checking for a file must not read it
+        return True
+
+
+class NpdStore:
+    """
+    NPD files of a folder, shared between all the datasets referencing them.
+    cache_dir, if given, keeps parsed arrays as memory mapped .npy files
+    """
+
+    def __init__(self, folder, cache_dir=None):
+        self.folder = folder
+        self.cache_dir = cache_dir
+        self.files = {}
+
+    def __getstate__(self):
+        # Loaded arrays are not pickled, they are read again when used
+        return {"folder": self.folder, "cache_dir": self.cache_dir}
+
+    def __setstate__(self, state):
+        self.__init__(state["folder"], state["cache_dir"])
+
+    def __getitem__(self, filename):
+        """
+        Return the shared LazyNpd of a file name, without reading it
+        """
+        npd = self.files.get(filename)
+        if npd is None:
+            npd = self.files[filename] = LazyNpd(self, filename)
+        return npd
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def path(self, filename):
+        """
+        Path of an NPD file, matching the file name case insensitively as
+        dat files written on Windows do not always match the case on disk
+        """
+        path = os.path.join(self.folder, filename)
+        if os.path.exists(path):
+            return path
+        lower = filename.lower()
+        for name in os.listdir(self.folder or "."):
+            if name.lower() == lower:
+                return os.path.join(self.folder, name)
+        raise FileNotFoundError(f"NPD file '{filename}' not found in "
+                                f"'{self.folder}'")
+
+    def load(self, filename):
+        """
+        Read and parse an NPD file, through the cache folder if there is one
+        """
+        path = self.path(filename)
+        if self.cache_dir is None:
+            return read_npd(path)
+
+        cache_path = os.path.join(self.cache_dir, f"{file_digest(path)}.npy")
+        if not os.path.exists(cache_path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, read_npd(path))
+            os.replace(tmp_path, cache_path)
+        return np.load(cache_path, mmap_mode="r")
+
+    def loaded(self):
+        """
+        Return the file names that have been read so far
+        """
+        return [name for name, npd in self.files.items() if npd.loaded]
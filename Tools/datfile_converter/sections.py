@@ -0,0 +1,230 @@
+"""
+Bulk parsing of the dataset sections of the dat file ([4] River Flow,
+[5] River Quality and [6] Effluent Flow and Quality) into typed NumPy columns
+
+The columns are read directly by model.load_model. The *_bulk handlers
+expand them into the DatFile dicts of the line by line parsers, which costs
+about as much as the tokenising saves
+"""
+
+from itertools import chain
+import numpy as np
+
+# Numeric fields of each line variant, in file order. The site name (and the
+# NPD file name for non-parametric distributions) are quoted and come after.
+# For river flow the "std" column holds the 95-percentile low flow.
+LAYOUTS = {
+        "RiverFlow": {
+            "standard": ("code", "dist", "mean", "std", "shift", "corr"),
+            "npd": ("code", "dist", "corr"),
+            },
+        "RiverQuality": {
+            "standard": ("code", "det_code", "dist", "mean", "std", "shift",
+                         "corr", "sample_n"),
+            "power": ("code", "det_code", "dist", "mean", "std", "power_idx",
+                      "base_conc", "cut_off_pc", "corr", "sample_n"),
+            "npd": ("code", "det_code", "dist", "corr", "sample_n"),
+            },
+        }
+LAYOUTS["Effluent"] = LAYOUTS["RiverQuality"]
+
+NPD_EXTENSIONS = (".npd", ".NPD")
+
+FLOAT_COLUMNS = ("dist", "mean", "std", "shift", "power_idx", "base_conc",
+                 "cut_off_pc", "corr", "sample_n")
+
+
+def tokenise_section(lines, section):
+    """
+    Tokenise a whole dataset section at once into typed NumPy columns:
+    code, det_code, dist, mean, std, shift, power_idx, base_conc, cut_off_pc,
+    corr, sample_n, npd_filename and the quoted title of each line, plus the
+    "is_power" and "is_npd" masks. Fields that do not apply to a line variant
+    are NaN
+    """
+    layouts = LAYOUTS[section]
+
+    # Single pass to split the lines, all the heavy work is done in bulk below.
+    # Only the numeric tokens are kept, plus the NPD file names and titles
+    rows = []
+    titles = []
+    npd_filenames = {}
+    for line in lines:
+        parts = line.split("'")
+        tokens = parts[0].split()
+        if not tokens:
+            continue
+        # The NPD file name is the first of two quoted strings
+        if len(parts) > 3 and parts[1].endswith(NPD_EXTENSIONS):
+            tokens += parts[2].split()
+            npd_filenames[len(rows)] = parts[1]
+            titles.append(parts[3])
+        else:
+            titles.append(parts[1] if len(parts) > 1 else "")
+        rows.append(tokens)
+
+    # Convert every numeric token of the section in one go
+    size = len(rows)
+    counts = np.fromiter(map(len, rows), dtype=np.intp, count=size)
+    starts = np.cumsum(counts) - counts
+    values = np.array(list(chain.from_iterable(rows)), dtype=np.float64)
+
+    columns = {
+            "code": np.array([tokens[0] for tokens in rows], dtype=str),
+            "det_code": np.zeros(size, dtype=np.int64),
+            "npd_filename": np.full(size, "", dtype=object),
+            "title": np.array(titles, dtype=str),
+            "is_power": np.zeros(size, dtype=bool),
+            "is_npd": np.zeros(size, dtype=bool),
+            }
+    for name in FLOAT_COLUMNS:
+        columns[name] = np.full(size, np.nan)
+
+    # Mask each line variant
+    is_npd = columns["is_npd"]
+    is_npd[list(npd_filenames)] = True
+    columns["npd_filename"][list(npd_filenames)] = list(npd_filenames.values())
+    columns["npd_filename"] = columns["npd_filename"].astype(str)
+    masks = {"npd": is_npd}
+    for variant, fields in layouts.items():
+        if variant != "npd":
+            masks[variant] = ~is_npd & (counts == len(fields))
+    unknown = ~np.logical_or.reduce(list(masks.values()))
+    if unknown.any():
+        raise ValueError(
+                f"Unexpected number of fields in {section} line "
+                f"{' '.join(rows[np.flatnonzero(unknown)[0]])}")
+    if "power" in masks:
+        columns["is_power"] = masks["power"]
+
+    # Gather each masked group as a 2D block and scatter it into the columns
+    for variant, fields in layouts.items():
+        rows_idx = np.flatnonzero(masks[variant])
+        if not rows_idx.size:
+            continue
+        block = values[starts[rows_idx, None] + np.arange(1, len(fields))]
+        for col, name in enumerate(fields[1:]):
+            if name == "det_code":
+                columns[name][rows_idx] = block[:, col].astype(np.int64)
+            else:
+                columns[name][rows_idx] = block[:, col]
+
+    return columns
+
+
+def flow_params(is_npd, dist, mean, std, shift, corr, npd_filename):
+    """
+    River flow parameters of a dataset in the DatFile layout
+    """
+    if is_npd:
+        return {
+                "dist": dist,
+                "npd_filename": npd_filename,
+                "corr": corr
+                }
+    return {
+            "dist": dist,
+            "mean_flow": mean,
+            "low_95th_flow": std,
+            "shift_flow": shift,
+            "corr": corr
+            }
+
+
+def determinand_params(is_power, is_npd, dist, mean, std, shift, power_idx,
+                       base_conc, cut_off_pc, corr, sample_n, npd_filename):
+    """
+    River quality or effluent parameters of a determinand in the DatFile
+    layout
+    """
+    if is_npd:
+        return {
+                "dist": dist,
+                "npd_filename": npd_filename,
+                "corr": corr,
+                "sample_n": sample_n
+                }
+    if is_power:
+        return {
+                "dist": dist,
+                "mean_conc": mean,
+                "std": std,
+                "power_idx": power_idx,
+                "base_conc": base_conc,
+                "cut_off_pc": cut_off_pc,
+                "corr": corr,
+                "sample_n": sample_n
+                }
+    return {
+            "dist": dist,
+            "mean_conc": mean,
+            "std": std,
+            "shift_conc": shift,
+            "corr": corr,
+            "sample_n": sample_n
+            }
+
+
+def process_river_flow_section_bulk(lines, dat_file):
+    """
+    Bulk version of process_river_flow_section
+    [4] River Flow - dist type, params, linked to feature
+    """
+    cols = tokenise_section(lines, "RiverFlow")
+    flow_data = {}
+    for code, *params in zip(
+            cols["code"].tolist(), cols["is_npd"].tolist(),
+            cols["dist"].tolist(), cols["mean"].tolist(),
+            cols["std"].tolist(), cols["shift"].tolist(),
+            cols["corr"].tolist(), cols["npd_filename"].tolist()):
+        flow_data[code] = flow_params(*params)
+
+    # Return dictionary to use data later
+    return flow_data
+
+
+def columns_to_determinand_dicts(cols, det_names, first_det):
+    """
+    Convert River Quality or Effluent columns into the nested dictionaries
+    used by DatFile, keyed by dataset code and determinand short name. A new
+    dataset starts at each line with determinand code first_det
+    """
+    data = {}
+    for code, det_code, *params in zip(
+            cols["code"].tolist(), cols["det_code"].tolist(),
+            cols["is_power"].tolist(), cols["is_npd"].tolist(),
+            cols["dist"].tolist(), cols["mean"].tolist(),
+            cols["std"].tolist(), cols["shift"].tolist(),
+            cols["power_idx"].tolist(), cols["base_conc"].tolist(),
+            cols["cut_off_pc"].tolist(), cols["corr"].tolist(),
+            cols["sample_n"].tolist(), cols["npd_filename"].tolist()):
+
+        # Initialise for first determinand
+        if det_code == first_det:
+            data[code] = {}
+
+        data[code][det_names[det_code]] = determinand_params(*params)
+
+    return data
+
+
+def process_river_quality_section_bulk(lines, dat_file, det_units_dict):
+    """
+    Bulk version of process_river_quality_section
+    [5] River Quality - per determinand, dist type and params, linked to feature
+    """
+    cols = tokenise_section(lines, "RiverQuality")
+    det_names = {int(k): v["short_name"] for k, v in det_units_dict.items()}
+    return columns_to_determinand_dicts(cols, det_names, 1)
+
+
+def process_effluent_section_bulk(lines, dat_file, det_units_dict):
+    """
+    Bulk version of process_effluent_section
+    [6] Effluent Flow and Quality - flow and per det, dist type and params,
+    linked to feature
+    """
+    cols = tokenise_section(lines, "Effluent")
+    det_names = {int(k): v["short_name"] for k, v in det_units_dict.items()}
+    det_names[0] = "Flow"
+    return columns_to_determinand_dicts(cols, det_names, 0)
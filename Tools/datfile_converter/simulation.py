@@ -0,0 +1,686 @@
+"""
+Monte Carlo mass balance of a dat file, vectorised across shots
+
+A SIMCAT style run of the parsed model: every river flow, river quality and
+effluent dataset is sampled as an array of shots (730 by default, from the
+General data), reaches are processed from the headwaters down to the outlets
+and flows and loads are mixed, added and decayed feature by feature. All the
+shots of a reach are handled at once as NumPy arrays, so a run costs a few
+array operations per feature. The mean and the 90, 95 and 99-percentile
+concentrations of every determinand are reported at every feature.
+
+How the data are used:
+    flows       log-normal (2), 3 parameter log-normal (3) and normal (1)
+                distributions are fitted to the mean and 95-percentile low
+                flow of the river flow datasets
+    quality     normal, log-normal and 3 parameter log-normal from the mean
+                and standard deviation, correlated with the flow shots
+                through the corr column (-9.9 means no correlation).
+                Loads (kg/d) are added as they are: river quality
+                distributions 6 (normal), 7 (log-normal), 9 (NPD) and 11,
+                and effluent distributions 6 (log-normal) and 9 (NPD).
+                The distribution code alone decides: SAGIS built models
+                hold "Load" titled data-sets (e.g. "(Urban Load)") with
+                log-normal concentration rows (2) whose means run into
+                the thousands. These are taken as concentrations, as coded,
+                and counted in the warnings
+    NPD         shots of non-parametric distributions are the quantiles of
+                the values of the NPD file
+    decay       first order, C = Cmin + (C - Cmin) exp(-k t), with the reach
+                rate constants (or the global ones of the determinand) and
+                the time of travel from velocity = a Q^b in km/day.
+                Conservative (1) and DO (3) determinands do not decay
+
+Simplifications compared with SIMCAT: no gap filling (gauges and
+monitoring stations only report), no monthly data (5, 8 and effluent 7),
+power curves (10, 11) are taken as log-normal, no temperature corrections
+or DO and BOD interactions, and abstractions (7) take their mean rate only
+above the hands-off flow given as the second flow value. These are counted
+in the warnings of the results.
+
+Example:
+    python simulation.py EXAMPLE.dat -o EXAMPLE_results.csv
+"""
+
+import re
+import csv
+import zlib
+import math
+import time
+import argparse
+import numpy as np
+from datfile import config
+from model import load_model
+from network import ReachNetwork
+
+DEFAULT_SHOTS = 730
+PERCENTILES = (90, 95, 99)
+
+# Standard normal deviate of the 95-percentile
+Z95 = 1.6448536269514722
+
+# Distribution codes of the river quality and effluent data-sets: the
+# normal ones, those of loads rather than concentrations and those sampled
+# as given (the others are taken as log-normal with a warning). The two
+# sections number them differently
+QUALITY_DISTS = {"section": "quality", "normal": (1, 6),
+                 "loads": (6, 7, 9, 11), "supported": (0, 1, 2, 3, 4, 6, 7, 9)}
+EFFLUENT_DISTS = {"section": "effluent", "normal": (1,), "loads": (6, 7, 9),
+                  "supported": (0, 1, 2, 3, 4, 6, 9)}
+
+# Determinand types without decay: conservative and dissolved oxygen
+NO_DECAY_TYPES = (1, 3)
+
+# Feature codes
+BOUNDARY_FEATURES = ("10", "-10")
+RIVER_INPUTS = ("2",)
+EFFLUENT_INPUTS = ("3", "5", "12", "39", "60", "61")
+ABSTRACTIONS = ("7", "18", "19")
+BIFURCATIONS = ("11", "20", "21", "22", "23")
+REPORT_ONLY = ("1", "4", "6", "9", "17", "24", "44", "45")
+
+# Features whose wq column is an effluent data-set and bifurcations whose wq
+# column is a river flow data-set
+EFFLUENT_DATA = EFFLUENT_INPUTS + ("15", "19", "22", "23", "40", "42")
+FLOW_DATA_BIFURCATIONS = ("20", "21")
+
+# Diffuse start features and their end features. Effluent type diffuse
+# pollution (15), aggregated CSOs (40) and aggregated sewage works (42) use
+# effluent data, the others river flow and quality data
+DIFFUSE_STARTS = {
+        "13": "14", "15": "16", "25": "26", "27": "28", "29": "30",
+        "31": "32", "33": "34", "35": "36", "37": "38", "40": "41",
+        "42": "43", "46": "47", "48": "49", "50": "51", "52": "53",
+        "54": "55", "56": "57", "58": "59",
+        }
+DIFFUSE_ENDS = set(DIFFUSE_STARTS.values())
+
+# Random streams of the shots, mixed with the seed, the reach and the
+# position of the feature in the reach so edits elsewhere do not move them
+FEATURE_STREAM, REACH_STREAM, BIFURCATION_STREAM = 0, 1, 2
+
+normal_probability = np.vectorize(
+        lambda z: 0.5 * (1.0 + math.erf(z / math.sqrt(2.0))), otypes=[float])
+
+
+def read_run_settings(file_path, config=config):
+    """
+    Read the number of shots and mean temperature of the General data and
+    the type, global rate constant and minimum quality of each determinand,
+    which the dat file parsers do not keep
+    """
+    settings = {"shots": DEFAULT_SHOTS, "temperature": None, "det_types": [],
+                "global_rates": [], "min_quality": []}
+    start = config["Determinands"]["start"]
+    end = config["Determinands"]["end"]
+    in_determinands = False
+
+    with open(file_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line == start:
+                in_determinands = True
+            elif line == end:
+                break
+            elif in_determinands and line and not line.startswith("="):
+                # Numbers left after removing the quoted names and units
+                numbers = re.sub(r"'[^']*'", " ", line).split()
+                settings["det_types"].append(int(numbers[0]))
+                settings["global_rates"].append(float(numbers[1]))
+                settings["min_quality"].append(float(numbers[2]))
+            elif "number of shots" in line:
+                settings["shots"] = int(line.split()[0])
+            elif "mean temperature" in line:
+                settings["temperature"] = float(line.split()[0])
+    return settings
+
+
+def lognormal_shots(mean, std, z):
+    """
+    Shots of log-normal distributions given their means and standard
+    deviations, zero where the mean is not positive
+    """
+    positive = mean > 0
+    safe_mean = np.where(positive, mean, 1.0)
+    sigma2 = np.log1p((std / safe_mean) ** 2)
+    mu = np.log(safe_mean) - sigma2 / 2
+    return np.where(positive, np.exp(mu + np.sqrt(sigma2) * z), 0.0)
+
+
+def sample_values(dist, mean, std, shift, z,
+                  normal_dists=QUALITY_DISTS["normal"]):
+    """
+    Shots of the rows of a quality or effluent dataset from their mean and
+    standard deviation, rows x shots. NPD rows are filled in separately
+    """
+    dist = dist[:, None]
+    mean = mean[:, None]
+    std = np.abs(std)[:, None]
+    shift = np.where(dist == 3, np.nan_to_num(shift[:, None]), 0.0)
+    lognormal = lognormal_shots(mean + shift, std, z) - shift
+    normal = mean + std * z
+    values = np.where(np.isin(dist, normal_dists), normal, lognormal)
+    values = np.where(dist == 0, mean, values)
+    return np.maximum(values, 0.0)
+
+
+def flow_shots(dist, mean, low_flow, shift, z):
+    """
+    Shots of a river flow dataset from its mean and 95-percentile low flow
+    """
+    if dist == 0 or mean <= 0:
+        return np.full(len(z), max(mean, 0.0))
+    if dist == 1:
+        std = max(mean - low_flow, 0.0) / Z95
+        return np.maximum(mean + std * z, 0.0)
+
+    # Log-normal fitted to the mean and the 95-percentile, shifted for 3
+    shift = shift if dist == 3 and not np.isnan(shift) else 0.0
+    mean, low_flow = mean + shift, low_flow + shift
+    if low_flow >= mean:
+        return np.full(len(z), max(mean - shift, 0.0))
+    low_flow = max(low_flow, mean * 1e-3)
+    sigma = -Z95 + math.sqrt(Z95 ** 2 + 2 * math.log(mean / low_flow))
+    mu = math.log(mean) - sigma ** 2 / 2
+    return np.maximum(np.exp(mu + sigma * z) - shift, 0.0)
+
+
+def correlated(z_flow, corr, rng):
+    """
+    Standard normal shots, one row per correlation, correlated with the
+    flow shots. Correlations outside [-1, 1] (-9.9 by default) are zero
+    """
+    corr = np.where(np.abs(corr) <= 1, corr, 0.0)[:, None]
+    noise = rng.standard_normal((len(corr), len(z_flow)))
+    return corr * z_flow + np.sqrt(1 - corr ** 2) * noise
+
+
+class MassBalance:
+    """
+    One Monte Carlo run of a DatModel. run() returns the statistics of the
+    flow and of every determinand at every feature
+    """
+
+    def __init__(self, model, shots=DEFAULT_SHOTS, seed=0, settings=None,
+                 network=None):
+        self.model = model
+        self.shots = shots
+        self.seed = seed
+        self.network = network or ReachNetwork.from_model(model)
+        self.dets = len(model.det_names)
+        self.warnings = {}
+        self.ends = {}
+
+        settings = settings or {}
+        det_types = settings.get("det_types") or [2] * self.dets
+        global_rates = settings.get("global_rates") or [0.0] * self.dets
+        min_quality = settings.get("min_quality") or [0.0] * self.dets
+        self.min_quality = np.array(min_quality, dtype=np.float64)[:, None]
+        self.excluded = ~np.isin(det_types, (1, 2, 3, 5))
+
+        # Rate constants of each reach: its own, or the global one where it
+        # has none, -1 standing for zero
+        rates = model.reaches["decay_rates"]
+        rates = np.where(np.isnan(rates) | (rates == 0), global_rates, rates)
+        rates = np.where(rates == -1, 0.0, rates)
+        rates[:, np.isin(det_types, NO_DECAY_TYPES)] = 0.0
+        self.rates = rates
+
+    def warn(self, message):
+        self.warnings[message] = self.warnings.get(message, 0) + 1
+
+    def rng(self, stream, simno, position=0):
+        return np.random.default_rng(
+                (self.seed, stream, zlib.crc32(simno.encode()), position))
+
+    def npd_shots(self, filename, z):
+        """
+        Shots of an NPD file at the normal probabilities of z, so the
+        correlation with flow is kept. Zero if the file is missing
+        """
+        try:
+            values = np.asarray(self.model.npd[filename].values)
+        except FileNotFoundError:
+            self.warn(f"NPD file {filename} not found, taken as zero")
+            return np.zeros(len(z))
+        if not len(values):
+            return np.zeros(len(z))
+        return np.quantile(values, normal_probability(z))
+
+    def river_flow(self, n, z):
+        """
+        Flow shots of a river flow dataset
+        """
+        table = self.model.flow
+        columns = table.columns
+        row = table.starts[n]
+        dist = int(columns["dist"][row])
+        if columns["is_npd"][row]:
+            return self.npd_shots(table.pool[columns["npd_filename"][row]], z)
+        if dist not in (0, 1, 2, 3):
+            self.warn(f"flow distribution {dist} taken as log-normal")
+        return flow_shots(dist, columns["mean"][row], columns["std"][row],
+                          columns["shift"][row], z)
+
+    def dataset_shots(self, table, n, z_flow, rng, dists=QUALITY_DISTS):
+        """
+        Shots of the determinands of a river quality or effluent dataset,
+        correlated with z_flow, dists being the distribution codes of its
+        section. Returns the effluent flow (None for river quality), the
+        shots as determinands x shots and which are loads
+        """
+        columns = table.columns
+        rows = table.rows(n)
+        det_code = columns["det_code"][rows].astype(np.int64)
+        dist = columns["dist"][rows].astype(np.int64)
+        z = correlated(z_flow, columns["corr"][rows], rng)
+        # The effluent flow row is the flow itself
+        z[det_code == 0] = z_flow
+        values = sample_values(dist, columns["mean"][rows],
+                               columns["std"][rows], columns["shift"][rows], z,
+                               dists["normal"])
+
+        for i in np.flatnonzero(columns["is_npd"][rows]).tolist():
+            filename = table.pool[columns["npd_filename"][rows.start + i]]
+            values[i] = self.npd_shots(filename, z[i])
+        for code in set(dist.tolist()) - set(dists["supported"]):
+            self.warn(f"{dists['section']} distribution {code} taken as "
+                      f"log-normal")
+        title = table.pool[columns["title"][rows.start]]
+        if "Load" in title and (~np.isin(dist, dists["loads"])
+                                & (columns["mean"][rows] > 0)).any():
+            self.warn(f"{dists['section']} data-set titled as a load with "
+                      f"concentration distributions taken as concentrations")
+
+        flow = None
+        quality = np.zeros((self.dets, self.shots))
+        is_load = np.zeros(self.dets, dtype=bool)
+        for i, det in enumerate(det_code.tolist()):
+            if det == 0:
+                flow = values[i]
+            elif det <= self.dets:
+                quality[det - 1] = values[i]
+                is_load[det - 1] = dist[i] in dists["loads"]
+        return flow, quality, is_load
+
+    def inflow(self, flow_n, wq_n, eff_n, rng):
+        """
+        Flow and load shots of an input, from a river flow and river quality
+        dataset pair or from an effluent dataset. Loads are flow times
+        concentration unless the data are loads already
+        """
+        z_flow = rng.standard_normal(self.shots)
+        if eff_n >= 0:
+            flow, quality, is_load = self.dataset_shots(
+                    self.model.eff, eff_n, z_flow, rng, EFFLUENT_DISTS)
+            if flow is None:
+                flow = np.zeros(self.shots)
+        else:
+            flow = (self.river_flow(flow_n, z_flow) if flow_n >= 0
+                    else np.zeros(self.shots))
+            if wq_n < 0:
+                return flow, np.zeros((self.dets, self.shots))
+            _, quality, is_load = self.dataset_shots(
+                    self.model.wq, wq_n, z_flow, rng)
+        load = np.where(is_load[:, None], quality, quality * flow)
+        return flow, load
+
+    def feature_inflow(self, f, code, rng):
+        """
+        Input of a feature: effluent types use effluent data, the others
+        river flow and quality data
+        """
+        model = self.model
+        features = model.features
+        if code in EFFLUENT_DATA:
+            wq_code = model.pool[features["wq_code"][f]]
+            return self.inflow(-1, -1, model.eff.find(wq_code), rng)
+        return self.inflow(int(features["flow"][f]), int(features["wq"][f]),
+                           -1, rng)
+
+    def decay(self, flow, load, reach, distance):
+        """
+        First order decay of the loads over a distance along a reach, with
+        time of travel from the velocity/discharge relation
+        """
+        rates = self.rates[reach]
+        if distance <= 0 or not rates.any():
+            return load
+        alpha = self.model.reaches["alpha"][reach]
+        beta = self.model.reaches["beta"][reach]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days = distance / (alpha * flow ** beta)
+            conc = np.where(flow > 0, load / flow, 0.0)
+            excess = np.maximum(conc - self.min_quality, 0.0)
+            lost = excess * -np.expm1(-rates[:, None] * days)
+        return load - np.nan_to_num(lost) * flow
+
+    def abstraction(self, f, code, flow, load, rng):
+        """
+        Remove flow, keeping the concentrations
+        """
+        model = self.model
+        z = rng.standard_normal(self.shots)
+        if code == "7":
+            # Mean rate, only while the river is above the hands-off flow
+            n = int(model.features["flow"][f])
+            if n < 0:
+                return flow, load
+            row = model.flow.starts[n]
+            rate = model.flow.columns["mean"][row]
+            hands_off = model.flow.columns["std"][row]
+            taken = np.clip(flow - hands_off, 0.0, rate)
+        elif code == "18":
+            n = int(model.features["flow"][f])
+            taken = self.river_flow(n, z) if n >= 0 else np.zeros(self.shots)
+        else:
+            taken, _ = self.feature_inflow(f, "15", rng)
+        taken = np.minimum(taken, flow)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            kept = np.where(flow > 0, (flow - taken) / flow, 0.0)
+        return flow - taken, load * kept
+
+    def bifurcation(self, f, code, ends):
+        """
+        Flow and loads at the head of a bifurcation reach, taken from the end
+        of the reach given as the flow data-set of the feature
+        """
+        model = self.model
+        features = model.features
+        source = model.pool[features["flow_code"][f]]
+        if source not in self.network.index or source not in ends:
+            self.warn(f"bifurcation from unknown reach {source} skipped")
+            return None
+        flow, load = ends[source]
+        if code == "11":
+            # dist_head is the fraction of flow passing down the bifurcation
+            fraction = features["dist_head"][f]
+            return flow * fraction, load * fraction
+
+        # The same diverted flow shots for both arms
+        rng = self.rng(BIFURCATION_STREAM, source)
+        dataset = model.pool[features["wq_code"][f]]
+        if code in FLOW_DATA_BIFURCATIONS:
+            n = model.flow.find(dataset)
+            diverted = (self.river_flow(n, rng.standard_normal(self.shots))
+                        if n >= 0 else np.zeros(self.shots))
+        else:
+            n = model.eff.find(dataset)
+            diverted = (self.inflow(-1, -1, n, rng)[0] if n >= 0
+                        else np.zeros(self.shots))
+        diverted = np.minimum(diverted, flow)
+        if code in ("20", "22"):
+            diverted = flow - diverted
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.where(flow > 0, diverted / flow, 0.0)
+        return diverted, load * fraction
+
+    def dependants(self):
+        """
+        Return {reach index: indices of the reaches using its results}: the
+        reach downstream and any bifurcation reaches taking flow from it
+        """
+        model = self.model
+        network = self.network
+        features = model.features
+        after = {n: [] for n in range(len(network))}
+        for n, down in enumerate(network.downstream.tolist()):
+            if down >= 0:
+                after[n].append(down)
+        for f in range(len(features.get("reach", ()))):
+            if model.pool[features["feat_code"][f]] in BIFURCATIONS:
+                source = network.index.get(model.pool[features["flow_code"][f]])
+                reach = int(features["reach"][f])
+                if source is not None and source != reach:
+                    after[source].append(reach)
+        return after
+
+    def processing_order(self):
+        """
+        Reaches from the headwaters to the outlets, with the source reaches
+        of bifurcations before the bifurcation reaches
+        """
+        after = self.dependants()
+        waiting = np.zeros(len(self.network), dtype=np.int64)
+        for n, reaches in after.items():
+            for m in reaches:
+                waiting[m] += 1
+
+        ready = np.flatnonzero(waiting == 0).tolist()[::-1]
+        order = []
+        while ready:
+            n = ready.pop()
+            order.append(n)
+            for m in after[n]:
+                waiting[m] -= 1
+                if waiting[m] == 0:
+                    ready.append(m)
+        if len(order) != len(self.network):
+            raise ValueError("The reaches and bifurcations form a loop")
+        return order
+
+    def new_results(self):
+        """
+        Empty results, NaN until a feature is reached
+        """
+        model = self.model
+        size = len(model.features.get("reach", ()))
+        results = {
+                "shots": self.shots,
+                "seed": self.seed,
+                "determinands": [model.det_names[n + 1] for n in range(self.dets)],
+                "flow_mean": np.full(size, np.nan),
+                "flow_low95": np.full(size, np.nan),
+                "conc_mean": np.full((size, self.dets), np.nan),
+                }
+        for p in PERCENTILES:
+            results[f"conc_q{p}"] = np.full((size, self.dets), np.nan)
+        return results
+
+    def run(self, reaches=None, ends=None, results=None):
+        """
+        Route the shots down the network and return the results. Only the
+        reach indices in reaches are run if given, taking the flow and loads
+        at the end of the others from ends ({simno: (flow, load)}) and
+        filling in results. The end of every reach run is kept in self.ends
+        """
+        start_time = time.perf_counter()
+        model = self.model
+        network = self.network
+        features = model.features
+        pool = model.pool
+        shots = self.shots
+        results = self.new_results() if results is None else results
+        codes = [pool[code] for code in features["feat_code"].tolist()] \
+            if len(features.get("reach", ())) else []
+        ends = self.ends = {} if ends is None else ends
+
+        for reach in self.processing_order():
+            if reaches is not None and reach not in reaches:
+                continue
+            simno = network.simnos[reach]
+            length = model.reaches["length"][reach]
+
+            # Mix the reaches draining into this one
+            flow = np.zeros(shots)
+            load = np.zeros((self.dets, shots))
+            for up in network.directly_upstream(simno):
+                flow = flow + ends[up][0]
+                load = load + ends[up][1]
+
+            # Diffuse inflow of the reach, spread evenly along it
+            rng = self.rng(REACH_STREAM, simno)
+            diffuse = []
+            flow_n = model.flow.find(pool[model.reaches["flow_code"][reach]])
+            wq_n = model.wq.find(pool[model.reaches["wq_code"][reach]])
+            if (flow_n >= 0 or wq_n >= 0) and length > 0:
+                reach_flow, reach_load = self.inflow(flow_n, wq_n, -1, rng)
+                diffuse.append((None, reach_flow / length, reach_load / length))
+
+            members = model.reach_features[
+                    model.reach_offsets[reach]:model.reach_offsets[reach + 1]]
+            positions = np.where(
+                    np.isin([codes[f] for f in members.tolist()], BIFURCATIONS),
+                    0.0, np.clip(features["dist_head"][members], 0.0, length))
+            order = np.argsort(positions, kind="stable")
+            ranks = order.tolist()
+            members, positions = members[order].tolist(), positions[order].tolist()
+
+            position = 0.0
+            for i, (f, at) in enumerate(zip(members, positions)):
+                code = codes[f]
+
+                # Along the river to the feature
+                step = at - position
+                if step > 0:
+                    for _, flow_rate, load_rate in diffuse:
+                        flow = flow + flow_rate * step
+                        load = load + load_rate * step
+                    load = self.decay(flow, load, reach, step)
+                    position = at
+
+                rng = self.rng(FEATURE_STREAM, simno, ranks[i])
+                if code in BOUNDARY_FEATURES:
+                    flow, load = self.feature_inflow(f, code, rng)
+                elif code in RIVER_INPUTS or code in EFFLUENT_INPUTS:
+                    in_flow, in_load = self.feature_inflow(f, code, rng)
+                    flow, load = flow + in_flow, load + in_load
+                elif code in ABSTRACTIONS:
+                    flow, load = self.abstraction(f, code, flow, load, rng)
+                elif code in BIFURCATIONS:
+                    state = self.bifurcation(f, code, ends)
+                    if state is not None:
+                        flow, load = state
+                elif code in DIFFUSE_STARTS:
+                    # Spread over the stretch to the matching end feature, or
+                    # to the end of the reach
+                    in_flow, in_load = self.feature_inflow(f, code, rng)
+                    end_code = DIFFUSE_STARTS[code]
+                    end = next((j for j in range(i + 1, len(members))
+                                if codes[members[j]] == end_code), None)
+                    stretch = (positions[end] if end is not None else length) - at
+                    if stretch > 0:
+                        diffuse.append((end, in_flow / stretch, in_load / stretch))
+                    else:
+                        flow, load = flow + in_flow, load + in_load
+                elif code not in DIFFUSE_ENDS and code not in REPORT_ONLY:
+                    self.warn(f"feature type {code} not simulated")
+                diffuse = [d for d in diffuse if d[0] != i]
+
+                self.record(results, f, flow, load)
+
+            # Along the river to the end of the reach
+            step = length - position
+            if step > 0:
+                for _, flow_rate, load_rate in diffuse:
+                    flow = flow + flow_rate * step
+                    load = load + load_rate * step
+                load = self.decay(flow, load, reach, step)
+            ends[simno] = (flow, load)
+
+        results["warnings"] = dict(self.warnings)
+        results["seconds"] = time.perf_counter() - start_time
+        return results
+
+    def record(self, results, f, flow, load):
+        """
+        Store the statistics of the shots at a feature
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            conc = np.where(flow > 0, load / flow, 0.0)
+        conc[self.excluded] = np.nan
+        results["flow_mean"][f] = flow.mean()
+        results["flow_low95"][f] = np.percentile(flow, 5)
+        results["conc_mean"][f] = conc.mean(axis=1)
+        percentiles = np.percentile(conc, PERCENTILES, axis=1)
+        for p, values in zip(PERCENTILES, percentiles):
+            results[f"conc_q{p}"][f] = values
+
+
+def simulate(model, shots=DEFAULT_SHOTS, seed=0, settings=None, network=None):
+    """
+    Run the Monte Carlo mass balance of a DatModel
+    """
+    return MassBalance(model, shots, seed, settings, network).run()
+
+
+def simulate_dat(file_path, seed=0, shots=None):
+    """
+    Parse a dat file and run it with the number of shots of its General
+    data, unless given
+    """
+    settings = read_run_settings(file_path)
+    model = load_model(file_path)
+    return simulate(model, shots or settings["shots"], seed, settings)
+
+
+def result_rows(model, results):
+    """
+    Results as one dict per feature, e.g. for a csv file
+    """
+    pool = model.pool
+    features = model.features
+    dets = results["determinands"]
+    for f in range(len(results["flow_mean"])):
+        row = {
+                "id": f + 1,
+                "reach": model.pool[model.reaches["simno"][features["reach"][f]]],
+                "name": pool[features["name"][f]],
+                "feat_code": pool[features["feat_code"][f]],
+                "flow_mean": results["flow_mean"][f].item(),
+                "flow_low95": results["flow_low95"][f].item(),
+                }
+        for d, det in enumerate(dets):
+            row[f"{det}_mean"] = results["conc_mean"][f, d].item()
+            for p in PERCENTILES:
+                row[f"{det}_q{p}"] = results[f"conc_q{p}"][f, d].item()
+        yield row
+
+
+def main(argv=None):
+    """
+    Run the dat file given in the command line and print the results at the
+    last feature of every outlet reach
+    """
+    parser = argparse.ArgumentParser(
+            description="Monte Carlo mass balance of a SIMCAT dat file")
+    parser.add_argument("dat_file", help="dat file to run")
+    parser.add_argument("-n", "--shots", type=int,
+                        help="number of shots (default from the dat file)")
+    parser.add_argument("-s", "--seed", type=int, default=0,
+                        help="seed of the random shots")
+    parser.add_argument("-o", "--output", help="write the results to a csv file")
+    args = parser.parse_args(argv)
+
+    settings = read_run_settings(args.dat_file)
+    model = load_model(args.dat_file)
+    network = ReachNetwork.from_model(model)
+    results = simulate(model, args.shots or settings["shots"], args.seed,
+                       settings, network)
+    rows = list(result_rows(model, results))
+
+    for simno in network.outlets():
+        reach = network.index[simno]
+        members = model.reach_features[
+                model.reach_offsets[reach]:model.reach_offsets[reach + 1]]
+        if not len(members):
+            continue
+        row = rows[int(members[-1])]
+        print(f"Reach {simno}, {row['name']}: mean flow {row['flow_mean']:.3f}")
+        for det in results["determinands"]:
+            print(f"    {det}: mean {row[f'{det}_mean']:.4g}, " + ", ".join(
+                    f"Q{p} {row[f'{det}_q{p}']:.4g}" for p in PERCENTILES))
+    for message, count in results["warnings"].items():
+        print(f"Warning: {message} ({count})")
+    print(f"{len(rows)} features, {results['shots']} shots in "
+          f"{results['seconds']:.2f}s")
+
+    if args.output:
+        with open(args.output, "w", newline="") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Spatial index over feature coordinates (British National Grid)
+
+Features are bucketed into a uniform grid of square cells. Points are
+sorted by cell, with cells numbered row by row, so the cells of one grid
+row inside a query box are a single contiguous run found with two binary
+searches. Only those candidates are checked exactly. Bounding box, radius
+and nearest feature queries then cost about the size of their answer
+instead of a pass over every feature.
+
+Example:
+    index = FeatureIndex.from_model(load_model("EXAMPLE.dat"))
+    ids, distances = index.nearest(376195, 160655, k=3)
+"""
+
+import numpy as np
+
+
+class FeatureIndex:
+    """
+    Grid index over points. Queries return positions in the arrays the
+    index was built from, which for from_model are feature indices
+    (model.feature(n + 1))
+    """
+
+    def __init__(self, easting, northing, cell_size=None):
+        self.x = np.asarray(easting, dtype=np.float64)
+        self.y = np.asarray(northing, dtype=np.float64)
+        size = len(self.x)
+        if size:
+            self.x0, self.y0 = self.x.min(), self.y.min()
+            self.x1, self.y1 = self.x.max(), self.y.max()
+        else:
+            self.x0 = self.y0 = self.x1 = self.y1 = 0.0
+        width = max(self.x1 - self.x0, self.y1 - self.y0, 1.0)
+
+        # About two points per cell if they were spread evenly
+        if cell_size is None:
+            cell_size = max(width * np.sqrt(2.0 / max(size, 1)), 1.0)
+        self.cell_size = float(cell_size)
+        self.columns = int((self.x1 - self.x0) // self.cell_size) + 1
+
+        cells = self._cells(self.x, self.y)
+        self.order = np.argsort(cells, kind="stable")
+        self.sorted_cells = cells[self.order]
+
+    @classmethod
+    def from_model(cls, model, cell_size=None):
+        """
+        Index the features of a DatModel
+        """
+        features = model.features
+        return cls(features["easting"], features["northing"], cell_size)
+
+    def __len__(self):
+        return len(self.x)
+
+    def _cell_xy(self, x, y):
+        cx = np.floor((np.asarray(x) - self.x0) / self.cell_size).astype(np.int64)
+        cy = np.floor((np.asarray(y) - self.y0) / self.cell_size).astype(np.int64)
+        return cx, cy
+
+    def _cells(self, x, y):
+        cx, cy = self._cell_xy(x, y)
+        return cy * self.columns + cx
+
+    def _candidates(self, xmin, ymin, xmax, ymax):
+        """
+        Points in the cells overlapping a box, one run of sorted points per
+        grid row
+        """
+        cx0, cy0 = self._cell_xy(xmin, ymin)
+        cx1, cy1 = self._cell_xy(xmax, ymax)
+        cx0 = max(int(cx0), 0)
+        cx1 = min(int(cx1), self.columns - 1)
+        if cx0 > cx1 or not len(self.x):
+            return np.zeros(0, dtype=np.int64)
+        last_row = int(self.sorted_cells[-1] // self.columns)
+        rows = np.arange(max(int(cy0), 0), min(int(cy1), last_row) + 1)
+        if not len(rows):
+            return np.zeros(0, dtype=np.int64)
+        starts = np.searchsorted(self.sorted_cells, rows * self.columns + cx0)
+        stops = np.searchsorted(self.sorted_cells, rows * self.columns + cx1,
+                                side="right")
+        return np.concatenate([self.order[start:stop] for start, stop in
+                               zip(starts.tolist(), stops.tolist())])
+
+    def bbox(self, xmin, ymin, xmax, ymax):
+        """
+        Indices of the points inside a bounding box (edges included)
+        """
+        found = self._candidates(xmin, ymin, xmax, ymax)
+        x, y = self.x[found], self.y[found]
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        return np.sort(found[inside])
+
+    def radius(self, x, y, r):
+        """
+        Indices and distances of the points within r metres of (x, y),
+        nearest first
+        """
+        found = self._candidates(x - r, y - r, x + r, y + r)
+        distances = np.hypot(self.x[found] - x, self.y[found] - y)
+        inside = distances <= r
+        found, distances = found[inside], distances[inside]
+        order = np.lexsort((found, distances))
+        return found[order], distances[order]
+
+    def nearest(self, x, y, k=1, max_distance=np.inf):
+        """
+        Indices and distances of the k points nearest to (x, y), searching
+        rings of growing radius. Fewer are returned if there are not enough
+        points within max_distance
+        """
+        if not len(self.x):
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        # Grow the radius until k points are inside, then the k nearest are
+        # within it
+        r = self.cell_size
+        extent = np.hypot(max(abs(x - self.x0), abs(x - self.x1)),
+                          max(abs(y - self.y0), abs(y - self.y1)))
+        while True:
+            r = min(r, max_distance)
+            found, distances = self.radius(x, y, r)
+            if len(found) >= k or r >= max_distance or r >= extent:
+                return found[:k], distances[:k]
+            r *= 2
+
+    def match(self, xs, ys, max_distance=np.inf):
+        """
+        Nearest point to each of many (x, y) points, e.g. monitoring sites.
+        Returns indices (-1 if none within max_distance) and distances
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        indices = np.full(len(xs), -1, dtype=np.int64)
+        distances = np.full(len(xs), np.inf)
+        for n, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+            found, dist = self.nearest(x, y, 1, max_distance)
+            if len(found):
+                indices[n], distances[n] = found[0], dist[0]
+        return indices, distances
@@ -0,0 +1,477 @@
+"""
+Indexed SQLite and GeoPackage export of dat file models
+
+Reaches, features, datasets and their determinand parameters are written
+as normalised tables of a SQLite database, indexed on simno, wbid,
+feat_code and dataset codes. Every row carries the model_id of its dat
+file, so many scenario models can be stored in one database and queried
+together. Files ending in .gpkg are written as GeoPackages, with the
+features as a point layer in British National Grid (EPSG:27700) built from
+the decoded giscodes, so GIS tools can open them directly.
+
+Flow datasets are stored with determinand code 0, like the flow rows of
+effluent datasets; their std column holds the 95-percentile low flow. The
+wq_section column of a feature names the section its wq_code refers to.
+A dataset code repeated within a section is stored once per occurrence, in
+file order; features use the last one, as in the DatFile dicts.
+
+Models are named after their dat file. Adding a model under the name of
+one exported from another file is refused unless replace is set, so
+scenarios with the same file name in different folders are not lost.
+
+Example:
+    export_dats(["Baseline.dat", "optionB.dat"], "scenarios.gpkg")
+
+    -- Sewage works on a water body with a mean total phosphorus over 2
+    SELECT m.name, f.name, p.mean
+    FROM features f
+    JOIN models m ON m.model_id = f.model_id
+    JOIN reaches r ON r.model_id = f.model_id AND r.simno = f.simno
+    JOIN determinands d ON d.model_id = f.model_id
+    JOIN dataset_parameters p ON p.model_id = f.model_id
+        AND p.section = f.wq_section AND p.code = f.wq_code
+        AND p.det_code = d.det_code
+    WHERE f.feat_code = '3' AND r.wbid = 'GB105033037810'
+        AND d.short_name = 'TP' AND p.mean > 2
+"""
+
+import os
+import json
+import struct
+import sqlite3
+import argparse
+import numpy as np
+from model import load_model, EFFLUENT_FEATURES
+from columnar import model_tables
+
+# Dataset sections, with their DatModel attribute and model_tables table
+DATASET_SECTIONS = {
+        "RiverFlow": ("flow", "flow_datasets"),
+        "RiverQuality": ("wq", "wq_datasets"),
+        "Effluent": ("eff", "effluent_datasets"),
+        }
+
+# Determinand parameter columns of the dataset_parameters table
+PARAMETERS = ("dist", "mean", "std", "shift", "power_idx", "base_conc",
+              "cut_off_pc", "corr", "sample_n")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS models (
+    model_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    source TEXT,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS determinands (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    det_code INTEGER NOT NULL,
+    name TEXT,
+    short_name TEXT,
+    units TEXT
+);
+CREATE TABLE IF NOT EXISTS reaches (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    simno TEXT NOT NULL,
+    name TEXT,
+    unique_ref TEXT,
+    wbid TEXT,
+    length REAL,
+    conn1 TEXT,
+    conn2 TEXT,
+    conn3 TEXT,
+    flow_code TEXT,
+    wq_code TEXT,
+    alpha REAL,
+    beta REAL
+);
+CREATE TABLE IF NOT EXISTS decay_rates (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    simno TEXT NOT NULL,
+    det_code INTEGER NOT NULL,
+    rate REAL
+);
+CREATE TABLE IF NOT EXISTS standards (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    simno TEXT NOT NULL,
+    det_code INTEGER NOT NULL,
+    count INTEGER,
+    class INTEGER NOT NULL,
+    threshold REAL
+);
+CREATE TABLE IF NOT EXISTS features (
+    fid INTEGER PRIMARY KEY AUTOINCREMENT,
+    geom POINT,
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    feature_id INTEGER NOT NULL,
+    simno TEXT NOT NULL,
+    name TEXT,
+    feat_code TEXT,
+    dist_head REAL,
+    flow_code TEXT,
+    wq_code TEXT,
+    wq_section TEXT,
+    gap_flow_code TEXT,
+    gap_wq_code TEXT,
+    target_code TEXT,
+    giscode TEXT,
+    easting INTEGER,
+    northing INTEGER
+);
+CREATE TABLE IF NOT EXISTS datasets (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    section TEXT NOT NULL,
+    code TEXT NOT NULL,
+    title TEXT
+);
+CREATE TABLE IF NOT EXISTS dataset_parameters (
+    model_id INTEGER NOT NULL REFERENCES models(model_id),
+    section TEXT NOT NULL,
+    code TEXT NOT NULL,
+    det_code INTEGER NOT NULL,
+    dist INTEGER,
+    mean REAL,
+    std REAL,
+    shift REAL,
+    power_idx REAL,
+    base_conc REAL,
+    cut_off_pc REAL,
+    corr REAL,
+    sample_n REAL,
+    npd_filename TEXT
+);
+"""
+
+# Created after the rows are inserted, which is much faster for big models
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS determinands_code
+    ON determinands (model_id, det_code);
+CREATE UNIQUE INDEX IF NOT EXISTS reaches_simno ON reaches (model_id, simno);
+CREATE INDEX IF NOT EXISTS reaches_wbid ON reaches (wbid);
+CREATE INDEX IF NOT EXISTS decay_rates_simno ON decay_rates (model_id, simno);
+CREATE INDEX IF NOT EXISTS standards_simno ON standards (model_id, simno);
+CREATE INDEX IF NOT EXISTS features_simno ON features (model_id, simno);
+CREATE INDEX IF NOT EXISTS features_feat_code ON features (feat_code, model_id);
+CREATE INDEX IF NOT EXISTS features_flow_code ON features (model_id, flow_code);
+CREATE INDEX IF NOT EXISTS features_wq_code
+    ON features (model_id, wq_section, wq_code);
+DROP INDEX IF EXISTS datasets_code;
+CREATE INDEX IF NOT EXISTS datasets_section_code
+    ON datasets (model_id, section, code);
+CREATE INDEX IF NOT EXISTS dataset_parameters_code
+    ON dataset_parameters (model_id, section, code, det_code);
+"""
+
+# GeoPackage 1.3 application id ("GPKG") and version
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10300
+
+GPKG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE IF NOT EXISTS gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL
+        DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    min_x DOUBLE,
+    min_y DOUBLE,
+    max_x DOUBLE,
+    max_y DOUBLE,
+    srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id)
+);
+CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL REFERENCES gpkg_spatial_ref_sys(srs_id),
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    PRIMARY KEY (table_name, column_name),
+    FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name)
+);
+"""
+
+# British National Grid, the coordinates of the giscodes
+SRS_ID = 27700
+
+SPATIAL_REF_SYS = (
+        ("Undefined cartesian SRS", -1, "NONE", -1, "undefined",
+         "undefined cartesian coordinate reference system"),
+        ("Undefined geographic SRS", 0, "NONE", 0, "undefined",
+         "undefined geographic coordinate reference system"),
+        ("WGS 84 geodetic", 4326, "EPSG", 4326,
+         'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,'
+         '298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],'
+         'PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",'
+         '0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]',
+         "longitude/latitude coordinates in decimal degrees on the WGS 84 "
+         "spheroid"),
+        ("OSGB 1936 / British National Grid", SRS_ID, "EPSG", SRS_ID,
+         'PROJCS["OSGB 1936 / British National Grid",GEOGCS["OSGB 1936",'
+         'DATUM["OSGB_1936",SPHEROID["Airy 1830",6377563.396,299.3249646,'
+         'AUTHORITY["EPSG","7001"]],AUTHORITY["EPSG","6277"]],PRIMEM["Greenwich",'
+         '0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,'
+         'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4277"]],'
+         'PROJECTION["Transverse_Mercator"],PARAMETER["latitude_of_origin",49],'
+         'PARAMETER["central_meridian",-2],PARAMETER["scale_factor",0.9996012717],'
+         'PARAMETER["false_easting",400000],PARAMETER["false_northing",-100000],'
+         'UNIT["metre",1,AUTHORITY["EPSG","9001"]],AXIS["Easting",EAST],'
+         'AXIS["Northing",NORTH],AUTHORITY["EPSG","27700"]]',
+         "British National Grid"),
+        )
+
+# GeoPackage binary header (magic, version, little endian flag, srs id)
+# followed by a little endian WKB point
+POINT_BLOB = struct.Struct("<2sBBiBIdd")
+
+
+def point_blob(easting, northing):
+    """
+    GeoPackage geometry blob of a point
+    """
+    return POINT_BLOB.pack(b"GP", 0, 1, SRS_ID, 1, 1, easting, northing)
+
+
+def is_geopackage(path):
+    return path.lower().endswith(".gpkg")
+
+
+def sql_values(column):
+    """
+    NumPy column as a list of Python values, NaN as NULL
+    """
+    if column.dtype.kind == "f":
+        return [None if v != v else v for v in column.tolist()]
+    return column.tolist()
+
+
+def init_database(connection, geopackage=False):
+    """
+    Create the tables of an empty database, or check an existing one
+    """
+    connection.executescript(SCHEMA)
+    if not geopackage:
+        return
+    connection.execute(f"PRAGMA application_id = {GPKG_APPLICATION_ID}")
+    connection.execute(f"PRAGMA user_version = {GPKG_USER_VERSION}")
+    connection.executescript(GPKG_SCHEMA)
+    connection.executemany(
+            "INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)",
+            SPATIAL_REF_SYS)
+    for table in ("models", "determinands", "reaches", "decay_rates",
+                  "standards", "datasets", "dataset_parameters"):
+        connection.execute(
+                "INSERT OR IGNORE INTO gpkg_contents (table_name, data_type, "
+                "identifier) VALUES (?, 'attributes', ?)", (table, table))
+    connection.execute(
+            "INSERT OR IGNORE INTO gpkg_contents (table_name, data_type, "
+            "identifier, srs_id) VALUES ('features', 'features', 'features', ?)",
+            (SRS_ID,))
+    connection.execute(
+            "INSERT OR IGNORE INTO gpkg_geometry_columns VALUES "
+            "('features', 'geom', 'POINT', ?, 0, 0)", (SRS_ID,))
+
+
+def update_extent(connection):
+    """
+    Set the bounding box and change time of the GeoPackage feature layer
+    """
+    connection.execute(
+            "UPDATE gpkg_contents SET (min_x, min_y, max_x, max_y) = "
+            "(SELECT min(easting), min(northing), max(easting), max(northing) "
+            "FROM features), last_change = strftime('%Y-%m-%dT%H:%M:%fZ', "
+            "'now') WHERE table_name = 'features'")
+
+
+def same_source(first, second):
+    """
+    Whether two model sources are the same file
+    """
+    if not first or not second:
+        return first == second
+    return os.path.realpath(first) == os.path.realpath(second)
+
+
+def delete_model(connection, name):
+    """
+    Delete a model and all its rows, if it is in the database
+    """
+    row = connection.execute("SELECT model_id FROM models WHERE name = ?",
+                             (name,)).fetchone()
+    if row is None:
+        return
+    for table in ("determinands", "reaches", "decay_rates", "standards",
+                  "features", "datasets", "dataset_parameters", "models"):
+        connection.execute(f"DELETE FROM {table} WHERE model_id = ?", row)
+
+
+def insert_rows(connection, table, columns):
+    """
+    Insert a dict of equal length columns (lists or NumPy arrays)
+    """
+    names = list(columns)
+    values = [sql_values(c) if isinstance(c, np.ndarray) else c
+              for c in columns.values()]
+    connection.executemany(
+            f"INSERT INTO {table} ({', '.join(names)}) VALUES "
+            f"({', '.join('?' * len(names))})", zip(*values))
+
+
+def write_model(connection, model, name, source="", replace=False):
+    """
+    Add a DatModel to an open database, replacing a model of the same name
+    exported from the same source. A model of that name from another source
+    is only replaced if replace is set, otherwise a ValueError is raised.
+    Returns its model_id
+    """
+    row = connection.execute("SELECT source FROM models WHERE name = ?",
+                             (name,)).fetchone()
+    if row is not None and not replace and not same_source(row[0], source):
+        raise ValueError(
+                f"The database already has a model named '{name}', from "
+                f"{row[0] or 'an unknown source'}. Give {source or 'this model'} "
+                f"another name or set replace to overwrite it")
+    delete_model(connection, name)
+    model_id = connection.execute(
+            "INSERT INTO models (name, source, metadata) VALUES (?, ?, ?)",
+            (name, source, json.dumps(model.metadata))).lastrowid
+    tables = model_tables(model)
+
+    # Determinands
+    dets = sorted(model.determinands.items(), key=lambda item: int(item[0]))
+    connection.executemany(
+            "INSERT INTO determinands VALUES (?, ?, ?, ?, ?)",
+            [(model_id, int(code), det["name"], det["short_name"], det["units"])
+             for code, det in dets])
+
+    # Reaches, with one row per decay rate and standard threshold
+    reaches = tables["reaches"]
+    size = len(reaches["simno"])
+    insert_rows(connection, "reaches", {
+            "model_id": [model_id] * size,
+            **{name: reaches[name] for name in (
+                "simno", "name", "unique_ref", "wbid", "length", "conn1",
+                "conn2", "conn3", "flow_code", "wq_code", "alpha", "beta")},
+            })
+    decay = model.reaches["decay_rates"]
+    det_codes = np.tile(np.arange(1, decay.shape[1] + 1), size)
+    insert_rows(connection, "decay_rates", {
+            "model_id": [model_id] * decay.size,
+            "simno": np.repeat(reaches["simno"], decay.shape[1]),
+            "det_code": det_codes,
+            "rate": decay.ravel(),
+            })
+    standards = tables["standards"]
+    thresholds = model.standards["thresholds"]
+    rows, classes = np.nonzero(~np.isnan(thresholds))
+    insert_rows(connection, "standards", {
+            "model_id": [model_id] * len(rows),
+            "simno": standards["simno"][rows],
+            "det_code": standards["det_code"][rows],
+            "count": standards["count"][rows],
+            "class": classes + 1,
+            "threshold": thresholds[rows, classes],
+            })
+
+    # Features, their quality codes refer to the Effluent section for
+    # discharges and to River Quality otherwise
+    features = tables["features"]
+    size = len(features["id"])
+    effluent = np.isin(features["feat_code"], EFFLUENT_FEATURES)
+    columns = {
+            "model_id": [model_id] * size,
+            "feature_id": features["id"],
+            "wq_section": np.where(effluent, "Effluent", "RiverQuality"),
+            }
+    for name in ("simno", "name", "feat_code", "dist_head", "flow_code",
+                 "wq_code", "gap_flow_code", "gap_wq_code", "target_code",
+                 "giscode", "easting", "northing"):
+        columns[name] = features[name]
+    columns["geom"] = [point_blob(e, n) for e, n in zip(
+            features["easting"].tolist(), features["northing"].tolist())]
+    insert_rows(connection, "features", columns)
+
+    # Datasets, one row each, and their parameters, one row per determinand
+    for section, (attribute, table_name) in DATASET_SECTIONS.items():
+        table = tables[table_name]
+        starts = getattr(model, attribute).starts
+        size = len(table["code"])
+        insert_rows(connection, "datasets", {
+                "model_id": [model_id] * len(starts),
+                "section": [section] * len(starts),
+                "code": table["code"][starts],
+                "title": table["title"][starts],
+                })
+        columns = {
+                "model_id": [model_id] * size,
+                "section": [section] * size,
+                "code": table["code"],
+                "det_code": table.get("det_code", np.zeros(size, dtype=np.int16)),
+                "npd_filename": table["npd_filename"],
+                }
+        for name in PARAMETERS:
+            if name in table:
+                columns[name] = table[name]
+        insert_rows(connection, "dataset_parameters", columns)
+    return model_id
+
+
+def write_sqlite(model, path, name="model", source="", replace=False):
+    """
+    Write a DatModel to a SQLite database, or a GeoPackage if the path ends
+    in .gpkg, adding it to the models already there (see write_model)
+    """
+    geopackage = is_geopackage(path)
+    connection = sqlite3.connect(path)
+    try:
+        with connection:
+            init_database(connection, geopackage)
+            write_model(connection, model, name, source, replace)
+            connection.executescript(INDEXES)
+            if geopackage:
+                update_extent(connection)
+    finally:
+        connection.close()
+
+
+def export_dats(file_paths, path, replace=False):
+    """
+    Add dat files to a database, each model named after its file. Files
+    with the same name as a model from another file are refused unless
+    replace is set
+    """
+    for file_path in file_paths:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        write_sqlite(load_model(file_path), path, name, file_path, replace)
+
+
+def main(argv=None):
+    """
+    Export the dat files given in the command line to one database
+    """
+    parser = argparse.ArgumentParser(
+            description="Export SIMCAT dat files to an indexed SQLite database "
+                        "or GeoPackage")
+    parser.add_argument("files", nargs="+", help="dat files to export")
+    parser.add_argument("-o", "--output", default="models.gpkg",
+                        help="database file, a GeoPackage if it ends in .gpkg "
+                             "(default: models.gpkg)")
+    parser.add_argument("--replace", action="store_true",
+                        help="replace models of the same name exported from "
+                             "other files")
+    args = parser.parse_args(argv)
+
+    export_dats(args.files, args.output, args.replace)
+    print(f"Exported {len(args.files)} models to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Synthetic dat files of any size, for benchmarks and scaling tests
+
+The Determinands, Reaches, River Flow, River Quality, Effluent and Features
+sections are generated with random but valid data and spliced into a
+template dat file (EXAMPLE.dat by default) with DatWriter, so notes, General
+data and section markers follow the datfile.config layout exactly.
+
+Reaches form a random tree in the newer connectivity scheme (downstream
+reach, 'x', 'x'). Every headwater reach starts with an upstream boundary
+feature, the other features are monitoring points, tributaries, plotting
+points and sewage, industrial and intermittent discharges. Some dataset
+rows use non-parametric (NPD) distributions and some river quality rows
+power curves, like SAGIS built models. The NPD files are not written.
+
+Example:
+    write_synthetic_dat("synthetic.dat", reaches=1000, features=20000)
+"""
+
+import numpy as np
+from dat_writer import (DatWriter, format_number, format_row, pad,
+                        REACH_WIDTHS, DECAY_WIDTH, STANDARD_WIDTHS,
+                        DATASET_WIDTH, FEATURE_WIDTHS, SEPARATOR_WIDTH)
+
+# Feature codes of the features after the headwater boundaries and their
+# relative frequencies
+FEATURE_CODES = ("1", "2", "3", "5", "6", "12")
+FEATURE_WEIGHTS = (0.15, 0.1, 0.2, 0.05, 0.3, 0.2)
+EFFLUENT_CODES = ("3", "5", "12")
+
+# Share of dataset rows with NPD and power curve distributions
+NPD_SHARE = 0.05
+POWER_SHARE = 0.1
+
+
+def determinand_lines(determinands):
+    """
+    Lines of the Determinands section, degradable determinands named D1,
+    D2, ...
+    """
+    return [f"2   'Determinand {n}'{' ' * (18 - len(str(n)))}'D{n}'"
+            f"{' ' * (10 - len(str(n)))}'mg/l'   0.2    0.00   0.0    0.0"
+            f"    0.0    0.0    0.0    0   0.0"
+            for n in range(1, determinands + 1)]
+
+
+def downstream_reaches(reaches, rng):
+    """
+    Downstream reach (1 based, 0 for the outlet) of each reach of a random
+    tree where every reach drains into a reach with a higher number
+    """
+    numbers = np.arange(1, reaches + 1)
+    # Mostly into one of the next few reaches, for long main rivers
+    jump = np.minimum(rng.geometric(0.5, reaches), reaches - numbers)
+    return np.where(numbers < reaches, numbers + jump, 0)
+
+
+def synthetic_reach_lines(reaches, determinands, flow_codes, wq_codes, rng):
+    """
+    Lines of the Reaches section and the lengths of the reaches
+    """
+    downstream = downstream_reaches(reaches, rng)
+    lengths = np.round(rng.uniform(0.2, 20.0, reaches), 3)
+    alphas = np.round(rng.uniform(5.0, 15.0, reaches), 3)
+    decay = np.round(rng.uniform(0.0, 2.0, (reaches, determinands)), 4)
+    flow_data = rng.choice(flow_codes, reaches)
+    wq_data = rng.choice(wq_codes, reaches)
+
+    lines = []
+    for n in range(reaches):
+        simno = str(n + 1)
+        lines.append(format_row((
+                simno, f"'Synthetic reach {simno}'",
+                format_number(lengths[n].item()), str(downstream[n]), "x", "x",
+                str(flow_data[n]), str(wq_data[n]),
+                format_number(alphas[n].item()), "0.5",
+                f"'GB{100000000000 + n}'", str(200000 + n),
+                ), REACH_WIDTHS).rstrip())
+        lines.append("".join(pad(format_number(v), DECAY_WIDTH)
+                             for v in decay[n].tolist()))
+        if determinands >= 2:
+            lines.append(format_row(("'Standard'", "2", "5"), STANDARD_WIDTHS)
+                         + "".join(pad(v, DATASET_WIDTH) for v in
+                                   ("0.3", "0.6", "1.1", "2.5", "9.9999")))
+    return lines, downstream, lengths
+
+
+def flow_lines(datasets, rng):
+    """
+    Lines of the River Flow section
+    """
+    means = np.round(rng.lognormal(1.0, 1.5, datasets), 4)
+    low_flows = np.round(means * rng.uniform(0.05, 0.4, datasets), 4)
+    npd = rng.random(datasets) < NPD_SHARE
+    lines = []
+    for n in range(datasets):
+        code = str(n + 1)
+        if npd[n]:
+            fields = (code, "4", f"'SynFlow{code}.npd'", "0.0",
+                      f"'Synthetic flow {code}'")
+        else:
+            fields = (code, "2", format_number(means[n].item()),
+                      format_number(low_flows[n].item()), "0.0", "-9.9",
+                      f"'Synthetic flow {code}'")
+        lines.append("".join(pad(field, DATASET_WIDTH) for field in fields).rstrip())
+    return lines
+
+
+def quality_lines(datasets, determinands, rng, effluent=False):
+    """
+    Lines of the River Quality section, or of the Effluent section with a
+    flow row (determinand 0) first in each dataset. Power curves are only
+    used for river quality, as in SAGIS built models
+    """
+    first = 0 if effluent else 1
+    dets = np.tile(np.arange(first, determinands + 1), datasets)
+    codes = np.repeat(np.arange(1, datasets + 1), determinands + 1 - first)
+    size = len(dets)
+    means = np.round(rng.lognormal(0.0, 1.0, size), 4)
+    stds = np.round(means * rng.uniform(0.2, 1.0, size), 4)
+    variant = rng.random(size)
+    name = "effluent" if effluent else "quality"
+
+    lines = []
+    for n in range(size):
+        code, det = str(codes[n]), str(dets[n])
+        mean, std = format_number(means[n].item()), format_number(stds[n].item())
+        title = f"'Synthetic {name} {code}'" if dets[n] == first else "''"
+        if variant[n] < NPD_SHARE:
+            fields = (code, det, "4", f"'Syn{name.title()}{code}_{det}.npd'",
+                      "0.6", "999", title)
+        elif variant[n] < NPD_SHARE + POWER_SHARE and not effluent:
+            fields = (code, det, "11", mean, std, "1.75", "1.0", "5.0", "1.0",
+                      "999", title)
+        else:
+            fields = (code, det, "2", mean, std, "0.0", "0.6", "999", title)
+        lines.append("".join(pad(field, DATASET_WIDTH) for field in fields).rstrip())
+    return lines
+
+
+def synthetic_feature_lines(features, downstream, lengths, flow_datasets,
+                            wq_datasets, eff_datasets, rng):
+    """
+    Lines of the Features section, grouped by reach with WBID separators.
+    Headwater reaches start with an upstream boundary
+    """
+    reaches = len(downstream)
+    headwater = np.ones(reaches, dtype=bool)
+    headwater[downstream[downstream > 0] - 1] = False
+
+    # Spread the other features over the reaches at random
+    others = max(features - int(headwater.sum()), 0)
+    reach_of = np.sort(rng.integers(0, reaches, others))
+    codes = rng.choice(FEATURE_CODES, others, p=FEATURE_WEIGHTS)
+    dist_head = np.round(rng.random(others) * lengths[reach_of], 3)
+    order = np.lexsort((dist_head, reach_of))
+    reach_of, codes, dist_head = reach_of[order], codes[order], dist_head[order]
+    flow_codes = rng.integers(1, flow_datasets + 1, others)
+    wq_codes = rng.integers(1, wq_datasets + 1, others)
+    eff_codes = rng.integers(1, eff_datasets + 1, others)
+    eastings = rng.integers(100000, 700000, others)
+    northings = rng.integers(100000, 1000000, others)
+    starts = np.searchsorted(reach_of, np.arange(reaches + 1))
+
+    lines = []
+    count = 0
+    for reach in range(reaches):
+        simno = str(reach + 1)
+        lines.append(f"Reach {simno} Synthetic reach {simno} - "
+                     f"WBID:GB{100000000000 + reach}".center(SEPARATOR_WIDTH, "="))
+        if headwater[reach]:
+            count += 1
+            lines.append(format_row((
+                    f"'Synthetic reach {simno} (Headwater)'", "-10", simno,
+                    "0.0", str(rng.integers(1, flow_datasets + 1)),
+                    str(rng.integers(1, wq_datasets + 1)), "0", "0", "0",
+                    f"'{rng.integers(100000, 700000)}"
+                    f"{rng.integers(100000, 1000000)}'"), FEATURE_WIDTHS))
+        for n in range(starts[reach], starts[reach + 1]):
+            count += 1
+            code = codes[n]
+            if code in EFFLUENT_CODES:
+                flow, wq = "0", str(eff_codes[n])
+            elif code == "2":
+                flow, wq = str(flow_codes[n]), str(wq_codes[n])
+            elif code == "1":
+                flow, wq = "0", str(wq_codes[n])
+            else:
+                flow, wq = "0", "0"
+            lines.append(format_row((
+                    f"'Synthetic feature {count}'", code, simno,
+                    format_number(dist_head[n].item()), flow, wq, "0", "0", "0",
+                    f"'{eastings[n]}{northings[n]}'"), FEATURE_WIDTHS))
+    return lines
+
+
+def synthetic_dat(reaches=100, features=2000, determinands=6,
+                  flow_datasets=None, wq_datasets=None, eff_datasets=None,
+                  seed=0, template="EXAMPLE.dat"):
+    """
+    Return a synthetic dat file as bytes. Dataset counts default to half
+    (river flow) and a quarter (river quality and effluent) of the number
+    of features
+    """
+    rng = np.random.default_rng(seed)
+    flow_datasets = flow_datasets or max(features // 2, 1)
+    wq_datasets = wq_datasets or max(features // 4, 1)
+    eff_datasets = eff_datasets or max(features // 4, 1)
+
+    reach_text, downstream, lengths = synthetic_reach_lines(
+            reaches, determinands, np.arange(1, flow_datasets + 1),
+            np.arange(1, wq_datasets + 1), rng)
+    sections = {
+            "Determinands": determinand_lines(determinands),
+            "Reaches": reach_text,
+            "RiverFlow": flow_lines(flow_datasets, rng),
+            "RiverQuality": quality_lines(wq_datasets, determinands, rng),
+            "Effluent": quality_lines(eff_datasets, determinands, rng,
+                                      effluent=True),
+            "Features": synthetic_feature_lines(
+                    features, downstream, lengths, flow_datasets, wq_datasets,
+                    eff_datasets, rng),
+            }
+    metadata = {
+            "SIMCAT data file": f"synthetic_{reaches}_{features}.dat",
+            "Created by": "synthetic.py",
+            }
+    return DatWriter(template).splice(sections, metadata)
+
+
+def write_synthetic_dat(file_path, **sizes):
+    """
+    Write a synthetic dat file, see synthetic_dat for the sizes
+    """
+    with open(file_path, "wb") as outfile:
+        outfile.write(synthetic_dat(**sizes))
+
+
+if __name__ == "__main__":
+    from model import load_model
+    write_synthetic_dat("synthetic.dat", reaches=200, features=5000)
+    model = load_model("synthetic.dat")
+    print(f"{len(model.reaches['simno'])} reaches, "
+          f"{len(model.features['reach'])} features, {len(model.flow)} flow, "
+          f"{len(model.wq)} quality and {len(model.eff)} effluent datasets")
@@ -0,0 +1,50 @@
+"""
+Shared fixtures of the dat file converter tests
+"""
+
+import os
+import sys
+
+import pytest
+
+TOOL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, TOOL_DIR)
+
+EXAMPLE = os.path.join(TOOL_DIR, "EXAMPLE.dat")
+
+# River flow data-set 1 of EXAMPLE.dat, up to its shift and correlation
+FLOW_SET_1 = b"1     2   3.1150                    0.4387        0.00  -9.9"
+
+
+@pytest.fixture
+def example_copy(tmp_path):
+    """
+    Write a copy of EXAMPLE.dat with some text replaced, returning its path
+    """
+    with open(EXAMPLE, "rb") as infile:
+        data = infile.read()
+
+    def write(name, old=None, new=None):
+        text = data
+        if old is not None:
+            assert old in text
+            text = text.replace(old, new, 1)
+        path = tmp_path / name
+        path.write_bytes(text)
+        return str(path)
+
+    return write
+
+
+@pytest.fixture
+def shifted_flows(example_copy):
+    """
+    Two copies of EXAMPLE.dat whose river flow data-set 1, made a shifted
+    log-normal (distribution 3), only differs in its shift, -1.00 against
+    -2.00
+    """
+    shifted = FLOW_SET_1.replace(b"1     2", b"1     3")
+    return (example_copy("minus1.dat", FLOW_SET_1,
+                         shifted.replace(b" 0.00", b"-1.00")),
+            example_copy("minus2.dat", FLOW_SET_1,
+                         shifted.replace(b" 0.00", b"-2.00")))
@@ -0,0 +1,48 @@
+"""
+Tests of the batch conversion of folders of dat files
+"""
+
+import os
+
+import pytest
+
+from batch import batch_convert, load_manifest
+from conftest import EXAMPLE
+
+
+@pytest.fixture
+def scenarios(tmp_path):
+    """
+    A folder with EXAMPLE.dat, a copy cut short, an empty file and junk
+    """
+    folder = tmp_path / "scenarios"
+    folder.mkdir()
+    with open(EXAMPLE, "rb") as infile:
+        data = infile.read()
+    (folder / "good.dat").write_bytes(data)
+    (folder / "trunc.dat").write_bytes(data[:20000])
+    (folder / "empty.dat").write_bytes(b"")
+    (folder / "junk.dat").write_bytes(b"not\na\ndat\nfile\n" * 10)
+    return str(folder)
+
+
+@pytest.mark.parametrize("formats", [["json"], ["parquet"], ["json", "gpkg"]])
+def test_incomplete_files_fail_without_outputs(tmp_path, scenarios, formats):
+    out_dir = str(tmp_path / "out")
+    summary = batch_convert([scenarios], out_dir, formats, workers=2)
+
+    assert summary["converted"] == 1
+    assert summary["failed"] == 3
+    errors = {os.path.basename(path): error
+              for path, error in summary["errors"].items()}
+    assert "no Effluent section" in errors["trunc.dat"]
+    assert "no Features section" in errors["empty.dat"]
+    assert "Header line 2" in errors["junk.dat"]
+
+    # Only the complete file has outputs and a manifest entry
+    manifest = load_manifest(out_dir)
+    good = os.path.join(scenarios, "good.dat")
+    assert list(manifest) == [good]
+    assert sorted(os.listdir(out_dir)) == sorted(
+        ["manifest.json"] + [os.path.basename(path)
+                             for path in manifest[good]["outputs"]])
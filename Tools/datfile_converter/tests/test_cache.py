@@ -0,0 +1,24 @@
+"""
+Tests of the content addressed cache of parsed dat files
+"""
+
+import os
+
+from cache import DatCache
+
+
+def test_copies_read_npd_files_next_to_them(tmp_path, example_copy):
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    first_path = example_copy(os.path.join("first", "EXAMPLE.dat"))
+    second_path = example_copy(os.path.join("second", "EXAMPLE.dat"))
+
+    cache = DatCache(str(tmp_path / "cache"))
+    assert cache.load_model(first_path).npd.folder == str(first)
+    assert cache.load_model(second_path).npd.folder == str(second)
+    # Read back from disk rather than from the memo
+    assert DatCache(str(tmp_path / "cache")).load_model(
+            second_path).npd.folder == str(second)
+    assert cache.load_model(first_path).npd.folder == str(first)
@@ -0,0 +1,42 @@
+"""
+Tests of the columnar export of the model
+"""
+
+import numpy as np
+
+from columnar import model_tables, write_columnar, read_columnar, TABLES
+from conftest import EXAMPLE
+from datfile import config
+from model import load_model
+
+
+def test_round_trip(tmp_path):
+    model = load_model(EXAMPLE)
+    write_columnar(model, str(tmp_path), "npz")
+
+    features = read_columnar(str(tmp_path), "features", ["simno", "easting"])
+    assert len(features["simno"]) == len(model.features["reach"])
+    first = model.feature(1)
+    assert features["easting"][0] == first.to_dict()["giscode"]["long"]
+    assert features["simno"][0] == first.reach.simno
+
+
+def test_model_without_reaches_gives_empty_tables(tmp_path):
+    # Keep the metadata and determinands only
+    with open(EXAMPLE, "rb") as infile:
+        data = infile.read()
+    end = config["Determinands"]["end"].encode()
+    path = tmp_path / "determinands.dat"
+    path.write_bytes(data[:data.index(end) + len(end)] + b"\r\n")
+
+    model = load_model(str(path))
+    tables = model_tables(model)
+    assert set(tables) == set(TABLES)
+    for table in tables.values():
+        assert all(len(column) == 0 for column in table.values())
+    assert f"decay_{model.det_names[1]}" in tables["reaches"]
+
+    write_columnar(model, str(tmp_path / "out"), "npz")
+    reaches = read_columnar(str(tmp_path / "out"), "reaches")
+    assert reaches["simno"].shape == (0,)
+    assert np.issubdtype(reaches["length"].dtype, np.floating)
@@ -0,0 +1,43 @@
+"""
+Tests of writing DatModels back to dat files
+"""
+
+import numpy as np
+
+from conftest import EXAMPLE
+from dat_to_json import parse_dat
+from dat_writer import DatWriter, check_round_trip, with_dataset_columns
+from diff import flatten
+from model import load_model
+
+
+def test_round_trip_parses_to_the_same_data(tmp_path):
+    path = str(tmp_path / "round_trip.dat")
+    DatWriter(EXAMPLE).write(load_model(EXAMPLE), path)
+
+    assert parse_dat(path) == parse_dat(EXAMPLE)
+    assert parse_dat(path, bulk=True) == parse_dat(EXAMPLE, bulk=True)
+    assert all(check_round_trip(EXAMPLE).values())
+
+
+def test_effluent_variant_only_changes_effluent_means(tmp_path):
+    model = load_model(EXAMPLE)
+    mean = model.eff.columns["mean"]
+    factors = np.random.default_rng(0).lognormal(0, 0.2, len(mean))
+    variant = with_dataset_columns(model, "Effluent", mean=mean * factors)
+    path = str(tmp_path / "variant.dat")
+    DatWriter(EXAMPLE).write(variant, path, sections=("Effluent",))
+
+    written = load_model(path)
+    for name, column in model.eff.columns.items():
+        if name != "mean":
+            np.testing.assert_array_equal(written.eff.columns[name], column)
+    np.testing.assert_array_equal(written.eff.columns["mean"], mean * factors)
+
+    old, new = flatten(parse_dat(EXAMPLE)), flatten(parse_dat(path))
+    assert old.keys() == new.keys()
+    changed = [key for key in old if old[key] != new[key]
+               and not (old[key] != old[key] and new[key] != new[key])]
+    assert changed
+    assert all(".eff_data." in key and key.endswith(".mean_conc")
+               for key in changed)
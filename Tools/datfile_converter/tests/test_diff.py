@@ -0,0 +1,17 @@
+"""
+Tests of the structural diff between dat files
+"""
+
+from diff import diff_dat
+
+
+def test_identical_files_have_no_changes(example_copy):
+    assert diff_dat(example_copy("a.dat"), example_copy("b.dat")) == []
+
+
+def test_shift_change_is_reported(shifted_flows):
+    # hash(-1.0) == hash(-2.0), so a diff built on the built-in hash
+    # missed this edit
+    changes = diff_dat(*shifted_flows)
+    assert changes == [{"entity": "flow", "key": "1", "change": "changed",
+                        "fields": {"shift_flow": (-1.0, -2.0)}}]
@@ -0,0 +1,39 @@
+"""
+Tests of the giscode decoding into easting and northing
+"""
+
+import numpy as np
+import pytest
+
+from datfile import get_coordinates, get_coordinates_array
+
+
+@pytest.mark.parametrize("giscode", [
+        "359239158127",
+        "52345678901",
+        "12345678901",
+        "123456789012345678",
+        " 359239158127",
+        "359239158127 ",
+        "\t359239158127\r",
+        "+35923915812",
+        "-35923915812",
+        "3592 3915812",
+        "３５９２３９１５８１２",
+        "٣٥٩٢٣٩١٥٨١٢",
+        "1234567890123456789",
+        "123456",
+        "",
+        "   ",
+        ])
+def test_array_matches_scalar(giscode):
+    easting, northing, valid = get_coordinates_array(
+            np.array([giscode], dtype=str))
+    try:
+        expected = get_coordinates(giscode)
+    except ValueError:
+        assert not valid[0]
+        assert (easting[0], northing[0]) == (-1, -1)
+    else:
+        assert valid[0]
+        assert (easting[0], northing[0]) == expected
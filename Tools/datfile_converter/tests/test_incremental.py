@@ -0,0 +1,27 @@
+"""
+Tests of the incremental re-simulation of scenarios
+"""
+
+import numpy as np
+
+from incremental import RESULT_ARRAYS, IncrementalRun
+from model import load_model
+from simulation import read_run_settings, simulate
+
+SHOTS = 200
+
+
+def test_rerun_matches_full_run(shifted_flows):
+    baseline_path, scenario_path = shifted_flows
+    baseline = IncrementalRun.from_dat(baseline_path, shots=SHOTS)
+    scenario = load_model(scenario_path)
+    settings = read_run_settings(scenario_path)
+
+    results = baseline.rerun(scenario, settings)
+    full = simulate(scenario, SHOTS, settings=settings)
+
+    assert results["recomputed"]
+    assert not np.allclose(baseline.results["flow_mean"], full["flow_mean"],
+                           equal_nan=True)
+    for name in RESULT_ARRAYS:
+        np.testing.assert_array_equal(results[name], full[name])
@@ -0,0 +1,79 @@
+"""
+Tests of the Monte Carlo mass balance on a hand-checkable model
+"""
+
+import pytest
+
+from conftest import EXAMPLE
+from dat_writer import (DatWriter, format_row, pad, REACH_WIDTHS, DECAY_WIDTH,
+                        DATASET_WIDTH, FEATURE_WIDTHS, SEPARATOR_WIDTH)
+from model import load_model
+from simulation import read_run_settings, simulate
+
+SHOTS = 100
+
+
+def dataset_line(*fields):
+    return "".join(pad(field, DATASET_WIDTH) for field in fields).rstrip()
+
+
+def feature_line(name, code, dist_head, flow, wq):
+    return format_row((f"'{name}'", code, "1", dist_head, flow, wq, "0", "0",
+                       "0", "'350000150000'"), FEATURE_WIDTHS)
+
+
+def single_reach_dat(effluent_dist):
+    """
+    One 10 km reach of a conservative determinand: a headwater of 10 Ml/d
+    at 2 mg/l and, 4 km down, an effluent of 2 Ml/d at 20 mg/l or, for
+    effluent distribution 6, a load of 20 kg/d. Every value is constant
+    """
+    sections = {
+        "Determinands": [
+            "1   'Chloride'          'Cl'       'mg/l'   0.0    0.00   0.0"
+            "    0.0    0.0    0.0    0.0    0   0.0"],
+        "Reaches": [
+            format_row(("1", "'Reach 1'", "10.0", "0", "x", "x", "0", "0",
+                        "10.0", "0.5", "'GB100000000000'", "200000"),
+                       REACH_WIDTHS).rstrip(),
+            pad("-1.0", DECAY_WIDTH)],
+        "RiverFlow": [dataset_line("1", "0", "10.0", "10.0", "0.0", "-9.9",
+                                   "'Headwater flow'")],
+        "RiverQuality": [dataset_line("1", "1", "0", "2.0", "0.0", "0.0",
+                                      "-9.9", "999", "'Headwater quality'")],
+        "Effluent": [
+            dataset_line("1", "0", "0", "2.0", "0.0", "0.0", "-9.9", "999",
+                         "'Works'"),
+            dataset_line("1", "1", effluent_dist, "20.0", "0.0", "0.0",
+                         "-9.9", "999", "''")],
+        "Features": [
+            "Reach 1 Reach 1 - WBID:GB100000000000".center(SEPARATOR_WIDTH,
+                                                          "="),
+            feature_line("Headwater", "-10", "0.0", "1", "1"),
+            feature_line("Works", "3", "4.0", "0", "1"),
+            feature_line("Outlet", "1", "10.0", "0", "0")],
+    }
+    return DatWriter(EXAMPLE).splice(sections)
+
+
+@pytest.mark.parametrize("effluent_dist, outlet_conc", [
+    # (10 Ml/d x 2 mg/l + 2 Ml/d x 20 mg/l) / 12 Ml/d
+    ("0", 60.0 / 12.0),
+    ("2", 60.0 / 12.0),
+    # (10 Ml/d x 2 mg/l + 20 kg/d) / 12 Ml/d, effluent 6 being a load
+    ("6", 40.0 / 12.0),
+])
+def test_single_reach_mass_balance(tmp_path, effluent_dist, outlet_conc):
+    path = tmp_path / "single.dat"
+    path.write_bytes(single_reach_dat(effluent_dist))
+    model = load_model(str(path))
+    results = simulate(model, SHOTS, settings=read_run_settings(str(path)))
+
+    headwater, works, outlet = range(3)
+    assert results["flow_mean"][headwater] == pytest.approx(10.0)
+    assert results["conc_mean"][headwater, 0] == pytest.approx(2.0)
+    assert results["flow_mean"][outlet] == pytest.approx(12.0)
+    assert results["conc_mean"][works, 0] == pytest.approx(outlet_conc)
+    assert results["conc_mean"][outlet, 0] == pytest.approx(outlet_conc)
+    assert results["conc_q95"][outlet, 0] == pytest.approx(outlet_conc)
+    assert not results["warnings"]
@@ -0,0 +1,61 @@
+"""
+Tests of the SQLite and GeoPackage export of dat file models
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+from model import load_model
+from sqlite_export import export_dats, write_sqlite
+
+
+def model_sources(path):
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute(
+                "SELECT name, source FROM models ORDER BY name").fetchall()
+    finally:
+        connection.close()
+
+
+def test_same_file_name_from_another_folder_is_refused(tmp_path, example_copy):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = example_copy(os.path.join("a", "Option1.dat"))
+    second = example_copy(os.path.join("b", "Option1.dat"))
+    path = str(tmp_path / "scenarios.gpkg")
+
+    export_dats([first], path)
+    # Exporting the same file again replaces it
+    export_dats([first], path)
+    assert model_sources(path) == [("Option1", first)]
+
+    with pytest.raises(ValueError, match="already has a model named 'Option1'"):
+        export_dats([second], path)
+    assert model_sources(path) == [("Option1", first)]
+
+    export_dats([second], path, replace=True)
+    assert model_sources(path) == [("Option1", second)]
+
+
+def test_repeated_dataset_codes_are_kept(tmp_path, example_copy):
+    # River flow data-set 2 renumbered as a second data-set 1
+    dat_path = example_copy("repeated.dat", b"2     2   2.1707",
+                            b"1     2   2.1707")
+    path = str(tmp_path / "repeated.sqlite")
+    write_sqlite(load_model(dat_path), path, "repeated", dat_path)
+
+    connection = sqlite3.connect(path)
+    try:
+        means = connection.execute(
+                "SELECT mean FROM dataset_parameters WHERE section = "
+                "'RiverFlow' AND code = '1' ORDER BY rowid").fetchall()
+        titles = connection.execute(
+                "SELECT count(*) FROM datasets WHERE section = 'RiverFlow' "
+                "AND code = '1'").fetchone()
+    finally:
+        connection.close()
+    assert means == [(3.115,), (2.1707,)]
+    assert titles == (2,)
@@ -0,0 +1,170 @@
+"""
+Direct yaml export of the dat file data
+
+The document is streamed reach by reach from the in-memory data (a DatFile
+dict, a lazily loaded normalised export or a DatModel) with anchors and
+aliases turned off, so the output matches a json round trip without
+serialising the model twice
+"""
+
+import os
+import json
+import time
+import tempfile
+from collections.abc import Mapping
+import yaml
+from yaml.events import (DocumentStartEvent, DocumentEndEvent,
+                         MappingStartEvent, MappingEndEvent,
+                         SequenceStartEvent, SequenceEndEvent, ScalarEvent)
+from yaml.nodes import ScalarNode, SequenceNode, MappingNode
+
+# Use the libyaml emitter when available
+try:
+    from yaml import CSafeDumper as BaseDumper
+except ImportError:
+    from yaml import SafeDumper as BaseDumper
+
+MAP_TAG = "tag:yaml.org,2002:map"
+
+
+class NoAliasDumper(BaseDumper):
+    """
+    Safe dumper writing repeated objects in full instead of using anchors
+    """
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def represent_mapping(dumper, data):
+    """
+    Represent any mapping with string keys, as a json round trip would
+    """
+    return dumper.represent_mapping(
+            MAP_TAG,
+            [(k if isinstance(k, str) else json.dumps(k), v)
+             for k, v in data.items()])
+
+
+NoAliasDumper.add_representer(dict, represent_mapping)
+NoAliasDumper.add_multi_representer(Mapping, represent_mapping)
+
+
+def emit_node(dumper, node):
+    """
+    Emit the events of a represented node
+    """
+    if isinstance(node, ScalarNode):
+        detected_tag = dumper.resolve(ScalarNode, node.value, (True, False))
+        default_tag = dumper.resolve(ScalarNode, node.value, (False, True))
+        implicit = (node.tag == detected_tag), (node.tag == default_tag)
+        dumper.emit(ScalarEvent(None, node.tag, implicit, node.value,
+                                style=node.style))
+
+    elif isinstance(node, SequenceNode):
+        implicit = node.tag == dumper.resolve(SequenceNode, node.value, True)
+        dumper.emit(SequenceStartEvent(None, node.tag, implicit,
+                                       flow_style=node.flow_style))
+        for item in node.value:
+            emit_node(dumper, item)
+        dumper.emit(SequenceEndEvent())
+
+    elif isinstance(node, MappingNode):
+        implicit = node.tag == dumper.resolve(MappingNode, node.value, True)
+        dumper.emit(MappingStartEvent(None, node.tag, implicit,
+                                      flow_style=node.flow_style))
+        for key, value in node.value:
+            emit_node(dumper, key)
+            emit_node(dumper, value)
+        dumper.emit(MappingEndEvent())
+
+
+def emit_data(dumper, data):
+    """
+    Represent and emit a python object, then drop the representer state so
+    nothing is kept between fragments
+    """
+    emit_node(dumper, dumper.represent_data(data))
+    dumper.represented_objects = {}
+    dumper.object_keeper = []
+    dumper.alias_key = None
+
+
+def iter_reach_items(dat_file):
+    """
+    Yield (simno, reach) pairs one at a time. Reaches of a DatModel are
+    only converted to dicts as they are written
+    """
+    if hasattr(dat_file, "iter_reaches"):
+        for reach in dat_file.iter_reaches():
+            yield reach.simno, reach.to_dict()
+    else:
+        yield from dat_file["reaches"].items()
+
+
+def write_yaml(dat_file, stream):
+    """
+    Write the dat file data as yaml to an open stream, reach by reach
+    """
+    dumper = NoAliasDumper(stream, default_flow_style=False, sort_keys=False)
+    dumper.open()
+    dumper.emit(DocumentStartEvent(explicit=False))
+    dumper.emit(MappingStartEvent(None, MAP_TAG, True, flow_style=False))
+
+    for key in ("metadata", "determinands"):
+        emit_data(dumper, key)
+        emit_data(dumper, dat_file[key] if isinstance(dat_file, Mapping)
+                  else getattr(dat_file, key))
+
+    emit_data(dumper, "reaches")
+    dumper.emit(MappingStartEvent(None, MAP_TAG, True, flow_style=False))
+    for simno, reach in iter_reach_items(dat_file):
+        emit_data(dumper, simno)
+        emit_data(dumper, reach)
+    dumper.emit(MappingEndEvent())
+
+    dumper.emit(MappingEndEvent())
+    dumper.emit(DocumentEndEvent(explicit=False))
+    dumper.close()
+
+
+def write_yaml_file(dat_file, file_path):
+    """
+    Export the dat file data as a yaml file
+    """
+    with open(file_path, "w") as outfile:
+        write_yaml(dat_file, outfile)
+
+
+def compare_yaml_export(dat_file, repeat=5):
+    """
+    Time the json round trip yaml export against the direct one, returning
+    the best time in seconds of each
+    """
+    timings = {"json_round_trip": [], "direct": []}
+    with tempfile.TemporaryDirectory() as folder:
+        jsonfile = os.path.join(folder, "out.json")
+        yamlfile = os.path.join(folder, "out.yaml")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with open(jsonfile, "w") as outfile:
+                json.dump(dat_file, outfile, indent=4, sort_keys=False)
+            with open(jsonfile) as f:
+                data = json.load(f)
+            with open(yamlfile, "w") as outfile:
+                yaml.safe_dump(data, outfile, default_flow_style=False,
+                               sort_keys=False)
+            timings["json_round_trip"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            write_yaml_file(dat_file, yamlfile)
+            timings["direct"].append(time.perf_counter() - start)
+
+    return {name: min(values) for name, values in timings.items()}
+
+
+if __name__ == "__main__":
+    from dat_to_json import parse_dat
+
+    for name, seconds in compare_yaml_export(parse_dat("EXAMPLE.dat")).items():
+        print(f"{name}: {seconds:.3f}s")
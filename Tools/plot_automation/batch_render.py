@@ -0,0 +1,156 @@
+"""
+Parallel batch rendering of chainage charts
+
+The plot output layers are read and split by river in the main process
+(chainage_plots_tool.chart_data) and every (reach, determinand, scenario)
+chart is rendered in a process pool. The data of a chart is sent to its
+worker as a dict of NumPy column arrays, text as fixed width strings,
+rather than as a pickled DataFrame. Only a few charts per worker are in
+flight at once, so the data of a whole chart pack is never held in
+memory. Progress is reported in chart order and a failed chart does not
+stop the batch.
+
+Example:
+    python batch_render.py snapshot -1 BaseGIS1TP BaseGIS1Ammonia -r Cam Wellow -j 8
+"""
+
+import os
+import sys
+import time
+import argparse
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+import utilities
+from chainage_plots_tool import (add_chart_arguments, chart_data, chart_pairs,
+                                 chart_params)
+from data_sources import open_source
+
+# Charts queued per worker, enough to keep the workers busy
+JOBS_PER_WORKER = 2
+
+
+def frame_arrays(df):
+    """
+    Columns of a DataFrame as NumPy arrays, text as fixed width strings
+    """
+    arrays = {}
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype == object and all(isinstance(v, str) for v in values):
+            values = values.astype(str)
+        arrays[name] = values
+    return arrays
+
+
+def arrays_frame(arrays):
+    """
+    DataFrame from the arrays of frame_arrays
+    """
+    if arrays is None:
+        return None
+    return pd.DataFrame(arrays)
+
+
+def render_job(out1, out2, reach, params, arrays1, arrays2, fig_folder):
+    """
+    Render one chart in a worker process. Never raises: failures are
+    returned so one bad chart does not stop the batch
+    """
+    start = time.perf_counter()
+    result = {"chart": chart_name(out1, out2, reach), "status": "rendered",
+              "error": None, "figure": None}
+    try:
+        result["figure"] = utilities.plot_chainage_chart(
+            out1, out2, reach, params, df1=arrays_frame(arrays1),
+            df2=arrays_frame(arrays2), fig_folder=fig_folder)
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = "".join(
+            traceback.format_exception_only(type(e), e)).strip()
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
+def chart_name(out1, out2, reach):
+    if out2:
+        return f"{out1} vs {out2} on {reach}"
+    return f"{out1} on {reach}"
+
+
+def batch_render(params, source, workers=None):
+    """
+    Render every chart of the tool parameters with a process pool sized
+    to the machine's cores by default. Returns a summary with the number
+    of rendered and failed charts, the figures and the errors
+    """
+    pairs, reaches_list = chart_pairs(params)
+    total = len(pairs) * len(reaches_list)
+    fig_folder = source.figure_folder()
+    workers = workers or os.cpu_count()
+    summary = {"rendered": 0, "failed": 0, "figures": [], "errors": {}}
+    start = time.perf_counter()
+
+    def report(done, name, future):
+        # A crashed worker process fails its chart too
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {"chart": name, "status": "failed", "seconds": 0.0,
+                      "error": "".join(traceback.format_exception_only(
+                          type(e), e)).strip()}
+        status = result["status"]
+        summary[status] += 1
+        print(f"[{done}/{total}] {status} {result['chart']} "
+              f"({result['seconds']:.2f}s)")
+        if status == "failed":
+            summary["errors"][result["chart"]] = result["error"]
+            print(f"    {result['error']}", file=sys.stderr)
+        else:
+            summary["figures"].append(result["figure"])
+
+    # Charts are reported in order, waiting for the oldest one in flight
+    done = 0
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for out1, out2, reach, df1, df2 in chart_data(params, source):
+            future = pool.submit(
+                render_job, out1, out2, reach, params, frame_arrays(df1),
+                None if df2 is None else frame_arrays(df2), fig_folder)
+            in_flight.append((chart_name(out1, out2, reach), future))
+            if len(in_flight) >= workers * JOBS_PER_WORKER:
+                done += 1
+                report(done, *in_flight.popleft())
+        while in_flight:
+            done += 1
+            report(done, *in_flight.popleft())
+
+    summary["seconds"] = time.perf_counter() - start
+    print(f"Rendered {summary['rendered']}, failed {summary['failed']} of "
+          f"{total} charts in {summary['seconds']:.1f}s")
+    for name, error in summary["errors"].items():
+        print(f"  {name}: {error}")
+    return summary
+
+
+def main(argv=None):
+    """
+    Render the chainage plots of a snapshot folder in parallel
+    """
+    parser = argparse.ArgumentParser(
+        description="Chainage plots from a snapshot, rendered in parallel")
+    add_chart_arguments(parser)
+    parser.add_argument("-j", "--workers", type=int,
+                        help="number of processes (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    summary = batch_render(chart_params(args),
+                           open_source(args.snapshot, args.out_dir),
+                           args.workers)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,131 @@
 """
 Library containing the main functions of the chainage plots tool
+
+Inside ArcGIS Pro the tool reads the layers with arcpy. Elsewhere charts are
+rendered from a snapshot folder exported once with
+data_sources.export_snapshot, e.g.:
+    python chainage_plots_tool.py snapshot -1 BaselineGIS1Ammonia -r River_Cam
 """
 
+import argparse
+
 import utilities
+from data_sources import open_source
 
 import importlib
 importlib.reload(utilities)
 
+# Tool parameters, as text like the ArcGIS Pro toolbox passes them
+DEFAULT_PARAMS = {
+    "outputs_list_1": "",
+    "outputs_list_2": None,
+    "reaches_list": "",
+    "calibration_flag": "true",
+    "target_flag": "false",
+    "headwater_flag": "false",
+    "annotate_flag": "true",
+    "annotate_filter": "0",
+    "annotate_features": None,
+    "custom_annotations": None,
+    "figure_size": "10",
+    "aspect_ratio_modifier": "1",
+    "legend_loc": "best",
+}
 
-def chainage_plots(params):
-    """Main function to create the chainage plots"""
 
-    # Retrieve parameters and transform as needed
+def chart_pairs(params):
+    """
+    Pairs of output layers (the second None without comparison) and the
+    reach layers to plot
+    """
     outputs_list_1 = params["outputs_list_1"].split(';')
     outputs_list_2 = params["outputs_list_2"]
     if outputs_list_2:
         outputs_list_2 = outputs_list_2.split(';')
-    reaches_list = params["reaches_list"].split(';')
-
-    # Loop through rivers and determinands
-    for reach in reaches_list:
-        if outputs_list_2:
-            for out1, out2 in zip(outputs_list_1, outputs_list_2):
-                utilities.plot_chainage_chart(out1, out2, reach, params)
-        else:
-            for out1 in outputs_list_1:
-                utilities.plot_chainage_chart(out1, out2=None, reach=reach, params=params)
+        pairs = list(zip(outputs_list_1, outputs_list_2))
+    else:
+        pairs = [(out1, None) for out1 in outputs_list_1]
+    return pairs, params["reaches_list"].split(';')
+
+
+def chart_data(params, source):
+    """
+    Yield (out1, out2, reach, df1, df2) for every chart, df2 being None
+    without comparison. Each output layer is read once and split by river,
+    and kept only while later pairs still use it
+    """
+    pairs, reaches_list = chart_pairs(params)
+    outputs = {}
+    for n, (out1, out2) in enumerate(pairs):
+        for out in (out1, out2):
+            if out and out not in outputs:
+                outputs[out] = source.read_outputs(out, reaches_list)
+        for reach in reaches_list:
+            yield (out1, out2, reach, outputs[out1][reach],
+                   outputs[out2][reach] if out2 else None)
+        later = {out for pair in pairs[n + 1:] for out in pair}
+        outputs = {out: df for out, df in outputs.items() if out in later}
+
+
+def chainage_plots(params, source=None):
+    """Main function to create the chainage plots"""
+
+    # Read the layers from ArcGIS Pro unless another source is given
+    if source is None:
+        source = open_source()
+
+    # Loop through determinands and rivers
+    for out1, out2, reach, df1, df2 in chart_data(params, source):
+        utilities.plot_chainage_chart(out1, out2, reach, params, source, df1,
+                                      df2)
+
+
+def add_chart_arguments(parser):
+    """
+    Command line arguments of the charts of a snapshot folder
+    """
+    parser.add_argument("snapshot", help="snapshot folder")
+    parser.add_argument("-1", "--outputs", nargs="+", required=True,
+                        help="plot output layers")
+    parser.add_argument("-2", "--compare", nargs="+",
+                        help="plot output layers to compare with")
+    parser.add_argument("-r", "--reaches", nargs="+", required=True,
+                        help="reach layers to plot")
+    parser.add_argument("-o", "--out-dir",
+                        help="figures folder (default: snapshot/Figures)")
+    parser.add_argument("--no-calibration", action="store_true",
+                        help="do not add the calibration chart on top")
+    parser.add_argument("--targets", action="store_true",
+                        help="add targets to the plots")
+    parser.add_argument("--no-headwater", action="store_true",
+                        help="remove headwater point")
+
+
+def chart_params(args):
+    """
+    Tool parameters from the command line arguments
+    """
+    params = dict(DEFAULT_PARAMS)
+    params["outputs_list_1"] = ";".join(args.outputs)
+    if args.compare:
+        params["outputs_list_2"] = ";".join(args.compare)
+    params["reaches_list"] = ";".join(args.reaches)
+    params["calibration_flag"] = "false" if args.no_calibration else "true"
+    params["target_flag"] = "true" if args.targets else "false"
+    params["headwater_flag"] = "true" if args.no_headwater else "false"
+    return params
+
+
+def main(argv=None):
+    """
+    Create the chainage plots of a snapshot folder without ArcGIS Pro
+    """
+    parser = argparse.ArgumentParser(
+        description="Chainage plots from a snapshot of plot output layers")
+    add_chart_arguments(parser)
+    args = parser.parse_args(argv)
+    chainage_plots(chart_params(args), open_source(args.snapshot, args.out_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,467 @@
+"""
+Data sources of the chainage plots tool
+
+A data source reads each plot output layer once, with only the COLUMNS
+the charts need, and splits it by reach layer in memory: the points within
+2 m of the lines of every reach layer are found in one pass, like the
+intersect selection by location the tool used to run for every reach and
+output. ArcpySource reads the layers inside ArcGIS Pro. SnapshotSource
+reads the same data from snapshot files, so charts can be rendered without
+arcpy, e.g. on Linux batch servers. It also tells where figures are saved.
+
+A snapshot is a folder with one file per layer, written once from ArcGIS
+with export_snapshot:
+    outputs/<layer>.<ext>  plot output points, COLUMNS plus X and Y
+    reaches/<layer>.<ext>  reach vertices in order, PART, X and Y
+where ext is gpkg, parquet or csv. GeoPackage layers may also be exported
+straight from ArcGIS (e.g. with Copy Features), their point and line
+geometries are decoded here.
+
+Example (ArcGIS Pro python window):
+    export_snapshot(["BaselineGIS1Ammonia"], ["River_Cam"], "C:/snapshot")
+
+Example (anywhere):
+    source = SnapshotSource("snapshot")
+    reaches = source.read_outputs("BaselineGIS1Ammonia", ["River_Cam", "Wellow"])
+    reaches["River_Cam"]
+"""
+
+import os
+import struct
+import sqlite3
+import numpy as np
+import pandas as pd
+
+from utilities import COLUMNS
+
+# Distance from the reaches within which plot output points are selected, in
+# the units of the projected spatial reference of the layers (metres)
+SEARCH_DISTANCE = 2.0
+
+# Snapshot file formats, in order of preference when reading
+SNAPSHOT_FORMATS = ("parquet", "gpkg", "csv")
+
+
+def import_arcpy():
+    """
+    Import arcpy, only available inside ArcGIS Pro
+    """
+    try:
+        import arcpy
+    except ImportError:
+        raise ImportError(
+            "arcpy is needed to read layers from ArcGIS, use a "
+            "SnapshotSource to read exported snapshots instead"
+        )
+    return arcpy
+
+
+def wkb_coordinates(blob, offset=0):
+    """
+    Decode a WKB point, line string or multi line string starting at
+    offset. Returns the (n, 2) x and y coordinates of each part and the
+    offset after the geometry
+    """
+    order = "<" if blob[offset] == 1 else ">"
+    geometry_type = struct.unpack_from(order + "I", blob, offset + 1)[0]
+    offset += 5
+    # ISO WKB adds 1000 for Z, 2000 for M and 3000 for ZM
+    dims = (2, 3, 3, 4)[geometry_type // 1000]
+    base_type = geometry_type % 1000
+    dtype = np.dtype(order + "f8")
+
+    if base_type == 1:
+        coords = np.frombuffer(blob, dtype, dims, offset).reshape(1, dims)
+        return [coords[:, :2]], offset + 8 * dims
+    if base_type == 2:
+        count = struct.unpack_from(order + "I", blob, offset)[0]
+        offset += 4
+        coords = np.frombuffer(blob, dtype, count * dims, offset)
+        return [coords.reshape(count, dims)[:, :2]], offset + 8 * count * dims
+    if base_type in (4, 5):
+        count = struct.unpack_from(order + "I", blob, offset)[0]
+        offset += 4
+        parts = []
+        for _ in range(count):
+            part, offset = wkb_coordinates(blob, offset)
+            parts.extend(part)
+        return parts, offset
+    raise ValueError(f"Unsupported WKB geometry type {geometry_type}")
+
+
+def gpkg_coordinates(blob):
+    """
+    Coordinates of each part of a GeoPackage geometry blob
+    """
+    if blob is None:
+        return []
+    blob = bytes(blob)
+    if blob[:2] != b"GP":
+        raise ValueError("Not a GeoPackage geometry")
+    # Envelope of 0, 4, 6, 6 or 8 doubles after the 8 byte header
+    envelope = (0, 32, 48, 48, 64)[(blob[3] >> 1) & 7]
+    return wkb_coordinates(blob, 8 + envelope)[0]
+
+
+def read_geopackage(path, table=None):
+    """
+    Read a GeoPackage feature table as a DataFrame, the geometry decoded
+    into a list of the coordinates of its parts. Reads the first feature
+    table unless one is named
+    """
+    connection = sqlite3.connect(path)
+    try:
+        if table is None:
+            table = connection.execute(
+                "SELECT table_name FROM gpkg_contents "
+                "WHERE data_type = 'features' ORDER BY table_name"
+            ).fetchone()[0]
+        geometry = connection.execute(
+            "SELECT column_name FROM gpkg_geometry_columns WHERE table_name = ?",
+            (table,),
+        ).fetchone()[0]
+        df = pd.read_sql_query(f'SELECT * FROM "{table}"', connection)
+    finally:
+        connection.close()
+    df[geometry] = [gpkg_coordinates(blob) for blob in df[geometry]]
+    return df.rename(columns={geometry: "SHAPE"})
+
+
+def point_segment_distances(x, y, x1, y1, x2, y2):
+    """
+    Distances from points to segments, element-wise or broadcast
+    """
+    dx, dy = x2 - x1, y2 - y1
+    length2 = dx * dx + dy * dy
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = ((x - x1) * dx + (y - y1) * dy) / length2
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    return np.hypot(x - x1 - t * dx, y - y1 - t * dy)
+
+
+def reach_segments(reach_lines):
+    """
+    Segment end points of the lines of several reach layers and the
+    number of the reach layer of each segment
+    """
+    starts, ends, owners = [], [], []
+    for n, lines in enumerate(reach_lines):
+        for line in lines:
+            if not len(line):
+                continue
+            # A single vertex is a segment of no length
+            start = line[:-1] if len(line) > 1 else line
+            starts.append(start)
+            ends.append(line[1:] if len(line) > 1 else line)
+            owners.append(np.full(len(start), n))
+    if not starts:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0, dtype=int)
+    return np.concatenate(starts), np.concatenate(ends), np.concatenate(owners)
+
+
+def reach_membership(x, y, reach_lines, distance=SEARCH_DISTANCE):
+    """
+    Boolean matrix of the points within distance of the lines of each reach
+    layer (one column each), like an intersect selection with a search
+    distance. The segments of all reaches are put in a grid of cells so
+    that every point is only tested against the segments near it
+    """
+    membership = np.zeros((len(x), len(reach_lines)), dtype=bool)
+    starts, ends, owners = reach_segments(reach_lines)
+    if not len(owners) or not len(x):
+        return membership
+    x1, y1, x2, y2 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+
+    # Cells about as long as a segment, and not smaller than the distance
+    lengths = np.hypot(x2 - x1, y2 - y1)
+    cell = max(np.median(lengths), 2 * distance)
+
+    # Split the segments longer than a cell into pieces no longer than one,
+    # so a long diagonal segment only touches the cells along it rather
+    # than every cell of its box
+    pieces = np.maximum(np.ceil(lengths / cell), 1).astype(np.int64)
+    if (pieces > 1).any():
+        piece = np.repeat(np.arange(len(owners)), pieces)
+        step = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces,
+                                                   pieces)
+        t1, t2 = step / pieces[piece], (step + 1) / pieces[piece]
+        dx, dy = (x2 - x1)[piece], (y2 - y1)[piece]
+        x1, y1 = x1[piece], y1[piece]
+        x1, y1, x2, y2 = x1 + t1 * dx, y1 + t1 * dy, x1 + t2 * dx, y1 + t2 * dy
+        owners = owners[piece]
+    ix0 = np.floor((np.minimum(x1, x2) - distance) / cell).astype(np.int64)
+    ix1 = np.floor((np.maximum(x1, x2) + distance) / cell).astype(np.int64)
+    iy0 = np.floor((np.minimum(y1, y2) - distance) / cell).astype(np.int64)
+    iy1 = np.floor((np.maximum(y1, y2) + distance) / cell).astype(np.int64)
+    nx, ny = ix1 - ix0 + 1, iy1 - iy0 + 1
+    x_min, y_min = ix0.min(), iy0.min()
+    height = iy1.max() - y_min + 1
+
+    # One (cell, segment) pair for every cell a segment's box touches
+    counts = nx * ny
+    segment = np.repeat(np.arange(len(owners)), counts)
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                 counts)
+    cx = ix0[segment] + within % nx[segment]
+    cy = iy0[segment] + within // nx[segment]
+    keys = (cx - x_min) * height + cy - y_min
+    order = np.argsort(keys, kind="stable")
+    keys, segment = keys[order], segment[order]
+
+    # Segments in the cell of every point
+    points = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    px = np.floor(x[points] / cell).astype(np.int64) - x_min
+    py = np.floor(y[points] / cell).astype(np.int64) - y_min
+    inside = (px >= 0) & (px <= ix1.max() - x_min) & (py >= 0) & (py < height)
+    points, point_keys = points[inside], px[inside] * height + py[inside]
+    first = np.searchsorted(keys, point_keys, "left")
+    found = np.searchsorted(keys, point_keys, "right") - first
+    point = np.repeat(points, found)
+    candidate = segment[np.repeat(first, found) + np.arange(found.sum())
+                        - np.repeat(np.cumsum(found) - found, found)]
+
+    near = point_segment_distances(x[point], y[point], x1[candidate],
+                                   y1[candidate], x2[candidate],
+                                   y2[candidate]) <= distance
+    membership[point[near], owners[candidate[near]]] = True
+    return membership
+
+
+class DataSource:
+    """
+    Base of the data sources. Subclasses read the plot output points and
+    the reach lines of layers, in the same projected coordinates (metres)
+    """
+
+    def __init__(self):
+        self.reach_lines = {}
+
+    def read_points(self, out_layer):
+        """
+        Plot outputs of a layer, COLUMNS plus X and Y
+        """
+        raise NotImplementedError
+
+    def read_lines(self, reach_layer):
+        """
+        Vertices, as (n, 2) arrays, of each line of a reach layer
+        """
+        raise NotImplementedError
+
+    def figure_folder(self):
+        raise NotImplementedError
+
+    def lines(self, reach_layer):
+        """
+        Lines of a reach layer, read once
+        """
+        if reach_layer not in self.reach_lines:
+            self.reach_lines[reach_layer] = self.read_lines(reach_layer)
+        return self.reach_lines[reach_layer]
+
+    def read_outputs(self, out_layer, reach_layers):
+        """
+        Read a plot output layer once and split it by reach layer. Returns
+        the rows (COLUMNS only) within the search distance of each reach
+        layer
+        """
+        df = self.read_points(out_layer)
+        membership = reach_membership(
+            df["X"].to_numpy(dtype=float), df["Y"].to_numpy(dtype=float),
+            [self.lines(reach) for reach in reach_layers])
+        df = df[COLUMNS]
+        return {reach: df[membership[:, n]].copy()
+                for n, reach in enumerate(reach_layers)}
+
+    def read_output(self, out_layer, reach_layer):
+        """
+        Plot output rows of a layer on a reach layer, COLUMNS only
+        """
+        return self.read_outputs(out_layer, [reach_layer])[reach_layer]
+
+
+def arcpy_points(arcpy, layer, spatial_reference=None):
+    """
+    COLUMNS and X and Y of the points of a layer or feature class,
+    projected to spatial_reference if given
+    """
+    with arcpy.da.SearchCursor(layer, COLUMNS + ["SHAPE@X", "SHAPE@Y"],
+                               spatial_reference=spatial_reference) as cursor:
+        return pd.DataFrame(list(cursor), columns=COLUMNS + ["X", "Y"])
+
+
+def arcpy_lines(arcpy, layer, spatial_reference=None):
+    """
+    Vertices of each part of the lines of a layer or feature class,
+    projected to spatial_reference if given
+    """
+    lines = []
+    with arcpy.da.SearchCursor(layer, ["SHAPE@"],
+                               spatial_reference=spatial_reference) as cursor:
+        for (shape,) in cursor:
+            if shape is None:
+                continue
+            for part in shape:
+                lines.append(np.array([(point.X, point.Y) for point in part
+                                       if point], dtype=float).reshape(-1, 2))
+    return lines
+
+
+def common_reference(arcpy, spatial_reference, layer):
+    """
+    Spatial reference to read every layer in: the one given, or else that
+    of the layer. It must be projected, as SEARCH_DISTANCE is in its units
+    """
+    if spatial_reference is None:
+        spatial_reference = arcpy.Describe(layer).spatialReference
+    if spatial_reference.type != "Projected":
+        raise ValueError(
+            f"Layer '{layer}' is read in {spatial_reference.name}, which is "
+            f"not a projected spatial reference: the {SEARCH_DISTANCE} search "
+            f"distance would not be in metres. Give a projected "
+            f"spatial_reference, e.g. British National Grid"
+        )
+    return spatial_reference
+
+
+class ArcpySource(DataSource):
+    """
+    Plot outputs and reaches read from ArcGIS Pro layers with arcpy. All
+    the layers are read in spatial_reference, by default the one of the
+    first layer read, so points and lines are compared in the same
+    coordinates whatever the layers are stored in
+    """
+
+    def __init__(self, arcpy_module=None, spatial_reference=None):
+        super().__init__()
+        # A stand-in module can be given to test without ArcGIS
+        self.arcpy = arcpy_module or import_arcpy()
+        self.spatial_reference = spatial_reference
+
+    def reference(self, layer):
+        self.spatial_reference = common_reference(
+            self.arcpy, self.spatial_reference, layer)
+        return self.spatial_reference
+
+    def read_points(self, out_layer):
+        # All the points of the layer, whatever was selected before
+        self.arcpy.management.SelectLayerByAttribute(out_layer,
+                                                     "CLEAR_SELECTION")
+        return arcpy_points(self.arcpy, out_layer, self.reference(out_layer))
+
+    def read_lines(self, reach_layer):
+        return arcpy_lines(self.arcpy, reach_layer,
+                           self.reference(reach_layer))
+
+    def figure_folder(self):
+        """
+        Figures folder of the current ArcGIS Pro project
+        """
+        project = self.arcpy.mp.ArcGISProject("CURRENT")
+        return os.path.join(project.homeFolder, "Figures")
+
+
+class SnapshotSource(DataSource):
+    """
+    Plot outputs and reaches read from snapshot files, without arcpy
+    """
+
+    def __init__(self, folder, fig_folder=None):
+        super().__init__()
+        self.folder = folder
+        self.fig_folder = fig_folder or os.path.join(folder, "Figures")
+
+    def layer_path(self, kind, layer):
+        """
+        Path of the snapshot file of a layer, kind being "outputs" or
+        "reaches"
+        """
+        for fmt in SNAPSHOT_FORMATS:
+            path = os.path.join(self.folder, kind, f"{layer}.{fmt}")
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError(
+            f"No snapshot of {kind} layer '{layer}' in {self.folder}")
+
+    def read_layer(self, kind, layer, columns=None):
+        """
+        Read a snapshot file as a DataFrame. GeoPackage geometries are
+        decoded into X and Y columns (PART too for reaches)
+        """
+        path = self.layer_path(kind, layer)
+        if path.endswith(".parquet"):
+            return pd.read_parquet(path, columns=columns)
+        if path.endswith(".csv"):
+            return pd.read_csv(path, usecols=columns)
+
+        df = read_geopackage(path)
+        if kind == "reaches":
+            parts = [part for shape in df["SHAPE"] for part in shape]
+            vertices = np.concatenate(parts) if parts else np.zeros((0, 2))
+            return pd.DataFrame({
+                "PART": np.repeat(np.arange(len(parts)),
+                                  [len(part) for part in parts]),
+                "X": vertices[:, 0],
+                "Y": vertices[:, 1],
+            })
+        points = np.array([shape[0][0] if shape else (np.nan, np.nan)
+                           for shape in df["SHAPE"]]).reshape(-1, 2)
+        df["X"], df["Y"] = points[:, 0], points[:, 1]
+        return df[columns] if columns else df
+
+    def read_points(self, out_layer):
+        return self.read_layer("outputs", out_layer, COLUMNS + ["X", "Y"])
+
+    def read_lines(self, reach_layer):
+        df = self.read_layer("reaches", reach_layer, ["PART", "X", "Y"])
+        return [part[["X", "Y"]].to_numpy(dtype=float)
+                for _, part in df.groupby("PART", sort=False)]
+
+    def figure_folder(self):
+        return self.fig_folder
+
+
+def export_snapshot(out_layers, reach_layers, folder, fmt="parquet",
+                    arcpy_module=None, spatial_reference=None):
+    """
+    Export plot output and reach layers from ArcGIS Pro to a snapshot
+    folder, fmt being "parquet" or "csv". The layers are read like
+    ArcpySource reads them, so charts of the snapshot match charts made in
+    ArcGIS: definition queries are honoured, output layer selections are
+    cleared, and all layers are read in spatial_reference (by default the
+    one of the first plot output layer)
+    """
+    source = ArcpySource(arcpy_module, spatial_reference)
+    for kind in ("outputs", "reaches"):
+        os.makedirs(os.path.join(folder, kind), exist_ok=True)
+
+    for layer in out_layers:
+        df = source.read_points(layer)
+        write_snapshot_file(df, os.path.join(folder, "outputs", f"{layer}.{fmt}"))
+
+    for layer in reach_layers:
+        lines = source.read_lines(layer)
+        vertices = np.concatenate(lines) if lines else np.zeros((0, 2))
+        df = pd.DataFrame({
+            "PART": np.repeat(np.arange(len(lines)),
+                              [len(line) for line in lines]),
+            "X": vertices[:, 0],
+            "Y": vertices[:, 1],
+        })
+        write_snapshot_file(df, os.path.join(folder, "reaches", f"{layer}.{fmt}"))
+
+
+def write_snapshot_file(df, path):
+    if path.endswith(".parquet"):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def open_source(snapshot=None, fig_folder=None):
+    """
+    Snapshot source if a snapshot folder is given, ArcGIS Pro otherwise
+    """
+    if snapshot:
+        return SnapshotSource(snapshot, fig_folder)
+    return ArcpySource()
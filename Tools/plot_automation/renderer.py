@@ -0,0 +1,368 @@
+"""
+Reentrant chainage chart renderer
+
+Charts are built as matplotlib Figure objects without pyplot: no module
+global, rcParams or pyplot figure is changed, so charts can be rendered
+concurrently from a thread pool. The apportionment sectors and colours
+come from a style profile chosen by determinand (reach diffuse instead of
+the diffuse sectors for Ammonia, BOD and DO), and the ggplot look the tool
+always had is applied to each figure. Figures are returned as objects,
+PNG/SVG bytes or written to any file-like buffer, e.g. a report or an HTTP
+response.
+
+Example:
+    png = render_chart(df1, None, "BaselineGIS1TP", None, params)
+    with ThreadPoolExecutor() as pool:
+        images = list(pool.map(lambda df: render_chart(df, None, out, None,
+                                                       params), slices))
+"""
+
+import io
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Sectors of the apportionment charts and their legend names
+APPORTIONMENT_COLS = {
+    "SWConc": "Sewage",
+    "IMConc": "Intermittent",
+    "INConc": "Industry",
+    "MIConc": "Mines",
+    "LSConc": "Livestock",
+    "ARConc": "Arable",
+    "HWConc": "Highways",
+    "URConc": "Urban",
+    "ATConc": "Atmospheric",
+    "BGConc": "Background",
+    "STConc": "Septic tanks",
+    "LKConc": "Lakes",
+}
+
+APPORTIONMENT_COLORS = [
+    "0.1",
+    "0.5",
+    "r",
+    "b",
+    "yellowgreen",
+    "yellow",
+    "g",
+    "purple",
+    "olive",
+    "pink",
+    "gold",
+    "orange",
+    "lightsteelblue"
+]
+
+# Determinands with reach diffuse rather than diffuse sector sources
+REACH_DIFFUSE_DETERMINANDS = ("Ammonia", "BOD", "DO_9924")
+
+# Axes look of the ggplot matplotlib style
+AXES_STYLE = {
+    "facecolor": "#E5E5E5",
+    "edgecolor": "white",
+    "grid_color": "white",
+    "text_color": "#555555",
+    "label_size": "large",
+}
+
+# Apportionment sectors and colours, and axes look, of each profile
+STYLE_PROFILES = {
+    "default": {
+        "apportionment_cols": APPORTIONMENT_COLS,
+        "colors": APPORTIONMENT_COLORS,
+        "axes": AXES_STYLE,
+    },
+    "reach_diffuse": {
+        "apportionment_cols": {
+            "SWConc": "Sewage",
+            "IMConc": "Intermittent",
+            "INConc": "Industry",
+            "MIConc": "Mines",
+            "DiffConc": "Reach Diffuse",
+        },
+        "colors": [
+            "0.1",
+            "0.5",
+            "r",
+            "b",
+            "lightsteelblue"
+        ],
+        "axes": AXES_STYLE,
+    },
+}
+
+# Target lines and their colours
+TARGETS = {
+    "TargetPoor": "r",
+    "TargetMod": "orange",
+    "TargetGood": "g",
+    "TargetHigh": "b",
+}
+
+CALIBRATION_LABELS = [
+    "Sim. Mean",
+    "Sim. Mean UCL",
+    "Sim. Mean LCL",
+    "Obs. Mean",
+    "Obs. Mean UCL",
+    "Obs. Mean LCL",
+]
+
+
+def style_profile(determinand):
+    """
+    Style profile of the charts of a determinand
+    """
+    if determinand in REACH_DIFFUSE_DETERMINANDS:
+        return STYLE_PROFILES["reach_diffuse"]
+    return STYLE_PROFILES["default"]
+
+
+def chart_options(params):
+    """
+    Chart options from the tool parameters (text, as ArcGIS Pro passes
+    them)
+    """
+    annotate_features = params["annotate_features"]
+    if annotate_features:
+        annotate_features = [s.replace("'", "") for s in
+                             annotate_features.split(';')]
+    custom_annotations = params["custom_annotations"]
+    if custom_annotations:
+        custom_annotations = {
+                ' '.join(e.split(' ')[:-1]): float(e.split(' ')[-1])
+                for e in custom_annotations.split(';')
+                }
+    return {
+        "calibration": params["calibration_flag"] == 'true',
+        "targets": params["target_flag"] == 'true',
+        "annotate": params["annotate_flag"] == 'true',
+        "annotate_filter": float(params["annotate_filter"]),
+        "annotate_features": annotate_features,
+        "custom_annotations": custom_annotations,
+        "figure_size": float(params["figure_size"]),
+        "aspect_ratio_modifier": float(params["aspect_ratio_modifier"]),
+        "legend_loc": params["legend_loc"],
+    }
+
+
+def prepare_output(df, headwater_flag):
+    """
+    Sort the plot outputs of a river and index them by chainage distance
+    """
+    # Sort per reach ascending
+    df = df.sort_values(["ReachNo", "OBJECTID"])
+    # Calculate cummulative distance
+    df["DISTANCE"] = df["DISPOINTKM"].cumsum()
+    # Calculate diff in concentration
+    df["DIFF_CONC"] = df["MeanConc"].diff().fillna(0)
+    # Set distance as index for x axis
+    df.set_index("DISTANCE", inplace=True)
+    # Remove first point next to headwater
+    if headwater_flag == 'true':
+        df = df[1:].copy()
+    # Get rid of 0s in Observed concentrations
+    obs_cols = ["ObsConc", "ObsConcLCL", "ObsConcUCL"]
+    df[obs_cols] = df[obs_cols].replace(0, np.nan)
+    return df
+
+
+def layer_names(out1, out2):
+    """
+    Determinand and scenarios of plot output layers named
+    <scenario>GIS1<determinand>
+    """
+    determinand = out1.split("GIS1")[1]
+    scenarios = [out1.split("GIS1")[0]]
+    if out2:
+        scenarios.append(out2.split("GIS1")[0])
+    return determinand, scenarios
+
+
+def figure_name(out1, out2, df1):
+    """
+    Name of a chart, without extension, from its prepared plot outputs
+    """
+    determinand, scenarios = layer_names(out1, out2)
+    return (f"{determinand}_{'_'.join(scenarios)}_"
+            f"{df1.ReachNo.min()}_{df1.ReachNo.max()}")
+
+
+def style_axes(axis, style):
+    """
+    Apply the axes look of a style profile
+    """
+    axis.set_facecolor(style["facecolor"])
+    axis.set_axisbelow(True)
+    axis.grid(True, color=style["grid_color"], linestyle="-")
+    for spine in axis.spines.values():
+        spine.set_edgecolor(style["edgecolor"])
+    axis.tick_params(colors=style["text_color"], direction="out")
+
+
+def plot_apportionment(axis, df, profile, targets):
+    """
+    Stacked source apportionment of a scenario, with the targets if needed
+    """
+    sectors = profile["apportionment_cols"]
+    values = df[list(sectors)].to_numpy(dtype=float)
+    axis.stackplot(df.index, np.nan_to_num(values).T,
+                   labels=list(sectors.values()), colors=profile["colors"],
+                   lw=0)
+    if targets:
+        for column, color in TARGETS.items():
+            axis.plot(df.index, df[column], c=color, ls="--", alpha=0.5,
+                      label=column)
+
+
+def annotate_discharges(axis, df, annotate_filter, annotate_features):
+    """
+    Label the features raising the concentration more than the filter, and
+    any named features
+    """
+    # Apply filter
+    mask = (df["DIFF_CONC"] > annotate_filter) & (df.US_DS_Feat == "d-s")
+
+    # Bespoke features to plot if input is not empty
+    if annotate_features:
+        mask = mask | df["FeatName"].isin(annotate_features)
+
+    # Draw labels
+    max_conc = axis.get_ylim()[1]
+    for count, (dis, row) in enumerate(df[mask].iterrows()):
+        axis.annotate(
+            row.FeatName,
+            xy=(dis, row.MeanConc),
+            xycoords="data",
+            xytext=(dis,
+                    max_conc - 0.15 * max_conc * (count)),
+            textcoords="data",
+            va="top",
+            ha="center",
+            arrowprops=dict(arrowstyle="->", connectionstyle="arc3", color="k"),
+            bbox=dict(boxstyle="square, pad=0.3", fc="1", ec="0.5", lw=1, alpha=0.5),
+        )
+
+
+def chart_figure(df1, df2, out1, out2, params):
+    """
+    Build the chainage chart of the plot outputs of a river (df1, and df2
+    to compare with) as a Figure labelled with the chart name. The data
+    frames are not modified
+    """
+    options = chart_options(params)
+    headwater_flag = params["headwater_flag"]
+    df1 = prepare_output(df1, headwater_flag)
+    if out2:
+        df2 = prepare_output(df2, headwater_flag)
+    determinand, scenarios = layer_names(out1, out2)
+    profile = style_profile(determinand)
+    style = profile["axes"]
+
+    # Get number of plots needed
+    num_plots = 1 + options["calibration"] + bool(out2)
+    fig_size = options["figure_size"]
+    fig = Figure(figsize=(
+            fig_size,  # width
+            options["aspect_ratio_modifier"] * fig_size / (1.618 * 2 / num_plots)  # height
+            ))
+    fig.set_label(figure_name(out1, out2, df1))
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows=num_plots, ncols=1, sharex=True, sharey=True,
+                        squeeze=False)[:, 0]
+    for axis in axes:
+        style_axes(axis, style)
+
+    # Calibration plot
+    if options["calibration"]:
+        # Simulated data
+        axes[0].plot(df1.index, df1.MeanConc, c="k")
+        axes[0].plot(df1.index, df1.UCLimMnCon, c="k", ls="--", alpha=0.75)
+        axes[0].plot(df1.index, df1.LCLimMnCon, c="k", ls="--", alpha=0.75)
+        # Observed data
+        axes[0].plot(df1.index, df1.ObsConc, c="b", marker="o")
+        axes[0].plot(df1.index, df1.ObsConcUCL, c="b", marker=".")
+        axes[0].plot(df1.index, df1.ObsConcLCL, c="b", marker=".")
+
+    # Apportionment plots
+    ax = int(options["calibration"])
+    plot_apportionment(axes[ax], df1, profile, options["targets"])
+    if out2:
+        plot_apportionment(axes[ax + 1], df2, profile, options["targets"])
+
+    # Compose title
+    title_text = f"{determinand} "
+    if options["calibration"]:
+        title_text += "calibration (top) and "
+    title_text += f"source apportionment for scenario {scenarios[0]} "
+    if out2:
+        title_text += f"(middle) and {scenarios[1]} (bottom) "
+    title_text += f"\n for reaches {df1.ReachNo.min()} to {df1.ReachNo.max()}"
+    fig.suptitle(title_text, size=12, ha="center", y=0.98)
+
+    # Make sure axis starts at 0, data fills the x axis
+    for axis in axes:
+        axis.set_ylim(bottom=0)
+        axis.margins(x=0)
+        axis.set_ylabel("Concentration (mg/L)", color=style["text_color"],
+                        size=style["label_size"])
+    axes[-1].set_xlabel("Distance (km)", color=style["text_color"],
+                        size=style["label_size"])
+
+    # Activate legend
+    if options["calibration"]:
+        axes[0].legend(labels=CALIBRATION_LABELS)
+    for axis in axes[ax:]:
+        axis.legend(ncol=2, loc=options["legend_loc"])
+
+    # Annotations
+    if options["annotate"]:
+        annotate_discharges(axes[ax], df1, options["annotate_filter"],
+                            options["annotate_features"])
+        if out2:
+            annotate_discharges(axes[ax + 1], df2, options["annotate_filter"],
+                                options["annotate_features"])
+
+    # Custom annotations
+    custom_annotations = options["custom_annotations"]
+    if custom_annotations:
+        max_conc = axes[ax].get_ylim()[1]
+        for label, dis in custom_annotations.items():
+            for axis in axes[ax:]:
+                axis.axvline(dis, ls='--', color='grey')
+                axis.annotate(
+                    label.replace("'", ""),
+                    xy=(dis, max_conc),
+                    xycoords="data",
+                    xytext=(dis,
+                            max_conc - 0.05 * max_conc),
+                    textcoords="data",
+                    va="top",
+                    ha="right",
+                    rotation="vertical",
+                    color='grey'
+                    )
+
+    # Make everything tidy
+    fig.tight_layout()
+    return fig
+
+
+def write_chart(buffer, df1, df2, out1, out2, params, fmt="png", dpi=None):
+    """
+    Render a chart into a file path or file-like buffer, fmt being any
+    format matplotlib writes, e.g. "png" or "svg"
+    """
+    fig = chart_figure(df1, df2, out1, out2, params)
+    fig.savefig(buffer, format=fmt, dpi=dpi)
+
+
+def render_chart(df1, df2, out1, out2, params, fmt="png", dpi=None):
+    """
+    Render a chart as bytes
+    """
+    buffer = io.BytesIO()
+    write_chart(buffer, df1, df2, out1, out2, params, fmt, dpi)
+    return buffer.getvalue()
@@ -0,0 +1,144 @@
+"""
+Shared fixtures of the chainage plots tool tests
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chainage_plots_tool import DEFAULT_PARAMS  # noqa: E402
+from utilities import COLUMNS  # noqa: E402
+
+OUT_LAYERS = ("BaseGIS1TP", "BaseGIS1Ammonia")
+REACH_LAYERS = {
+    "RiverA": [np.array([(0.0, 0.0), (500.0, 0.0), (1000.0, 0.0)])],
+    "RiverB": [np.array([(0.0, 1000.0), (1000.0, 1000.0)]),
+               np.array([(1000.0, 1000.0), (1000.0, 1500.0)])],
+}
+
+
+def plot_outputs(rng):
+    """
+    Plot output points along both rivers and a third line they miss
+    """
+    rows = []
+    for reach_no, (y, spread) in enumerate(((0.0, 1.5), (1000.0, 1.5),
+                                            (500.0, 1.5), (0.0, 10.0)), 1):
+        for i in range(40):
+            row = dict.fromkeys(COLUMNS, 0.0)
+            row.update(OBJECTID=len(rows) + 1, ReachNo=reach_no,
+                       FeatName=f"F{len(rows) + 1}", US_DS_Feat="d-s",
+                       MeanConc=rng.uniform(0, 2),
+                       X=i * 25 + rng.uniform(-1, 1),
+                       Y=y + rng.uniform(-spread, spread))
+            rows.append(row)
+    return pd.DataFrame(rows)[COLUMNS + ["X", "Y"]]
+
+
+@pytest.fixture
+def layers():
+    """
+    Plot output points of each output layer and lines of each reach layer
+    """
+    rng = np.random.default_rng(0)
+    return ({layer: plot_outputs(rng) for layer in OUT_LAYERS},
+            dict(REACH_LAYERS))
+
+
+@pytest.fixture
+def snapshot(tmp_path, layers):
+    """
+    Snapshot folder of the layers, in csv
+    """
+    outputs, reaches = layers
+    for kind in ("outputs", "reaches"):
+        (tmp_path / kind).mkdir()
+    for layer, df in outputs.items():
+        df.to_csv(tmp_path / "outputs" / f"{layer}.csv", index=False)
+    for layer, lines in reaches.items():
+        pd.DataFrame({
+            "PART": np.repeat(np.arange(len(lines)),
+                              [len(line) for line in lines]),
+            "X": np.concatenate(lines)[:, 0],
+            "Y": np.concatenate(lines)[:, 1],
+        }).to_csv(tmp_path / "reaches" / f"{layer}.csv", index=False)
+    return str(tmp_path)
+
+
+def tool_params(**params):
+    """
+    Parameters of the tool charting every output layer on every river.
+    Only the biggest rises in concentration are annotated, so there are few
+    labels to lay out
+    """
+    return dict(DEFAULT_PARAMS, outputs_list_1=";".join(OUT_LAYERS),
+                reaches_list=";".join(REACH_LAYERS), annotate_filter="1.2",
+                **params)
+
+
+def spatial_reference(name, type="Projected"):
+    return SimpleNamespace(name=name, type=type)
+
+
+class StandInArcpy:
+    """
+    The parts of arcpy the data sources use, serving the layers from
+    memory. The projected spatial reference of each layer is named after it
+    ("SR:<layer>"), or geographic for the layers in geographic. Every
+    cursor records the layer and spatial reference it was asked for
+    """
+
+    def __init__(self, outputs, reaches):
+        self.outputs = outputs
+        self.reaches = reaches
+        self.geographic = set()
+        self.cursors = []
+        self.management = SimpleNamespace(
+            SelectLayerByAttribute=lambda *args: None)
+        self.da = SimpleNamespace(SearchCursor=self.search_cursor)
+        self.mp = SimpleNamespace(ArcGISProject=lambda name: SimpleNamespace(
+            homeFolder="project"))
+
+    def Describe(self, layer):
+        return SimpleNamespace(
+            catalogPath=f"catalog/{layer}",
+            spatialReference=spatial_reference(
+                f"SR:{layer}",
+                "Geographic" if layer in self.geographic else "Projected"))
+
+    def search_cursor(self, layer, fields, spatial_reference=None):
+        self.cursors.append((layer, spatial_reference.name))
+        if fields == ["SHAPE@"]:
+            rows = [([[SimpleNamespace(X=x, Y=y) for x, y in line.tolist()]],)
+                    for line in self.reaches[layer]]
+        else:
+            df = self.outputs[layer]
+            rows = list(df[fields[:-2] + ["X", "Y"]].itertuples(
+                index=False, name=None))
+        return StandInCursor(rows)
+
+
+class StandInCursor:
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return iter(self.rows)
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def arcpy(layers):
+    """
+    Stand-in arcpy module serving the layers
+    """
+    return StandInArcpy(*layers)
@@ -0,0 +1,62 @@
+"""
+Tests of the parallel batch rendering of chainage charts
+"""
+
+import os
+from collections import Counter
+
+from batch_render import batch_render
+from conftest import OUT_LAYERS, REACH_LAYERS, tool_params
+from data_sources import SnapshotSource
+
+
+class CountingSource(SnapshotSource):
+    """
+    Snapshot source counting the reads of each output layer
+    """
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.reads = Counter()
+
+    def read_outputs(self, out_layer, reach_layers):
+        self.reads[out_layer] += 1
+        return super().read_outputs(out_layer, reach_layers)
+
+
+class BrokenSource(SnapshotSource):
+    """
+    Snapshot source losing the mean concentrations of the first output
+    layer on the first river
+    """
+
+    def read_outputs(self, out_layer, reach_layers):
+        outputs = super().read_outputs(out_layer, reach_layers)
+        if out_layer == OUT_LAYERS[0]:
+            outputs[reach_layers[0]] = outputs[reach_layers[0]].drop(
+                columns="MeanConc")
+        return outputs
+
+
+def test_a_broken_chart_does_not_stop_the_batch(snapshot):
+    source = BrokenSource(snapshot)
+    summary = batch_render(tool_params(), source, workers=2)
+
+    broken = f"{OUT_LAYERS[0]} on {list(REACH_LAYERS)[0]}"
+    assert summary["failed"] == 1
+    assert list(summary["errors"]) == [broken]
+    assert "MeanConc" in summary["errors"][broken]
+    assert summary["rendered"] == len(OUT_LAYERS) * len(REACH_LAYERS) - 1
+    assert sorted(os.listdir(source.figure_folder())) == sorted(
+        os.path.basename(path) for path in summary["figures"])
+
+
+def test_each_output_layer_is_read_once(snapshot):
+    # Every layer is in two comparisons, as the first and second output
+    source = CountingSource(snapshot)
+    params = tool_params(outputs_list_2=";".join(reversed(OUT_LAYERS)))
+    summary = batch_render(params, source, workers=2)
+
+    assert summary["failed"] == 0
+    assert summary["rendered"] == len(OUT_LAYERS) * len(REACH_LAYERS)
+    assert source.reads == Counter(OUT_LAYERS)
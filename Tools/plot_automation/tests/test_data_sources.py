@@ -0,0 +1,100 @@
+"""
+Tests of the data sources of the chainage plots tool
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import OUT_LAYERS, REACH_LAYERS, spatial_reference
+from data_sources import (ArcpySource, SnapshotSource, export_snapshot,
+                          point_segment_distances, reach_membership,
+                          reach_segments)
+
+
+def brute_force_membership(x, y, reach_lines, distance):
+    starts, ends, owners = reach_segments(reach_lines)
+    near = point_segment_distances(
+        x[:, None], y[:, None], starts[:, 0], starts[:, 1], ends[:, 0],
+        ends[:, 1]) <= distance
+    return np.stack([near[:, owners == n].any(axis=1)
+                     for n in range(len(reach_lines))], axis=1)
+
+
+def test_membership_of_long_diagonal_segments():
+    # 10 m segments set the cell size, so the box of the 100 km diagonal
+    # spans 10^8 cells
+    rng = np.random.default_rng(1)
+    short = np.cumsum(np.full((500, 2), 7.0), axis=0)
+    diagonal = np.array([(0.0, 50.0), (100000.0, 100050.0)])
+    reach_lines = [[short], [diagonal]]
+    t = rng.uniform(0, 100000, 2000)
+    x = np.concatenate([t, rng.uniform(0, 3500, 500)])
+    y = np.concatenate([t + 50 + rng.uniform(-4, 4, 2000),
+                        rng.uniform(0, 3500, 500)])
+
+    membership = reach_membership(x, y, reach_lines, 2.0)
+    np.testing.assert_array_equal(
+        membership, brute_force_membership(x, y, reach_lines, 2.0))
+    assert membership[:, 1].any()
+
+
+def assert_same_outputs(left, right):
+    assert list(left) == list(right)
+    for reach in left:
+        pd.testing.assert_frame_equal(left[reach].reset_index(drop=True),
+                                      right[reach].reset_index(drop=True))
+
+
+def test_arcpy_source_matches_snapshot(arcpy, snapshot):
+    arcpy_source = ArcpySource(arcpy)
+    snapshot_source = SnapshotSource(snapshot)
+    for layer in OUT_LAYERS:
+        outputs = arcpy_source.read_outputs(layer, list(REACH_LAYERS))
+        assert_same_outputs(
+            outputs, snapshot_source.read_outputs(layer, list(REACH_LAYERS)))
+        # Reach 4 points scatter 10 m around river A, only some are near
+        assert (outputs["RiverA"].ReachNo == 1).sum() == 40
+        assert set(outputs["RiverA"].ReachNo) == {1, 4}
+        assert (outputs["RiverB"].ReachNo == 2).all()
+        assert len(outputs["RiverB"]) == 40
+
+
+def test_arcpy_layers_read_in_one_spatial_reference(arcpy):
+    source = ArcpySource(arcpy)
+    for layer in OUT_LAYERS:
+        source.read_outputs(layer, list(REACH_LAYERS))
+    assert len(arcpy.cursors) == len(OUT_LAYERS) + len(REACH_LAYERS)
+    assert {reference for _, reference in arcpy.cursors} == {
+        f"SR:{OUT_LAYERS[0]}"}
+
+    arcpy.cursors.clear()
+    ArcpySource(arcpy, spatial_reference("SR:BNG")).read_outputs(
+        OUT_LAYERS[1], ["RiverA"])
+    assert {reference for _, reference in arcpy.cursors} == {"SR:BNG"}
+
+
+def test_export_snapshot(arcpy, snapshot, tmp_path):
+    folder = str(tmp_path / "exported")
+    export_snapshot(OUT_LAYERS, list(REACH_LAYERS), folder, fmt="csv",
+                    arcpy_module=arcpy)
+    # Read through the layers, not their feature classes, so definition
+    # queries apply like in ArcpySource
+    assert arcpy.cursors == [(layer, f"SR:{OUT_LAYERS[0]}")
+                             for layer in OUT_LAYERS + tuple(REACH_LAYERS)]
+    for layer in OUT_LAYERS:
+        assert_same_outputs(
+            SnapshotSource(folder).read_outputs(layer, list(REACH_LAYERS)),
+            SnapshotSource(snapshot).read_outputs(layer, list(REACH_LAYERS)))
+
+
+def test_geographic_layers_are_rejected(arcpy, tmp_path):
+    arcpy.geographic.add(OUT_LAYERS[0])
+    with pytest.raises(ValueError, match="not a projected"):
+        ArcpySource(arcpy).read_outputs(OUT_LAYERS[0], list(REACH_LAYERS))
+    with pytest.raises(ValueError, match="not a projected"):
+        export_snapshot(OUT_LAYERS, list(REACH_LAYERS), str(tmp_path),
+                        arcpy_module=arcpy)
+    with pytest.raises(ValueError, match="not a projected"):
+        ArcpySource(arcpy, spatial_reference("WGS 1984", "Geographic")
+                    ).read_outputs(OUT_LAYERS[1], ["RiverA"])
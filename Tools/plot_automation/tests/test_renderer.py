@@ -0,0 +1,66 @@
+"""
+Tests of the reentrant chainage chart renderer
+"""
+
+import copy
+from concurrent.futures import ThreadPoolExecutor
+
+import matplotlib
+import pytest
+
+import renderer
+from conftest import OUT_LAYERS, REACH_LAYERS, tool_params
+from data_sources import SnapshotSource
+
+
+@pytest.fixture
+def charts(snapshot):
+    """
+    (out1, df1, params) of the chart of every output layer on every river
+    """
+    source = SnapshotSource(snapshot)
+    params = tool_params()
+    return [(out, df, params) for out in OUT_LAYERS
+            for df in source.read_outputs(out, list(REACH_LAYERS)).values()]
+
+
+def module_state():
+    return copy.deepcopy({name: value for name, value in vars(renderer).items()
+                          if name.isupper()})
+
+
+def legend_labels(figure):
+    return [text.get_text() for text in figure.axes[-1].get_legend().get_texts()]
+
+
+def test_threaded_rendering_matches_serial(charts):
+    rc_params = dict(matplotlib.rcParams)
+    state = module_state()
+
+    def render(chart):
+        out, df, params = chart
+        return renderer.render_chart(df, None, out, None, params)
+
+    serial = [render(chart) for chart in charts]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        threaded = list(pool.map(render, charts * 2))
+
+    assert threaded == serial * 2
+    assert len(set(serial)) == len(charts)
+    assert dict(matplotlib.rcParams) == rc_params
+    assert module_state() == state
+
+
+def test_style_profiles_follow_the_determinand(charts):
+    tp, tp_df, params = next(c for c in charts if c[0] == "BaseGIS1TP")
+    ammonia, ammonia_df, _ = next(c for c in charts
+                                  if c[0] == "BaseGIS1Ammonia")
+
+    tp_labels = legend_labels(renderer.chart_figure(tp_df, None, tp, None,
+                                                    params))
+    ammonia_labels = legend_labels(renderer.chart_figure(
+        ammonia_df, None, ammonia, None, params))
+
+    assert tp_labels != ammonia_labels
+    assert "Arable" in tp_labels and "Reach Diffuse" not in tp_labels
+    assert "Reach Diffuse" in ammonia_labels and "Arable" not in ammonia_labels